@@ -0,0 +1,49 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compiles a vocab.txt file into a memory-mappable binary vocabulary.
+
+By default the output is written next to the input, where
+`tokenization.load_vocab` (and so `FullTokenizer`) picks it up automatically
+for as long as it is newer than the text file.
+
+Example:
+  python compile_vocab.py --vocab_file=$BERT_BASE_DIR/vocab.txt
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+
+import tokenization
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--vocab_file", required=True,
+                      help="The vocab.txt file to compile.")
+  parser.add_argument("--output_file", default=None,
+                      help="Where to write the compiled vocabulary. Defaults "
+                      "to the vocab file path plus \".compiled\".")
+  args = parser.parse_args()
+
+  output_file = tokenization.compile_vocab(args.vocab_file, args.output_file)
+  vocab = tokenization.CompiledVocab(output_file)
+  print("Wrote %d tokens to %s" % (len(vocab), output_file))
+
+
+if __name__ == "__main__":
+  main()
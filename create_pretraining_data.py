@@ -18,9 +18,16 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import array
 import collections
+import hashlib
+import json
+import multiprocessing
+import os
 import random
+import shutil
 
+import numpy as np
 import tokenization
 import tensorflow as tf
 
@@ -61,91 +68,276 @@ flags.DEFINE_float(
     "Probability of creating sequences which are shorter than the "
     "maximum length.")
 
+flags.DEFINE_bool(
+    "dynamic_masking", False,
+    "Whether to write unmasked sequences without masked LM features, for "
+    "`run_pretraining.py --dynamic_masking` to mask with fresh masks in every "
+    "epoch. A `dupe_factor` of 1 is then usually enough.")
+
+flags.DEFINE_bool(
+    "vectorized_masking", False,
+    "Whether to choose the masked LM predictions with NumPy, for batches of "
+    "instances at a time, rather than one instance at a time in Python. The "
+    "masks follow the same distribution, but are not the same as without it "
+    "for a given `random_seed`.")
+
+flags.DEFINE_bool(
+    "compact_records", False,
+    "Whether to write the examples without padding and without the "
+    "`input_mask` and `masked_lm_weights` features, which only mark the "
+    "padding. This makes the output smaller and faster to parse, "
+    "especially with many short sequences. `run_pretraining.py` detects the "
+    "format and pads when it batches.")
+
+flags.DEFINE_integer(
+    "max_sequences_per_pack", 0,
+    "If > 0, instances are packed into examples of up to `max_seq_length` "
+    "tokens, with up to this many instances each, instead of padding every "
+    "instance to `max_seq_length`. Each packed instance keeps its own "
+    "positions, attention and next sentence label. The same value must be "
+    "passed to `run_pretraining.py`.")
+
+flags.DEFINE_bool(
+    "streaming", False,
+    "Whether to generate instances while reading the input instead of "
+    "reading all of it first. Memory use then stays within "
+    "`streaming_memory_mb` regardless of the corpus size and `dupe_factor`, "
+    "but random next sentences are drawn from a window of recent documents "
+    "rather than from the whole corpus, and instances are shuffled within a "
+    "buffer rather than globally.")
+
+flags.DEFINE_integer(
+    "streaming_memory_mb", 1024,
+    "Approximate ceiling, in MB, on the memory held in `streaming` mode (per "
+    "worker with `num_workers`). A quarter of it goes to the window of recent "
+    "documents that random next sentences are drawn from, the rest to the "
+    "buffer that instances are shuffled in before they are written. Larger "
+    "values give more varied random next sentences and a better shuffle.")
+
+flags.DEFINE_integer(
+    "num_workers", 0,
+    "If > 0, every input file becomes its own output shard, and the shards "
+    "are created by this many worker processes. `output_file` is then the "
+    "prefix of the shard files, and `<output_file>.manifest.json` lists them. "
+    "Each shard's random seed is derived from `random_seed` and the shard id, "
+    "so the output does not depend on the number of workers.")
+
+flags.DEFINE_string(
+    "document_store_dir", None,
+    "If set, a local directory that keeps the tokenized input as "
+    "memory-mapped arrays of token ids, under a fingerprint of the input "
+    "files, the vocabulary and `do_lower_case`. The first run on some input "
+    "writes its store, and later runs on the same input (e.g. with another "
+    "`max_seq_length`, `masked_lm_prob` or `dupe_factor`) read it instead of "
+    "tokenizing again.")
+
+flags.DEFINE_integer(
+    "shuffle_buckets", 0,
+    "If > 0, the examples of each output (or of each shard with "
+    "`num_workers`) are shuffled as a whole with a two-pass external shuffle "
+    "through this many temporary files, of which only one is held in memory "
+    "at a time. Pick it so that the output size divided by it fits in "
+    "memory. The instances are then not held in memory or shuffled there. "
+    "Without `streaming`, the tokenized input still is, while with "
+    "`streaming`, this replaces the shuffle buffer, so generating any amount "
+    "of data takes bounded memory.")
+
 
 class TrainingInstance(object):
-  """A single training instance (sentence pair)."""
+  """A single training instance (sentence pair).
+
+  There are often tens of millions of these in memory, so the tokens and
+  masked LM labels are kept as vocabulary ids, in `array.array`s: "i" for
+  `input_ids`, `masked_lm_positions` and `masked_lm_ids`, and "b" for
+  `segment_ids`.
+  """
+
+  __slots__ = ("input_ids", "segment_ids", "masked_lm_positions",
+               "masked_lm_ids", "is_random_next")
 
-  def __init__(self, tokens, segment_ids, masked_lm_positions, masked_lm_labels,
-               is_random_next):
-    self.tokens = tokens
+  def __init__(self, input_ids, segment_ids, masked_lm_positions,
+               masked_lm_ids, is_random_next):
+    self.input_ids = input_ids
     self.segment_ids = segment_ids
     self.is_random_next = is_random_next
     self.masked_lm_positions = masked_lm_positions
-    self.masked_lm_labels = masked_lm_labels
+    self.masked_lm_ids = masked_lm_ids
 
-  def __str__(self):
+  def to_string(self, tokenizer=None):
+    """Describes the instance, with tokens if a `tokenizer` is given."""
     s = ""
-    s += "tokens: %s\n" % (" ".join(
-        [tokenization.printable_text(x) for x in self.tokens]))
+    if tokenizer is None:
+      s += "input_ids: %s\n" % (" ".join([str(x) for x in self.input_ids]))
+    else:
+      s += "tokens: %s\n" % (" ".join([
+          tokenization.printable_text(x)
+          for x in tokenizer.convert_ids_to_tokens(self.input_ids)
+      ]))
     s += "segment_ids: %s\n" % (" ".join([str(x) for x in self.segment_ids]))
     s += "is_random_next: %s\n" % self.is_random_next
     s += "masked_lm_positions: %s\n" % (" ".join(
         [str(x) for x in self.masked_lm_positions]))
-    s += "masked_lm_labels: %s\n" % (" ".join(
-        [tokenization.printable_text(x) for x in self.masked_lm_labels]))
+    if tokenizer is None:
+      s += "masked_lm_ids: %s\n" % (" ".join(
+          [str(x) for x in self.masked_lm_ids]))
+    else:
+      s += "masked_lm_labels: %s\n" % (" ".join([
+          tokenization.printable_text(x)
+          for x in tokenizer.convert_ids_to_tokens(self.masked_lm_ids)
+      ]))
     s += "\n"
     return s
 
+  def __str__(self):
+    return self.to_string()
+
   def __repr__(self):
     return self.__str__()
 
 
+# The vocabulary ids that `TrainingInstance`s are built from: those of the
+# special tokens, and all ids to draw random replacement tokens from.
+InstanceVocab = collections.namedtuple(
+    "InstanceVocab", ["cls_id", "sep_id", "mask_id", "vocab_ids"])
+
+
+def create_instance_vocab(tokenizer):
+  """Returns the `InstanceVocab` of a `FullTokenizer`."""
+  vocab = tokenizer.vocab
+  return InstanceVocab(
+      cls_id=vocab["[CLS]"],
+      sep_id=vocab["[SEP]"],
+      mask_id=vocab["[MASK]"],
+      vocab_ids=list(vocab.values()))
+
+
 def write_instance_to_example_files(instances, tokenizer, max_seq_length,
-                                    max_predictions_per_seq, output_files):
-  """Create TF example files from `TrainingInstance`s."""
-  writers = []
-  for output_file in output_files:
-    writers.append(tf.python_io.TFRecordWriter(output_file))
+                                    max_predictions_per_seq, output_files,
+                                    dynamic_masking=False, compact=False,
+                                    max_sequences_per_pack=0,
+                                    shuffle_buckets=0, rng=None):
+  """Create TF example files from `TrainingInstance`s.
+
+  With `dynamic_masking`, the masked LM features are left out. With
+  `compact`, the features are not padded, and `input_mask`,
+  `masked_lm_weights` and `next_sentence_weights` (which only mark the
+  padding) are left out; `run_pretraining.input_fn_builder` adds them back
+  when it batches.
+
+  With `max_sequences_per_pack`, every element of `instances` is instead a
+  list of instances (as made by `pack_instances`) that are written as one
+  packed example. Packed examples also have `position_ids` that restart at 0
+  for every instance, `sequence_ids` that tell the instances apart (1, 2, ...,
+  and 0 for padding), and one next sentence label per instance, with the
+  position of its [CLS] token.
+
+  With `shuffle_buckets`, the examples are written in a random order drawn
+  from `rng` (see `external_shuffle`) rather than in the order of
+  `instances`.
+  """
+  records = serialize_instances(instances, tokenizer, max_seq_length,
+                                max_predictions_per_seq, dynamic_masking,
+                                compact, max_sequences_per_pack)
+  if shuffle_buckets:
+    total_written = external_shuffle(records, output_files, shuffle_buckets,
+                                     rng)
+  else:
+    total_written = write_records(records, output_files)
 
-  writer_index = 0
+  tf.logging.info("Wrote %d total instances", total_written)
+  return total_written
 
-  total_written = 0
+
+def serialize_instances(instances, tokenizer, max_seq_length,
+                        max_predictions_per_seq, dynamic_masking=False,
+                        compact=False, max_sequences_per_pack=0):
+  """Yields serialized `tf.train.Example`s of `TrainingInstance`s.
+
+  See `write_instance_to_example_files` for the arguments.
+  """
   for (inst_index, instance) in enumerate(instances):
-    input_ids = tokenizer.convert_tokens_to_ids(instance.tokens)
+    pack = instance if max_sequences_per_pack else [instance]
+    input_ids = []
+    segment_ids = []
+    position_ids = []
+    sequence_ids = []
+    masked_lm_positions = []
+    masked_lm_ids = []
+    next_sentence_positions = []
+    next_sentence_labels = []
+    for (sequence_index, packed_instance) in enumerate(pack):
+      offset = len(input_ids)
+      num_instance_tokens = len(packed_instance.input_ids)
+      input_ids.extend(packed_instance.input_ids)
+      segment_ids.extend(packed_instance.segment_ids)
+      position_ids.extend(range(num_instance_tokens))
+      sequence_ids.extend([sequence_index + 1] * num_instance_tokens)
+      masked_lm_positions.extend(
+          offset + position
+          for position in packed_instance.masked_lm_positions)
+      masked_lm_ids.extend(packed_instance.masked_lm_ids)
+      next_sentence_positions.append(offset)
+      next_sentence_labels.append(1 if packed_instance.is_random_next else 0)
+    num_tokens = len(input_ids)
     input_mask = [1] * len(input_ids)
-    segment_ids = list(instance.segment_ids)
     assert len(input_ids) <= max_seq_length
 
-    while len(input_ids) < max_seq_length:
+    while not compact and len(input_ids) < max_seq_length:
       input_ids.append(0)
       input_mask.append(0)
       segment_ids.append(0)
+      position_ids.append(0)
+      sequence_ids.append(0)
 
-    assert len(input_ids) == max_seq_length
-    assert len(input_mask) == max_seq_length
-    assert len(segment_ids) == max_seq_length
+    assert compact or len(input_ids) == max_seq_length
+    assert compact or len(input_mask) == max_seq_length
+    assert compact or len(segment_ids) == max_seq_length
 
-    masked_lm_positions = list(instance.masked_lm_positions)
-    masked_lm_ids = tokenizer.convert_tokens_to_ids(instance.masked_lm_labels)
     masked_lm_weights = [1.0] * len(masked_lm_ids)
 
-    while len(masked_lm_positions) < max_predictions_per_seq:
+    while not compact and len(masked_lm_positions) < max_predictions_per_seq:
       masked_lm_positions.append(0)
       masked_lm_ids.append(0)
       masked_lm_weights.append(0.0)
 
-    next_sentence_label = 1 if instance.is_random_next else 0
+    next_sentence_weights = [1.0] * len(next_sentence_labels)
+    while (not compact and
+           len(next_sentence_labels) < max_sequences_per_pack):
+      next_sentence_positions.append(0)
+      next_sentence_labels.append(0)
+      next_sentence_weights.append(0.0)
 
     features = collections.OrderedDict()
     features["input_ids"] = create_int_feature(input_ids)
-    features["input_mask"] = create_int_feature(input_mask)
+    if not compact:
+      features["input_mask"] = create_int_feature(input_mask)
     features["segment_ids"] = create_int_feature(segment_ids)
-    features["masked_lm_positions"] = create_int_feature(masked_lm_positions)
-    features["masked_lm_ids"] = create_int_feature(masked_lm_ids)
-    features["masked_lm_weights"] = create_float_feature(masked_lm_weights)
-    features["next_sentence_labels"] = create_int_feature([next_sentence_label])
+    if max_sequences_per_pack:
+      features["position_ids"] = create_int_feature(position_ids)
+      features["sequence_ids"] = create_int_feature(sequence_ids)
+    if not dynamic_masking:
+      features["masked_lm_positions"] = create_int_feature(
+          masked_lm_positions)
+      features["masked_lm_ids"] = create_int_feature(masked_lm_ids)
+      if not compact:
+        features["masked_lm_weights"] = create_float_feature(
+            masked_lm_weights)
+    if max_sequences_per_pack:
+      features["next_sentence_positions"] = create_int_feature(
+          next_sentence_positions)
+    features["next_sentence_labels"] = create_int_feature(next_sentence_labels)
+    if max_sequences_per_pack and not compact:
+      features["next_sentence_weights"] = create_float_feature(
+          next_sentence_weights)
 
     tf_example = tf.train.Example(features=tf.train.Features(feature=features))
 
-    writers[writer_index].write(tf_example.SerializeToString())
-    writer_index = (writer_index + 1) % len(writers)
-
-    total_written += 1
-
     if inst_index < 20:
       tf.logging.info("*** Example ***")
-      tf.logging.info("tokens: %s" % " ".join(
-          [tokenization.printable_text(x) for x in instance.tokens]))
+      for packed_instance in pack:
+        tf.logging.info(packed_instance.to_string(tokenizer).rstrip("\n"))
+      tf.logging.info("text: %s" % tokenization.printable_text(
+          tokenizer.decode(input_ids[0:num_tokens], skip_special=True)))
 
       for feature_name in features.keys():
         feature = features[feature_name]
@@ -157,10 +349,82 @@ def write_instance_to_example_files(instances, tokenizer, max_seq_length,
         tf.logging.info(
             "%s: %s" % (feature_name, " ".join([str(x) for x in values])))
 
+    yield tf_example.SerializeToString()
+
+
+def write_records(records, output_files):
+  """Writes `records` round-robin into `output_files`.
+
+  Returns:
+    The number of records written.
+  """
+  writers = []
+  for output_file in output_files:
+    writers.append(tf.python_io.TFRecordWriter(output_file))
+
+  writer_index = 0
+  total_written = 0
+  for record in records:
+    writers[writer_index].write(record)
+    writer_index = (writer_index + 1) % len(writers)
+    total_written += 1
+
   for writer in writers:
     writer.close()
-
-  tf.logging.info("Wrote %d total instances", total_written)
+  return total_written
+
+
+def external_shuffle(records, output_files, num_buckets, rng):
+  """Writes `records` round-robin into `output_files` in a random order.
+
+  This is a two-pass shuffle that does not hold all of the records in memory.
+  First every record is appended to one of `num_buckets` temporary files in
+  `<output_files[0]>.shuffle-tmp`, chosen at random. Then the buckets are read
+  back one at a time, shuffled in memory and written out. Every order of the
+  records is equally likely, and the order only depends on the state of `rng`.
+  Memory use is about the size of the largest bucket, i.e. of the output
+  divided by `num_buckets`.
+
+  Args:
+    records: An iterable of serialized records.
+    output_files: The output files.
+    num_buckets: Number of temporary bucket files.
+    rng: A `random.Random`.
+
+  Returns:
+    The number of records written.
+  """
+  tmp_dir = output_files[0] + ".shuffle-tmp"
+  tf.gfile.MakeDirs(tmp_dir)
+  bucket_files = [
+      os.path.join(tmp_dir, "bucket-%05d" % i) for i in range(num_buckets)
+  ]
+  try:
+    bucket_writers = [
+        tf.python_io.TFRecordWriter(bucket_file)
+        for bucket_file in bucket_files
+    ]
+    bucket_bytes = [0] * num_buckets
+    for record in records:
+      bucket = rng.randint(0, num_buckets - 1)
+      bucket_writers[bucket].write(record)
+      bucket_bytes[bucket] += len(record)
+    for writer in bucket_writers:
+      writer.close()
+    tf.logging.info("Shuffling in %d buckets of up to %.1f MB", num_buckets,
+                    max(bucket_bytes) / (1024.0 * 1024.0))
+
+    def shuffled_records():
+      for bucket_file in bucket_files:
+        bucket = list(tf.python_io.tf_record_iterator(bucket_file))
+        tf.gfile.Remove(bucket_file)
+        rng.shuffle(bucket)
+        for record in bucket:
+          yield record
+
+    return write_records(shuffled_records(), output_files)
+  finally:
+    tf.gfile.DeleteRecursively(tmp_dir)
 
 
 def create_int_feature(values):
@@ -175,9 +439,46 @@ def create_float_feature(values):
 
 def create_training_instances(input_files, tokenizer, max_seq_length,
                               dupe_factor, short_seq_prob, masked_lm_prob,
-                              max_predictions_per_seq, rng):
-  """Create `TrainingInstance`s from raw text."""
-  all_documents = [[]]
+                              max_predictions_per_seq, rng,
+                              dynamic_masking=False, document_store=None,
+                              shuffle=True):
+  """Create `TrainingInstance`s from raw text.
+
+  With a `document_store`, the documents are read from it instead of from
+  `input_files`. Without `shuffle`, the instances are not shuffled, and an
+  iterator that creates them as they are consumed is returned instead of a
+  list, so that only the documents are held in memory.
+  """
+  if document_store is None:
+    all_documents = list(read_documents(input_files, tokenizer))
+  else:
+    all_documents = list(document_store)
+  rng.shuffle(all_documents)
+
+  vocab = create_instance_vocab(tokenizer)
+
+  def generate_instances():
+    for _ in range(dupe_factor):
+      for document_index in range(len(all_documents)):
+        for instance in create_instances_from_document(
+            all_documents, document_index, max_seq_length, short_seq_prob,
+            masked_lm_prob, max_predictions_per_seq, vocab, rng,
+            dynamic_masking):
+          yield instance
+
+  if not shuffle:
+    return generate_instances()
+  instances = list(generate_instances())
+  rng.shuffle(instances)
+  return instances
+
+
+def read_documents(input_files, tokenizer):
+  """Yields the non-empty documents of `input_files` as lists of sentences.
+
+  Each sentence is an `array.array("i")` of token ids.
+  """
+  document = []
 
   # Input file format:
   # (1) One sentence per line. These should ideally be actual sentences, not
@@ -195,32 +496,375 @@ def create_training_instances(input_files, tokenizer, max_seq_length,
 
         # Empty lines are used as document delimiters
         if not line:
-          all_documents.append([])
-        tokens = tokenizer.tokenize(line)
-        if tokens:
-          all_documents[-1].append(tokens)
+          if document:
+            yield document
+          document = []
+        token_ids = tokenizer.tokenize_to_ids(line)
+        if token_ids:
+          document.append(array.array("i", token_ids))
+  if document:
+    yield document
+
+
+# Bump when the layout of the document store changes.
+_DOCUMENT_STORE_VERSION = 1
+
+
+def document_store_fingerprint(input_files, tokenizer):
+  """Returns a hex digest of everything the tokenized documents depend on.
+
+  That is the vocabulary, `do_lower_case` and the input files. Like the
+  compiled vocabs of `tokenization.load_vocab`, the input files are told apart
+  by their modification time rather than their contents, along with their
+  path and size, so that checking for a store does not read the corpus.
+  """
+  digest = hashlib.sha256()
+  digest.update(("version=%d\ndo_lower_case=%s\n" %
+                 (_DOCUMENT_STORE_VERSION,
+                  tokenizer.basic_tokenizer.do_lower_case)).encode("utf-8"))
+  for (token, token_id) in tokenizer.vocab.items():
+    digest.update((u"%s\t%d\n" % (token, token_id)).encode("utf-8"))
+  for input_file in input_files:
+    stat = tf.gfile.Stat(input_file)
+    digest.update(("%s\t%d\t%d\n" % (input_file, stat.length,
+                                      stat.mtime_nsec)).encode("utf-8"))
+  return digest.hexdigest()
+
+
+def build_document_store(input_files, tokenizer, path):
+  """Tokenizes `input_files` into a document store directory at `path`.
+
+  Layout (flat little-endian arrays):
+    token_ids.bin:        int32[num_tokens], the ids of all sentences, back to
+                          back.
+    sentence_offsets.bin: int64[num_sentences + 1], where each sentence starts
+                          in `token_ids`.
+    document_offsets.bin: int64[num_documents + 1], where each document starts
+                          in `sentence_offsets`.
+    meta.json:            The array sizes and the input files.
+
+  The documents are those of `read_documents`. The store is written to a
+  temporary directory that is renamed to `path` at the end, so an interrupted
+  run does not leave a partial store behind.
+  """
+  tmp_path = "%s.tmp-%d" % (path, os.getpid())
+  if os.path.exists(tmp_path):
+    shutil.rmtree(tmp_path)
+  os.makedirs(tmp_path)
+
+  num_tokens = 0
+  num_sentences = 0
+  num_documents = 0
+  with open(os.path.join(tmp_path, "token_ids.bin"), "wb") as token_writer, \
+      open(os.path.join(tmp_path, "sentence_offsets.bin"),
+           "wb") as sentence_writer, \
+      open(os.path.join(tmp_path, "document_offsets.bin"),
+           "wb") as document_writer:
+    np.zeros(1, dtype="<i8").tofile(sentence_writer)
+    np.zeros(1, dtype="<i8").tofile(document_writer)
+    for document in read_documents(input_files, tokenizer):
+      token_ids = []
+      sentence_offsets = []
+      for sentence in document:
+        token_ids.extend(sentence)
+        sentence_offsets.append(num_tokens + len(token_ids))
+      np.asarray(token_ids, dtype="<i4").tofile(token_writer)
+      np.asarray(sentence_offsets, dtype="<i8").tofile(sentence_writer)
+      num_tokens += len(token_ids)
+      num_sentences += len(document)
+      num_documents += 1
+      np.asarray([num_sentences], dtype="<i8").tofile(document_writer)
+
+  meta = collections.OrderedDict([
+      ("version", _DOCUMENT_STORE_VERSION),
+      ("input_files", list(input_files)),
+      ("num_tokens", num_tokens),
+      ("num_sentences", num_sentences),
+      ("num_documents", num_documents),
+  ])
+  with open(os.path.join(tmp_path, "meta.json"), "w") as writer:
+    writer.write(json.dumps(meta, indent=2) + "\n")
+
+  try:
+    os.rename(tmp_path, path)
+  except OSError:
+    # Another run on the same input got there first.
+    if not os.path.isdir(path):
+      raise
+    shutil.rmtree(tmp_path)
+
+
+def load_document_store(store_dir, input_files, tokenizer):
+  """Returns the `DocumentStore` of `input_files` in `store_dir`.
+
+  The store is built first if `store_dir` has none for the current input
+  files and vocabulary.
+  """
+  path = os.path.join(store_dir,
+                      document_store_fingerprint(input_files, tokenizer))
+  if os.path.isdir(path):
+    tf.logging.info("Reading tokenized documents from %s", path)
+  else:
+    tf.logging.info("Tokenizing the input into %s", path)
+    if not os.path.isdir(store_dir):
+      os.makedirs(store_dir)
+    build_document_store(input_files, tokenizer, path)
+  return DocumentStore(path)
+
+
+class DocumentStore(object):
+  """The memory-mapped documents of a store made by `build_document_store`.
+
+  This is a read-only sequence of documents. Each document is a sequence of
+  sentences, as in `read_documents`, but a sentence's ids are only read when
+  it is accessed.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    with open(os.path.join(path, "meta.json")) as reader:
+      meta = json.load(reader)
+    self._token_ids = _map_array(
+        os.path.join(path, "token_ids.bin"), "<i4", meta["num_tokens"])
+    self._sentence_offsets = _map_array(
+        os.path.join(path, "sentence_offsets.bin"), "<i8",
+        meta["num_sentences"] + 1)
+    self._document_offsets = _map_array(
+        os.path.join(path, "document_offsets.bin"), "<i8",
+        meta["num_documents"] + 1)
+
+  def __len__(self):
+    return len(self._document_offsets) - 1
+
+  def __getitem__(self, document_index):
+    if not 0 <= document_index < len(self):
+      raise IndexError("Document index out of range: %d" % document_index)
+    return _StoredDocument(self, int(self._document_offsets[document_index]),
+                           int(self._document_offsets[document_index + 1]))
+
+  def __iter__(self):
+    for document_index in range(len(self)):
+      yield self[document_index]
+
+  def sentence(self, sentence_index):
+    """Returns the token ids of a sentence, by its index in the whole store."""
+    start = self._sentence_offsets[sentence_index]
+    end = self._sentence_offsets[sentence_index + 1]
+    return array.array("i", self._token_ids[start:end].tolist())
+
+
+class _StoredDocument(object):
+  """A document of a `DocumentStore`, as a sequence of sentences."""
+
+  def __init__(self, store, start, end):
+    self._store = store
+    self._start = start
+    self._end = end
+
+  def __len__(self):
+    return self._end - self._start
+
+  def __getitem__(self, index):
+    if not 0 <= index < len(self):
+      raise IndexError("Sentence index out of range: %d" % index)
+    return self._store.sentence(self._start + index)
+
+  def __iter__(self):
+    for index in range(len(self)):
+      yield self[index]
+
+
+def _map_array(path, dtype, size):
+  # `np.memmap` cannot map empty files.
+  if not size:
+    return np.zeros(0, dtype=dtype)
+  return np.memmap(path, dtype=dtype, mode="r", shape=(size,))
+
+
+# Rough memory held per buffered token in `streaming` mode, including the
+# arrays that hold it and their share of the per-sentence and per-instance
+# overhead. Measured on CPython 3, with some headroom.
+_DOCUMENT_BYTES_PER_TOKEN = 8
+_INSTANCE_BYTES_PER_TOKEN = 16
+
+
+def create_training_instances_streaming(input_files, tokenizer, max_seq_length,
+                                        dupe_factor, short_seq_prob,
+                                        masked_lm_prob, max_predictions_per_seq,
+                                        rng, memory_mb, dynamic_masking=False,
+                                        shuffle=True, document_store=None):
+  """Yields `TrainingInstance`s from raw text in bounded memory.
+
+  The input is read (and tokenized) once, and all `dupe_factor` rounds of
+  instances of each document are created as soon as it is read. Random next
+  sentences come from a window of the most recent documents, and instances
+  leave through a shuffle buffer: once it is full, every new instance pushes
+  out a random one. Without `shuffle`, the instances are yielded as they are
+  created instead.
+
+  Args:
+    input_files: The input files.
+    tokenizer: A `FullTokenizer`.
+    max_seq_length: See `create_instances_from_document`.
+    dupe_factor: Number of times to create instances from each document.
+    short_seq_prob: See `create_instances_from_document`.
+    masked_lm_prob: See `create_instances_from_document`.
+    max_predictions_per_seq: See `create_instances_from_document`.
+    rng: A `random.Random`.
+    memory_mb: Approximate ceiling on the memory held by the document window
+      (a quarter) and the shuffle buffer (the rest).
+    dynamic_masking: See `create_instances_from_document`.
+    shuffle: Whether to pass the instances through the shuffle buffer.
+    document_store: (optional) A `DocumentStore` to read the documents from
+      instead of `input_files`.
+
+  Yields:
+    `TrainingInstance`s.
+  """
+  memory_bytes = memory_mb * 1024 * 1024
+  max_window_tokens = memory_bytes // 4 // _DOCUMENT_BYTES_PER_TOKEN
+  max_buffer_tokens = (memory_bytes * 3 // 4) // _INSTANCE_BYTES_PER_TOKEN
+
+  vocab = create_instance_vocab(tokenizer)
+  shuffle_buffer = []
+  buffer_tokens = 0
+  window = []
+  window_tokens = 0
+  if document_store is None:
+    documents = read_documents(input_files, tokenizer)
+  else:
+    documents = document_store
+  for document in documents:
+    window.append(document)
+    window_tokens += sum(len(sentence) for sentence in document)
+    if window_tokens > max_window_tokens:
+      # Drop the oldest documents down to 3/4 of the limit at once, so that
+      # the cost of shifting the list is amortized. The newest document is
+      # always kept.
+      num_dropped = 0
+      while (num_dropped < len(window) - 1 and
+             window_tokens > max_window_tokens * 3 // 4):
+        window_tokens -= sum(len(sentence) for sentence in window[num_dropped])
+        num_dropped += 1
+      del window[0:num_dropped]
+
+    for _ in range(dupe_factor):
+      for instance in create_instances_from_document(
+          window, len(window) - 1, max_seq_length, short_seq_prob,
+          masked_lm_prob, max_predictions_per_seq, vocab, rng,
+          dynamic_masking):
+        if not shuffle:
+          yield instance
+          continue
+        shuffle_buffer.append(instance)
+        buffer_tokens += len(instance.input_ids)
+        while buffer_tokens > max_buffer_tokens:
+          output_instance = _pop_random(shuffle_buffer, rng)
+          buffer_tokens -= len(output_instance.input_ids)
+          yield output_instance
+
+  rng.shuffle(shuffle_buffer)
+  for instance in shuffle_buffer:
+    yield instance
+
+
+class PackingStats(object):
+  """Counts what `pack_instances` packs, to report the padding saved."""
+
+  def __init__(self):
+    self.num_instances = 0
+    self.num_packs = 0
+    self.num_tokens = 0
+
+  def report(self, max_seq_length):
+    """Returns the share of real tokens before and after packing."""
+    if not self.num_packs:
+      return "Nothing was packed"
+    return ("Padding efficiency: %.1f%% of the tokens are real in %d "
+            "unpacked examples, %.1f%% in %d packed ones" %
+            (100.0 * self.num_tokens / (self.num_instances * max_seq_length),
+             self.num_instances,
+             100.0 * self.num_tokens / (self.num_packs * max_seq_length),
+             self.num_packs))
+
+
+def pack_instances(instances, max_seq_length, max_predictions_per_seq,
+                   max_sequences_per_pack, stats=None, max_open_packs=64):
+  """Packs `TrainingInstance`s into rows of up to `max_seq_length` tokens.
+
+  Every instance goes into the oldest open pack that has room for it (in
+  tokens, masked LM predictions and instances), or else opens a new one.
+  Packs are emitted when they are full, or oldest first once there are more
+  than `max_open_packs`, so this works on a stream of instances.
+
+  Args:
+    instances: An iterable of `TrainingInstance`s.
+    max_seq_length: Maximum number of tokens per pack.
+    max_predictions_per_seq: Maximum number of masked LM predictions per pack.
+    max_sequences_per_pack: Maximum number of instances per pack.
+    stats: (optional) A `PackingStats` to count the packs in.
+    max_open_packs: Maximum number of packs still being filled.
+
+  Yields:
+    Lists of `TrainingInstance`s.
+  """
+  # Each open pack is a list of [instances, num_tokens, num_predictions].
+  open_packs = []
+  for instance in instances:
+    num_tokens = len(instance.input_ids)
+    num_predictions = len(instance.masked_lm_positions)
+    if stats is not None:
+      stats.num_instances += 1
+      stats.num_tokens += num_tokens
+
+    pack = None
+    for candidate in open_packs:
+      if (candidate[1] + num_tokens <= max_seq_length and
+          candidate[2] + num_predictions <= max_predictions_per_seq):
+        pack = candidate
+        break
+    if pack is None:
+      pack = [[], 0, 0]
+      open_packs.append(pack)
+    pack[0].append(instance)
+    pack[1] += num_tokens
+    pack[2] += num_predictions
+
+    if len(pack[0]) == max_sequences_per_pack or pack[1] == max_seq_length:
+      open_packs.remove(pack)
+    elif len(open_packs) > max_open_packs:
+      pack = open_packs.pop(0)
+    else:
+      continue
+    if stats is not None:
+      stats.num_packs += 1
+    yield pack[0]
 
-  # Remove empty documents
-  all_documents = [x for x in all_documents if x]
-  rng.shuffle(all_documents)
+  for pack in open_packs:
+    if stats is not None:
+      stats.num_packs += 1
+    yield pack[0]
 
-  vocab_words = list(tokenizer.vocab.keys())
-  instances = []
-  for _ in range(dupe_factor):
-    for document_index in range(len(all_documents)):
-      instances.extend(
-          create_instances_from_document(
-              all_documents, document_index, max_seq_length, short_seq_prob,
-              masked_lm_prob, max_predictions_per_seq, vocab_words, rng))
 
-  rng.shuffle(instances)
-  return instances
+def _pop_random(items, rng):
+  """Removes and returns a random element of the list `items` in O(1)."""
+  index = rng.randint(0, len(items) - 1)
+  (items[index], items[-1]) = (items[-1], items[index])
+  return items.pop()
 
 
 def create_instances_from_document(
     all_documents, document_index, max_seq_length, short_seq_prob,
-    masked_lm_prob, max_predictions_per_seq, vocab_words, rng):
-  """Creates `TrainingInstance`s for a single document."""
+    masked_lm_prob, max_predictions_per_seq, vocab, rng,
+    dynamic_masking=False):
+  """Creates `TrainingInstance`s for a single document.
+
+  `all_documents` are lists of sentences of token ids, as made by
+  `read_documents`, and `vocab` is an `InstanceVocab`.
+
+  With `dynamic_masking`, the instances are left unmasked (with no masked LM
+  predictions) for the masking to be done at training time.
+  """
   document = all_documents[document_index]
 
   # Account for [CLS], [SEP], [SEP]
@@ -258,11 +902,11 @@ def create_instances_from_document(
         if len(current_chunk) >= 2:
           a_end = rng.randint(1, len(current_chunk) - 1)
 
-        tokens_a = []
+        tokens_a = array.array("i")
         for j in range(a_end):
           tokens_a.extend(current_chunk[j])
 
-        tokens_b = []
+        tokens_b = array.array("i")
         # Random next
         is_random_next = False
         if len(current_chunk) == 1 or rng.random() < 0.5:
@@ -298,32 +942,27 @@ def create_instances_from_document(
         assert len(tokens_a) >= 1
         assert len(tokens_b) >= 1
 
-        tokens = []
-        segment_ids = []
-        tokens.append("[CLS]")
-        segment_ids.append(0)
-        for token in tokens_a:
-          tokens.append(token)
-          segment_ids.append(0)
-
-        tokens.append("[SEP]")
-        segment_ids.append(0)
-
-        for token in tokens_b:
-          tokens.append(token)
-          segment_ids.append(1)
-        tokens.append("[SEP]")
-        segment_ids.append(1)
-
-        (tokens, masked_lm_positions,
-         masked_lm_labels) = create_masked_lm_predictions(
-             tokens, masked_lm_prob, max_predictions_per_seq, vocab_words, rng)
+        input_ids = array.array("i", [vocab.cls_id])
+        input_ids.extend(tokens_a)
+        input_ids.append(vocab.sep_id)
+        input_ids.extend(tokens_b)
+        input_ids.append(vocab.sep_id)
+        segment_ids = array.array("b", [0]) * (len(tokens_a) + 2)
+        segment_ids.extend(array.array("b", [1]) * (len(tokens_b) + 1))
+
+        if dynamic_masking:
+          (masked_lm_positions, masked_lm_ids) = (array.array("i"),
+                                                  array.array("i"))
+        else:
+          (input_ids, masked_lm_positions,
+           masked_lm_ids) = create_masked_lm_predictions(
+               input_ids, masked_lm_prob, max_predictions_per_seq, vocab, rng)
         instance = TrainingInstance(
-            tokens=tokens,
+            input_ids=input_ids,
             segment_ids=segment_ids,
             is_random_next=is_random_next,
             masked_lm_positions=masked_lm_positions,
-            masked_lm_labels=masked_lm_labels)
+            masked_lm_ids=masked_lm_ids)
         instances.append(instance)
       current_chunk = []
       current_length = 0
@@ -332,59 +971,156 @@ def create_instances_from_document(
   return instances
 
 
-def create_masked_lm_predictions(tokens, masked_lm_prob,
-                                 max_predictions_per_seq, vocab_words, rng):
-  """Creates the predictions for the masked LM objective."""
+def create_masked_lm_predictions(input_ids, masked_lm_prob,
+                                 max_predictions_per_seq, vocab, rng):
+  """Creates the predictions for the masked LM objective.
+
+  Returns:
+    `(output_ids, masked_lm_positions, masked_lm_ids)`, as `array.array("i")`s.
+  """
 
   cand_indexes = []
-  for (i, token) in enumerate(tokens):
-    if token == "[CLS]" or token == "[SEP]":
+  for (i, token_id) in enumerate(input_ids):
+    if token_id == vocab.cls_id or token_id == vocab.sep_id:
       continue
     cand_indexes.append(i)
 
   rng.shuffle(cand_indexes)
 
-  output_tokens = list(tokens)
-
-  masked_lm = collections.namedtuple("masked_lm", ["index", "label"])  # pylint: disable=invalid-name
+  output_ids = array.array("i", input_ids)
 
   num_to_predict = min(max_predictions_per_seq,
-                       max(1, int(round(len(tokens) * masked_lm_prob))))
+                       max(1, int(round(len(input_ids) * masked_lm_prob))))
 
-  masked_lms = []
+  masked_lm_positions = []
   covered_indexes = set()
   for index in cand_indexes:
-    if len(masked_lms) >= num_to_predict:
+    if len(masked_lm_positions) >= num_to_predict:
       break
     if index in covered_indexes:
       continue
     covered_indexes.add(index)
 
-    masked_token = None
+    masked_id = None
     # 80% of the time, replace with [MASK]
     if rng.random() < 0.8:
-      masked_token = "[MASK]"
+      masked_id = vocab.mask_id
     else:
       # 10% of the time, keep original
       if rng.random() < 0.5:
-        masked_token = tokens[index]
+        masked_id = input_ids[index]
       # 10% of the time, replace with random word
       else:
-        masked_token = vocab_words[rng.randint(0, len(vocab_words) - 1)]
-
-    output_tokens[index] = masked_token
-
-    masked_lms.append(masked_lm(index=index, label=tokens[index]))
-
-  masked_lms = sorted(masked_lms, key=lambda x: x.index)
-
-  masked_lm_positions = []
-  masked_lm_labels = []
-  for p in masked_lms:
-    masked_lm_positions.append(p.index)
-    masked_lm_labels.append(p.label)
-
-  return (output_tokens, masked_lm_positions, masked_lm_labels)
+        masked_id = vocab.vocab_ids[rng.randint(0, len(vocab.vocab_ids) - 1)]
+
+    output_ids[index] = masked_id
+
+    masked_lm_positions.append(index)
+
+  masked_lm_positions.sort()
+  masked_lm_ids = array.array("i", [input_ids[i] for i in masked_lm_positions])
+
+  return (output_ids, array.array("i", masked_lm_positions), masked_lm_ids)
+
+
+def mask_instances(instances, masked_lm_prob, max_predictions_per_seq, vocab,
+                   np_rng, batch_size=1024):
+  """Yields unmasked `TrainingInstance`s with masked LM predictions.
+
+  The instances are masked by `mask_instance_batch`, `batch_size` at a time,
+  so this works on a stream of instances.
+  """
+  batch = []
+  for instance in instances:
+    batch.append(instance)
+    if len(batch) == batch_size:
+      mask_instance_batch(batch, masked_lm_prob, max_predictions_per_seq,
+                          vocab, np_rng)
+      for masked_instance in batch:
+        yield masked_instance
+      batch = []
+  if batch:
+    mask_instance_batch(batch, masked_lm_prob, max_predictions_per_seq, vocab,
+                        np_rng)
+    for masked_instance in batch:
+      yield masked_instance
+
+
+def mask_instance_batch(instances, masked_lm_prob, max_predictions_per_seq,
+                        vocab, np_rng):
+  """Creates the masked LM predictions of unmasked instances, in place.
+
+  This is `create_masked_lm_predictions` for a whole batch at once with NumPy,
+  and its masks follow the same distribution:
+
+  * Each instance gets `min(max_predictions_per_seq, max(1, round(n *
+    masked_lm_prob)))` predictions for `n` tokens, or one per token if it has
+    fewer tokens other than [CLS] and [SEP]. (`round` rounds half to even, as
+    in Python 3.)
+  * The predicted positions are a uniformly random subset of those tokens:
+    the tokens with the smallest of a set of uniform random keys rather than
+    the first ones of a shuffled list.
+  * Each prediction independently becomes [MASK] with probability 0.8, stays
+    the same with probability 0.1, and otherwise becomes a uniformly random
+    id of `vocab.vocab_ids`. This is one uniform draw per prediction rather
+    than two, with the same probabilities.
+
+  Args:
+    instances: A list of `TrainingInstance`s without masked LM predictions.
+    masked_lm_prob: See `create_masked_lm_predictions`.
+    max_predictions_per_seq: See `create_masked_lm_predictions`.
+    vocab: An `InstanceVocab`.
+    np_rng: A `numpy.random.Generator`.
+  """
+  batch_size = len(instances)
+  lengths = np.array([len(instance.input_ids) for instance in instances])
+  max_length = int(lengths.max())
+  input_ids = np.zeros([batch_size, max_length], dtype=np.intc)
+  for (i, instance) in enumerate(instances):
+    input_ids[i, 0:lengths[i]] = np.frombuffer(instance.input_ids,
+                                               dtype=np.intc)
+
+  is_candidate = ((np.arange(max_length)[np.newaxis, :] <
+                   lengths[:, np.newaxis]) & (input_ids != vocab.cls_id) &
+                  (input_ids != vocab.sep_id))
+  num_to_predict = np.minimum(
+      max_predictions_per_seq,
+      np.maximum(1, np.rint(lengths * masked_lm_prob).astype(np.int64)))
+  num_to_predict = np.minimum(num_to_predict, is_candidate.sum(axis=1))
+
+  # The candidates with the smallest random keys are predicted. Other tokens
+  # get a key that sorts after every candidate.
+  keys = np_rng.random((batch_size, max_length))
+  keys[~is_candidate] = 2.0
+  num_columns = min(max_predictions_per_seq, max_length)
+  is_prediction = (np.arange(num_columns)[np.newaxis, :] <
+                   num_to_predict[:, np.newaxis])
+  positions = np.where(is_prediction,
+                       np.argsort(keys, axis=1)[:, 0:num_columns], max_length)
+  # Sorting leaves the predictions at the start of each row.
+  positions.sort(axis=1)
+  rows = np.broadcast_to(np.arange(batch_size)[:, np.newaxis], positions.shape)
+  labels = input_ids[rows, np.minimum(positions, max_length - 1)]
+
+  draws = np_rng.random((batch_size, num_columns))
+  random_ids = np.asarray(vocab.vocab_ids, dtype=np.intc)[np_rng.integers(
+      0, len(vocab.vocab_ids), size=(batch_size, num_columns))]
+  replacements = np.where(draws < 0.8, vocab.mask_id,
+                          np.where(draws < 0.9, labels, random_ids))
+  output_ids = input_ids.copy()
+  output_ids[rows[is_prediction],
+             positions[is_prediction]] = replacements[is_prediction]
+
+  for (i, instance) in enumerate(instances):
+    instance.input_ids = _to_int_array(output_ids[i, 0:lengths[i]])
+    instance.masked_lm_positions = _to_int_array(
+        positions[i, 0:num_to_predict[i]])
+    instance.masked_lm_ids = _to_int_array(labels[i, 0:num_to_predict[i]])
+
+
+def _to_int_array(values):
+  """Copies a NumPy vector into an `array.array("i")`."""
+  return array.array("i", values.astype(np.intc).tobytes())
 
 
 def truncate_seq_pair(tokens_a, tokens_b, max_num_tokens, rng):
@@ -405,6 +1141,167 @@ def truncate_seq_pair(tokens_a, tokens_b, max_num_tokens, rng):
       trunc_tokens.pop()
 
 
+# The settings that are the same for every shard.
+ShardConfig = collections.namedtuple("ShardConfig", [
+    "max_seq_length", "dupe_factor", "short_seq_prob", "masked_lm_prob",
+    "max_predictions_per_seq", "streaming", "streaming_memory_mb",
+    "dynamic_masking", "compact_records", "max_sequences_per_pack",
+    "shuffle_buckets", "document_store_dir", "vectorized_masking"
+])
+
+
+def shard_seed(random_seed, shard_id):
+  """Derives the random seed of a shard from the global random seed."""
+  digest = hashlib.sha256(
+      ("%d/%d" % (random_seed, shard_id)).encode("utf-8")).hexdigest()
+  return int(digest[0:16], 16)
+
+
+def shard_output_file(output_file, shard_id, num_shards):
+  return "%s-%05d-of-%05d" % (output_file, shard_id, num_shards)
+
+
+def create_examples(input_files, output_files, tokenizer, config, rng):
+  """Creates TF example files from raw text as configured by `config`.
+
+  Returns:
+    The number of examples written.
+  """
+  document_store = None
+  if config.document_store_dir:
+    document_store = load_document_store(config.document_store_dir,
+                                         input_files, tokenizer)
+
+  # With `vectorized_masking`, the instances are created unmasked and masked
+  # below instead.
+  vectorized_masking = (
+      config.vectorized_masking and not config.dynamic_masking)
+  np_rng = None
+  if vectorized_masking:
+    np_rng = np.random.default_rng(rng.getrandbits(64))
+  unmasked = config.dynamic_masking or vectorized_masking
+
+  if config.streaming:
+    # Nothing is generated until the writer below asks for it.
+    instances = create_training_instances_streaming(
+        input_files, tokenizer, config.max_seq_length, config.dupe_factor,
+        config.short_seq_prob, config.masked_lm_prob,
+        config.max_predictions_per_seq, rng, config.streaming_memory_mb,
+        unmasked, shuffle=not config.shuffle_buckets,
+        document_store=document_store)
+  else:
+    instances = create_training_instances(
+        input_files, tokenizer, config.max_seq_length, config.dupe_factor,
+        config.short_seq_prob, config.masked_lm_prob,
+        config.max_predictions_per_seq, rng, unmasked, document_store,
+        shuffle=not config.shuffle_buckets)
+
+  if vectorized_masking:
+    instances = mask_instances(instances, config.masked_lm_prob,
+                               config.max_predictions_per_seq,
+                               create_instance_vocab(tokenizer), np_rng)
+
+  packing_stats = None
+  if config.max_sequences_per_pack:
+    packing_stats = PackingStats()
+    instances = pack_instances(instances, config.max_seq_length,
+                               config.max_predictions_per_seq,
+                               config.max_sequences_per_pack, packing_stats)
+
+  num_written = write_instance_to_example_files(
+      instances, tokenizer, config.max_seq_length,
+      config.max_predictions_per_seq, output_files, config.dynamic_masking,
+      config.compact_records, config.max_sequences_per_pack,
+      config.shuffle_buckets, rng)
+  if packing_stats is not None:
+    tf.logging.info(packing_stats.report(config.max_seq_length))
+  return num_written
+
+
+def create_shard(input_files, output_file, tokenizer, config, seed):
+  """Creates the TF example file of one shard.
+
+  Returns:
+    The number of examples written.
+  """
+  return create_examples(input_files, [output_file], tokenizer, config,
+                         random.Random(seed))
+
+
+def create_sharded_examples(input_files, output_file, tokenizer, config,
+                            random_seed, num_workers):
+  """Creates one output shard per input file with a pool of workers.
+
+  Args:
+    input_files: The input files. Shard `i` is created from `input_files[i]`.
+    output_file: Prefix of the shard files.
+    tokenizer: A `FullTokenizer`.
+    config: A `ShardConfig`.
+    random_seed: The seed that the seeds of the shards are derived from.
+    num_workers: Number of worker processes. With 1, the shards are created
+      in the calling process.
+
+  Returns:
+    The manifest, which is also written to `<output_file>.manifest.json`.
+  """
+  num_shards = len(input_files)
+  shards = []
+  for (shard_id, input_file) in enumerate(input_files):
+    shards.append((shard_id, [input_file],
+                   shard_output_file(output_file, shard_id, num_shards),
+                   shard_seed(random_seed, shard_id)))
+
+  if num_workers <= 1:
+    _init_shard_worker(tokenizer, config)
+    num_instances = [_create_shard_in_worker(shard) for shard in shards]
+  else:
+    pool = multiprocessing.Pool(
+        processes=num_workers,
+        initializer=_init_shard_worker,
+        initargs=(tokenizer, config))
+    try:
+      num_instances = pool.map(_create_shard_in_worker, shards, chunksize=1)
+    finally:
+      pool.close()
+      pool.join()
+
+  manifest = collections.OrderedDict([
+      ("random_seed", random_seed),
+      ("config", collections.OrderedDict(zip(config._fields, config))),
+      ("num_instances", sum(num_instances)),
+      ("shards", []),
+  ])
+  for ((shard_id, shard_input_files, shard_file, seed),
+       shard_num_instances) in zip(shards, num_instances):
+    manifest["shards"].append(
+        collections.OrderedDict([
+            ("shard_id", shard_id),
+            ("input_files", shard_input_files),
+            ("output_file", shard_file),
+            ("seed", seed),
+            ("num_instances", shard_num_instances),
+        ]))
+  with tf.gfile.GFile(output_file + ".manifest.json", "w") as writer:
+    writer.write(json.dumps(manifest, indent=2) + "\n")
+  return manifest
+
+
+# The tokenizer and `ShardConfig` of the current shard worker process. Set
+# once per worker by `_init_shard_worker`.
+_shard_worker_args = None
+
+
+def _init_shard_worker(tokenizer, config):
+  global _shard_worker_args
+  _shard_worker_args = (tokenizer, config)
+
+
+def _create_shard_in_worker(shard):
+  (_, input_files, output_file, seed) = shard
+  (tokenizer, config) = _shard_worker_args
+  return create_shard(input_files, output_file, tokenizer, config, seed)
+
+
 def main(_):
   tf.logging.set_verbosity(tf.logging.INFO)
 
@@ -419,19 +1316,39 @@ def main(_):
   for input_file in input_files:
     tf.logging.info("  %s", input_file)
 
-  rng = random.Random(FLAGS.random_seed)
-  instances = create_training_instances(
-      input_files, tokenizer, FLAGS.max_seq_length, FLAGS.dupe_factor,
-      FLAGS.short_seq_prob, FLAGS.masked_lm_prob, FLAGS.max_predictions_per_seq,
-      rng)
+  config = ShardConfig(
+      max_seq_length=FLAGS.max_seq_length,
+      dupe_factor=FLAGS.dupe_factor,
+      short_seq_prob=FLAGS.short_seq_prob,
+      masked_lm_prob=FLAGS.masked_lm_prob,
+      max_predictions_per_seq=FLAGS.max_predictions_per_seq,
+      streaming=FLAGS.streaming,
+      streaming_memory_mb=FLAGS.streaming_memory_mb,
+      dynamic_masking=FLAGS.dynamic_masking,
+      compact_records=FLAGS.compact_records,
+      max_sequences_per_pack=FLAGS.max_sequences_per_pack,
+      shuffle_buckets=FLAGS.shuffle_buckets,
+      document_store_dir=FLAGS.document_store_dir,
+      vectorized_masking=FLAGS.vectorized_masking)
+
+  if FLAGS.num_workers > 0:
+    manifest = create_sharded_examples(input_files, FLAGS.output_file,
+                                       tokenizer, config, FLAGS.random_seed,
+                                       FLAGS.num_workers)
+    tf.logging.info("*** Wrote %d instances to %d shards ***",
+                    manifest["num_instances"], len(manifest["shards"]))
+    for shard in manifest["shards"]:
+      tf.logging.info("  %s (%d instances)", shard["output_file"],
+                      shard["num_instances"])
+    return
 
   output_files = FLAGS.output_file.split(",")
   tf.logging.info("*** Writing to output files ***")
   for output_file in output_files:
     tf.logging.info("  %s", output_file)
 
-  write_instance_to_example_files(instances, tokenizer, FLAGS.max_seq_length,
-                                  FLAGS.max_predictions_per_seq, output_files)
+  create_examples(input_files, output_files, tokenizer, config,
+                  random.Random(FLAGS.random_seed))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,289 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Memory and masking benchmarks for create_pretraining_data.py.
+
+Measures the memory held per `TrainingInstance`, with and without masking,
+and compares it to the same instances in the representation they used to
+have: Python lists of token strings and label strings in an object without
+`__slots__`. The token strings are shared with the vocabulary, so they are
+not counted for either.
+
+Also measures the throughput of `create_masked_lm_predictions` against the
+batched `mask_instance_batch`, along with the statistics of the masks each
+produces, which should agree. The results can be written as JSON to track
+them over time.
+
+Example:
+  python create_pretraining_data_benchmark.py \
+    --input_file=sample_text.txt \
+    --vocab_file=$BERT_BASE_DIR/vocab.txt \
+    --dupe_factor=20 \
+    --output_json=/tmp/create_pretraining_data_benchmark.json
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import collections
+import io
+import json
+import platform
+import random
+import time
+
+import create_pretraining_data
+import numpy as np
+import tokenization
+
+
+class ListTrainingInstance(object):
+  """A `TrainingInstance` in the list-of-strings representation."""
+
+  def __init__(self, tokens, segment_ids, masked_lm_positions, masked_lm_labels,
+               is_random_next):
+    self.tokens = tokens
+    self.segment_ids = segment_ids
+    self.is_random_next = is_random_next
+    self.masked_lm_positions = masked_lm_positions
+    self.masked_lm_labels = masked_lm_labels
+
+
+def to_list_instance(instance, tokenizer):
+  return ListTrainingInstance(
+      tokens=tokenizer.convert_ids_to_tokens(instance.input_ids),
+      segment_ids=list(instance.segment_ids),
+      masked_lm_positions=list(instance.masked_lm_positions),
+      masked_lm_labels=tokenizer.convert_ids_to_tokens(instance.masked_lm_ids),
+      is_random_next=instance.is_random_next)
+
+
+def retained_memory_bytes(fn):
+  """Returns `fn()` and the memory in bytes it left allocated.
+
+  The memory is that of the Python objects allocated during `fn()` and still
+  alive when it returns, or None where `tracemalloc` is not available
+  (Python 2).
+  """
+  try:
+    import tracemalloc  # pylint: disable=g-import-not-at-top
+  except ImportError:
+    return (fn(), None)
+  tracemalloc.start()
+  try:
+    result = fn()
+    (current, _) = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return (result, current)
+
+
+def benchmark_instances(tokenizer, documents, args, dynamic_masking):
+  """Creates instances from `documents` and measures their memory.
+
+  Returns:
+    A dict of results, suitable for JSON.
+  """
+  vocab = create_pretraining_data.create_instance_vocab(tokenizer)
+  rng = random.Random(args.random_seed)
+
+  def create_instances():
+    instances = []
+    for _ in range(args.dupe_factor):
+      for document_index in range(len(documents)):
+        instances.extend(
+            create_pretraining_data.create_instances_from_document(
+                documents, document_index, args.max_seq_length,
+                args.short_seq_prob, args.masked_lm_prob,
+                args.max_predictions_per_seq, vocab, rng, dynamic_masking))
+    return instances
+
+  start = time.time()
+  (instances, array_bytes) = retained_memory_bytes(create_instances)
+  seconds = time.time() - start
+  (list_instances, list_bytes) = retained_memory_bytes(
+      lambda: [to_list_instance(x, tokenizer) for x in instances])
+  assert len(list_instances) == len(instances)
+
+  num_instances = len(instances)
+  num_tokens = sum(len(instance.input_ids) for instance in instances)
+  result = collections.OrderedDict([
+      ("num_instances", num_instances),
+      ("num_tokens", num_tokens),
+      ("seconds", seconds),
+      ("instances_per_sec", num_instances / seconds),
+  ])
+  for (name, num_bytes) in [("array", array_bytes), ("list", list_bytes)]:
+    if num_bytes is None:
+      continue
+    result[name] = collections.OrderedDict([
+        ("bytes", num_bytes),
+        ("bytes_per_instance", num_bytes / num_instances),
+        ("bytes_per_token", num_bytes / num_tokens),
+    ])
+  return result
+
+
+def mask_statistics(unmasked_instances, masked_instances, vocab):
+  """Returns statistics of the masks of `masked_instances`, for JSON."""
+  num_predictions = 0
+  num_masked = 0
+  num_kept = 0
+  for (unmasked, masked) in zip(unmasked_instances, masked_instances):
+    for position in masked.masked_lm_positions:
+      num_predictions += 1
+      if masked.input_ids[position] == vocab.mask_id:
+        num_masked += 1
+      elif masked.input_ids[position] == unmasked.input_ids[position]:
+        num_kept += 1
+  # Random replacements that happen to draw [MASK] or the original token are
+  # counted as such, so those two shares are slightly above 80% and 10%.
+  return collections.OrderedDict([
+      ("predictions_per_instance",
+       num_predictions / len(unmasked_instances)),
+      ("mask_fraction", num_masked / num_predictions),
+      ("keep_fraction", num_kept / num_predictions),
+      ("random_fraction",
+       (num_predictions - num_masked - num_kept) / num_predictions),
+  ])
+
+
+def benchmark_masking(tokenizer, documents, args):
+  """Times both masking engines on the same unmasked instances.
+
+  Returns:
+    A dict of results, suitable for JSON.
+  """
+  vocab = create_pretraining_data.create_instance_vocab(tokenizer)
+  rng = random.Random(args.random_seed)
+  unmasked_instances = []
+  for _ in range(args.dupe_factor):
+    for document_index in range(len(documents)):
+      unmasked_instances.extend(
+          create_pretraining_data.create_instances_from_document(
+              documents, document_index, args.max_seq_length,
+              args.short_seq_prob, args.masked_lm_prob,
+              args.max_predictions_per_seq, vocab, rng, dynamic_masking=True))
+
+  def copy_instances():
+    return [
+        create_pretraining_data.TrainingInstance(
+            input_ids=instance.input_ids,
+            segment_ids=instance.segment_ids,
+            masked_lm_positions=instance.masked_lm_positions,
+            masked_lm_ids=instance.masked_lm_ids,
+            is_random_next=instance.is_random_next)
+        for instance in unmasked_instances
+    ]
+
+  def mask_scalar(instances):
+    for instance in instances:
+      (instance.input_ids, instance.masked_lm_positions,
+       instance.masked_lm_ids) = (
+           create_pretraining_data.create_masked_lm_predictions(
+               instance.input_ids, args.masked_lm_prob,
+               args.max_predictions_per_seq, vocab, rng))
+
+  np_rng = np.random.default_rng(args.random_seed)
+
+  def mask_vectorized(instances):
+    for start in range(0, len(instances), args.masking_batch_size):
+      create_pretraining_data.mask_instance_batch(
+          instances[start:start + args.masking_batch_size],
+          args.masked_lm_prob, args.max_predictions_per_seq, vocab, np_rng)
+
+  results = collections.OrderedDict()
+  for (name, mask_fn) in [("scalar", mask_scalar),
+                          ("vectorized", mask_vectorized)]:
+    instances = copy_instances()
+    start = time.time()
+    mask_fn(instances)
+    seconds = time.time() - start
+    result = collections.OrderedDict([
+        ("seconds", seconds),
+        ("instances_per_sec", len(instances) / seconds),
+    ])
+    result.update(mask_statistics(unmasked_instances, instances, vocab))
+    results[name] = result
+  return results
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--input_file", default="sample_text.txt",
+                      help="Input text file, in the create_pretraining_data.py "
+                      "format.")
+  parser.add_argument("--vocab_file", required=True,
+                      help="The vocabulary to tokenize the input with.")
+  parser.add_argument("--do_lower_case", type=lambda x: x.lower() == "true",
+                      default=True, help="Whether to lower case the input.")
+  parser.add_argument("--max_seq_length", type=int, default=128)
+  parser.add_argument("--max_predictions_per_seq", type=int, default=20)
+  parser.add_argument("--masked_lm_prob", type=float, default=0.15)
+  parser.add_argument("--short_seq_prob", type=float, default=0.1)
+  parser.add_argument("--dupe_factor", type=int, default=10,
+                      help="Number of passes over the documents.")
+  parser.add_argument("--random_seed", type=int, default=12345)
+  parser.add_argument("--masking_batch_size", type=int, default=1024,
+                      help="Number of instances per `mask_instance_batch`.")
+  parser.add_argument("--output_json", default=None,
+                      help="Where to write the results as JSON.")
+  args = parser.parse_args()
+
+  results = collections.OrderedDict([
+      ("time", time.strftime("%Y-%m-%dT%H:%M:%S")),
+      ("python", platform.python_version()),
+      ("args", collections.OrderedDict(sorted(vars(args).items()))),
+  ])
+
+  tokenizer = tokenization.FullTokenizer(
+      vocab_file=args.vocab_file, do_lower_case=args.do_lower_case)
+  documents = list(
+      create_pretraining_data.read_documents([args.input_file], tokenizer))
+
+  print("TrainingInstance memory")
+  print("  %-16s %10s %18s %18s" % ("masking", "instances", "array bytes/inst",
+                                    "list bytes/inst"))
+  results["instances"] = collections.OrderedDict()
+  for dynamic_masking in (False, True):
+    name = "dynamic" if dynamic_masking else "static"
+    result = benchmark_instances(tokenizer, documents, args, dynamic_masking)
+    if "array" in result:
+      print("  %-16s %10d %18.1f %18.1f" %
+            (name, result["num_instances"],
+             result["array"]["bytes_per_instance"],
+             result["list"]["bytes_per_instance"]))
+    results["instances"][name] = result
+
+  print("Masked LM predictions")
+  print("  %-16s %14s %12s %8s %8s %8s" % ("engine", "instances/sec",
+                                           "preds/inst", "mask %", "keep %",
+                                           "random %"))
+  results["masking"] = benchmark_masking(tokenizer, documents, args)
+  for (name, result) in results["masking"].items():
+    print("  %-16s %14.0f %12.2f %8.1f %8.1f %8.1f" %
+          (name, result["instances_per_sec"],
+           result["predictions_per_instance"], 100.0 * result["mask_fraction"],
+           100.0 * result["keep_fraction"], 100.0 * result["random_fraction"]))
+
+  if args.output_json:
+    with io.open(args.output_json, "w", encoding="utf-8") as writer:
+      writer.write(json.dumps(results, indent=2) + u"\n")
+    print("Wrote %s" % args.output_json)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,499 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import array
+import io
+import json
+import os
+import random
+import tempfile
+
+import numpy as np
+
+import create_pretraining_data
+import modeling
+import tokenization
+import tensorflow as tf
+
+_VOCAB_TOKENS = [
+    "[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "the", "cat", "sat", "on",
+    "mat", "dog", "ran"
+]
+
+
+class CreatePretrainingDataTest(tf.test.TestCase):
+
+  def _create_full_tokenizer(self, vocab_tokens):
+    with tempfile.NamedTemporaryFile(delete=False) as vocab_writer:
+      vocab_writer.write("".join([x + "\n" for x in vocab_tokens]).encode(
+          "utf-8"))
+
+      vocab_file = vocab_writer.name
+
+    tokenizer = tokenization.FullTokenizer(vocab_file)
+    os.unlink(vocab_file)
+    return tokenizer
+
+  def _write_corpus(self, path, num_documents, seed):
+    """Writes a corpus of random sentences of the vocabulary's words."""
+    rng = random.Random(seed)
+    with io.open(path, "w", encoding="utf-8") as writer:
+      for _ in range(num_documents):
+        for _ in range(rng.randint(1, 8)):
+          writer.write(u" ".join(
+              rng.choice(_VOCAB_TOKENS[5:])
+              for _ in range(rng.randint(1, 12))) + u"\n")
+        writer.write(u"\n")
+    return path
+
+  def _create_config(self, **kwargs):
+    config = create_pretraining_data.ShardConfig(
+        max_seq_length=32,
+        dupe_factor=3,
+        short_seq_prob=0.1,
+        masked_lm_prob=0.15,
+        max_predictions_per_seq=5,
+        streaming=False,
+        streaming_memory_mb=1,
+        dynamic_masking=False,
+        compact_records=False,
+        max_sequences_per_pack=0,
+        shuffle_buckets=0,
+        document_store_dir=None,
+        vectorized_masking=False)
+    return config._replace(**kwargs)
+
+  def _create_instance(self, len_a, len_b, rng, num_predictions=0,
+                       is_random_next=False):
+    """Returns a [CLS] A [SEP] B [SEP] instance of random words."""
+    tokens = ["[CLS]"]
+    tokens.extend(rng.choice(_VOCAB_TOKENS[5:]) for _ in range(len_a))
+    tokens.append("[SEP]")
+    tokens.extend(rng.choice(_VOCAB_TOKENS[5:]) for _ in range(len_b))
+    tokens.append("[SEP]")
+    input_ids = array.array("i", [_VOCAB_TOKENS.index(x) for x in tokens])
+    masked_lm_positions = array.array(
+        "i", sorted(rng.sample(range(1, len_a + 1), num_predictions)))
+    return create_pretraining_data.TrainingInstance(
+        input_ids=input_ids,
+        segment_ids=array.array("b", [0] * (len_a + 2) + [1] * (len_b + 1)),
+        masked_lm_positions=masked_lm_positions,
+        masked_lm_ids=array.array(
+            "i", [input_ids[position] for position in masked_lm_positions]),
+        is_random_next=is_random_next)
+
+  def test_sharded_examples(self):
+    tokenizer = self._create_full_tokenizer(_VOCAB_TOKENS)
+    temp_dir = self.get_temp_dir()
+    input_files = [
+        self._write_corpus(
+            os.path.join(temp_dir, "corpus-%d.txt" % i), 20, seed=i)
+        for i in range(2)
+    ]
+    config = self._create_config()
+
+    shards = {}
+    manifests = {}
+    for num_workers in (1, 2):
+      output_dir = os.path.join(temp_dir, "workers-%d" % num_workers)
+      tf.gfile.MakeDirs(output_dir)
+      output_file = os.path.join(output_dir, "examples.tfrecord")
+      manifest = create_pretraining_data.create_sharded_examples(
+          input_files, output_file, tokenizer, config, random_seed=12345,
+          num_workers=num_workers)
+      with io.open(output_file + ".manifest.json", encoding="utf-8") as reader:
+        self.assertEqual(json.load(reader), json.loads(json.dumps(manifest)))
+
+      shards[num_workers] = []
+      for (shard_id, shard) in enumerate(manifest["shards"]):
+        self.assertEqual(
+            shard["output_file"],
+            create_pretraining_data.shard_output_file(output_file, shard_id,
+                                                      2))
+        with open(shard["output_file"], "rb") as reader:
+          shards[num_workers].append(reader.read())
+      manifests[num_workers] = manifest
+
+    # The output does not depend on the number of workers.
+    self.assertEqual(shards[1], shards[2])
+    for key in ("random_seed", "num_instances"):
+      self.assertEqual(manifests[1][key], manifests[2][key])
+    for (shard_1, shard_2) in zip(manifests[1]["shards"],
+                                  manifests[2]["shards"]):
+      for key in ("shard_id", "input_files", "seed", "num_instances"):
+        self.assertEqual(shard_1[key], shard_2[key])
+
+    manifest = manifests[1]
+    self.assertEqual([shard["seed"] for shard in manifest["shards"]], [
+        create_pretraining_data.shard_seed(12345, shard_id)
+        for shard_id in range(2)
+    ])
+    self.assertGreater(manifest["shards"][0]["num_instances"], 0)
+    self.assertEqual(manifest["num_instances"],
+                     sum(shard["num_instances"]
+                         for shard in manifest["shards"]))
+    for shard in manifest["shards"]:
+      self.assertEqual(
+          len(list(tf.python_io.tf_record_iterator(shard["output_file"]))),
+          shard["num_instances"])
+
+  def _record_calls(self, calls):
+    """Patches `create_instances_from_document` to record what it makes.
+
+    Every call appends the window of documents it drew from and the
+    instances it made to `calls`.
+    """
+    create_instances_from_document = (
+        create_pretraining_data.create_instances_from_document)
+
+    def recording_create_instances_from_document(all_documents, *args):
+      instances = create_instances_from_document(all_documents, *args)
+      calls.append((list(all_documents), instances))
+      return instances
+
+    return tf.test.mock.patch.object(
+        create_pretraining_data, "create_instances_from_document",
+        recording_create_instances_from_document)
+
+  def test_streaming_instances(self):
+    tokenizer = self._create_full_tokenizer(_VOCAB_TOKENS)
+    input_file = self._write_corpus(
+        os.path.join(self.get_temp_dir(), "corpus.txt"), 30, seed=1)
+    with io.open(input_file, encoding="utf-8") as reader:
+      num_lines = len(reader.readlines())
+
+    tokenize_to_ids = tokenizer.tokenize_to_ids
+    tokenized_lines = []
+
+    def counting_tokenize_to_ids(text, *args, **kwargs):
+      tokenized_lines.append(text)
+      return tokenize_to_ids(text, *args, **kwargs)
+
+    tokenizer.tokenize_to_ids = counting_tokenize_to_ids
+
+    def create_instances(memory_mb, shuffle, calls):
+      with self._record_calls(calls):
+        for instance in (
+            create_pretraining_data.create_training_instances_streaming(
+                [input_file], tokenizer, max_seq_length=32, dupe_factor=5,
+                short_seq_prob=0.1, masked_lm_prob=0.15,
+                max_predictions_per_seq=5, rng=random.Random(12345),
+                memory_mb=memory_mb, shuffle=shuffle)):
+          yield instance
+
+    # Without `shuffle`, every instance comes out once, as it is created.
+    calls = []
+    instances = list(create_instances(1, False, calls))
+    created = [x for (_, call_instances) in calls for x in call_instances]
+    self.assertGreater(len(instances), 0)
+    self.assertEqual([id(x) for x in instances], [id(x) for x in created])
+    # The input is read and tokenized once, whatever the `dupe_factor`.
+    self.assertEqual(len(tokenized_lines), num_lines)
+    self.assertEqual(len(calls), 30 * 5)
+
+    # With a tiny `memory_mb`, the window and the shuffle buffer stay within
+    # their share of it, and no instance is lost.
+    memory_mb = 0.001
+    memory_bytes = memory_mb * 1024 * 1024
+    max_window_tokens = (
+        memory_bytes // 4 //
+        create_pretraining_data._DOCUMENT_BYTES_PER_TOKEN)
+    max_buffer_tokens = (
+        memory_bytes * 3 // 4 //
+        create_pretraining_data._INSTANCE_BYTES_PER_TOKEN)
+    calls = []
+    instances = []
+    for instance in create_instances(memory_mb, True, calls):
+      instances.append(instance)
+      # What has been created but not yielded yet is the shuffle buffer
+      # (which may go over its limit by the instance just added) and the
+      # instances of the last call that were not added to it yet.
+      created_tokens = sum(
+          len(x.input_ids) for (_, call_instances) in calls
+          for x in call_instances)
+      yielded_tokens = sum(len(x.input_ids) for x in instances)
+      last_call_tokens = sum(len(x.input_ids) for x in calls[-1][1])
+      self.assertLessEqual(created_tokens - yielded_tokens,
+                           max_buffer_tokens + last_call_tokens)
+    created = [x for (_, call_instances) in calls for x in call_instances]
+    self.assertEqual(sorted(id(x) for x in instances),
+                     sorted(id(x) for x in created))
+    self.assertNotEqual([id(x) for x in instances], [id(x) for x in created])
+    # Only the newest document may push the window over its limit.
+    for (window, _) in calls:
+      window_tokens = sum(
+          len(sentence) for document in window for sentence in document)
+      if len(window) > 1:
+        self.assertLessEqual(window_tokens, max_window_tokens)
+    self.assertLess(max(len(window) for (window, _) in calls), 30)
+
+  def test_document_store(self):
+    tokenizer = self._create_full_tokenizer(_VOCAB_TOKENS)
+    temp_dir = self.get_temp_dir()
+    store_dir = os.path.join(temp_dir, "store")
+    input_files = [
+        self._write_corpus(
+            os.path.join(temp_dir, "store-corpus-%d.txt" % i), 10, seed=i)
+        for i in range(2)
+    ]
+
+    def as_lists(documents):
+      return [[list(sentence) for sentence in document]
+              for document in documents]
+
+    store = create_pretraining_data.load_document_store(
+        store_dir, input_files, tokenizer)
+    expected = as_lists(
+        create_pretraining_data.read_documents(input_files, tokenizer))
+    self.assertEqual(len(store), 20)
+    self.assertEqual(as_lists(store), expected)
+    self.assertEqual(
+        as_lists(create_pretraining_data.DocumentStore(store.path)), expected)
+    self.assertEqual(list(store[3][0]), expected[3][0])
+    with self.assertRaises(IndexError):
+      store[20]  # pylint: disable=pointless-statement
+
+    # The same input loads the same store.
+    self.assertEqual(
+        create_pretraining_data.load_document_store(store_dir, input_files,
+                                                    tokenizer).path,
+        store.path)
+
+    # A new modification time or size makes a new store.
+    stat = os.stat(input_files[1])
+    os.utime(input_files[1], (stat.st_atime, stat.st_mtime + 10))
+    touched_store = create_pretraining_data.load_document_store(
+        store_dir, input_files, tokenizer)
+    self.assertNotEqual(touched_store.path, store.path)
+    self.assertEqual(as_lists(touched_store), expected)
+
+    with io.open(input_files[1], "a", encoding="utf-8") as writer:
+      writer.write(u"the cat sat\n")
+    os.utime(input_files[1], (stat.st_atime, stat.st_mtime + 10))
+    grown_store = create_pretraining_data.load_document_store(
+        store_dir, input_files, tokenizer)
+    self.assertNotEqual(grown_store.path, touched_store.path)
+    self.assertEqual(len(grown_store), 21)
+    self.assertEqual(
+        as_lists(grown_store),
+        as_lists(
+            create_pretraining_data.read_documents(input_files, tokenizer)))
+    self.assertEqual(
+        sorted(os.listdir(store_dir)),
+        sorted(
+            os.path.basename(x.path)
+            for x in [store, touched_store, grown_store]))
+
+    # An empty corpus makes an empty store.
+    empty_file = os.path.join(temp_dir, "empty.txt")
+    with io.open(empty_file, "w", encoding="utf-8") as writer:
+      writer.write(u"\n\n")
+    empty_store = create_pretraining_data.load_document_store(
+        store_dir, [empty_file], tokenizer)
+    self.assertEqual(len(empty_store), 0)
+    self.assertEqual(list(empty_store), [])
+
+  def test_pack_instances(self):
+    rng = random.Random(12345)
+    instances = []
+    for _ in range(200):
+      len_a = rng.randint(1, 20)
+      instances.append(
+          self._create_instance(len_a, rng.randint(1, 20), rng,
+                                num_predictions=rng.randint(0, min(len_a, 6))))
+
+    stats = create_pretraining_data.PackingStats()
+    packs = list(
+        create_pretraining_data.pack_instances(
+            instances, max_seq_length=64, max_predictions_per_seq=10,
+            max_sequences_per_pack=3, stats=stats, max_open_packs=4))
+
+    for pack in packs:
+      self.assertGreater(len(pack), 0)
+      self.assertLessEqual(len(pack), 3)
+      self.assertLessEqual(sum(len(x.input_ids) for x in pack), 64)
+      self.assertLessEqual(sum(len(x.masked_lm_positions) for x in pack), 10)
+    # Every instance is packed exactly once.
+    packed_ids = sorted(id(x) for pack in packs for x in pack)
+    self.assertEqual(packed_ids, sorted(id(x) for x in instances))
+    self.assertLess(len(packs), len(instances))
+
+    self.assertEqual(stats.num_instances, len(instances))
+    self.assertEqual(stats.num_packs, len(packs))
+    self.assertEqual(stats.num_tokens,
+                     sum(len(x.input_ids) for x in instances))
+
+  def test_mask_instance_batch(self):
+    vocab = create_pretraining_data.InstanceVocab(
+        cls_id=_VOCAB_TOKENS.index("[CLS]"),
+        sep_id=_VOCAB_TOKENS.index("[SEP]"),
+        mask_id=_VOCAB_TOKENS.index("[MASK]"),
+        vocab_ids=list(range(len(_VOCAB_TOKENS))))
+    rng = random.Random(12345)
+    # Instances of different lengths, so the shorter ones are padded in the
+    # batch.
+    instances = [
+        self._create_instance(rng.randint(1, 30), rng.randint(1, 30), rng)
+        for _ in range(2000)
+    ]
+    unmasked_ids = [array.array("i", x.input_ids) for x in instances]
+
+    create_pretraining_data.mask_instance_batch(
+        instances, masked_lm_prob=0.15, max_predictions_per_seq=5,
+        vocab=vocab, np_rng=np.random.default_rng(12345))
+
+    num_predictions = 0
+    num_masked = 0
+    num_kept = 0
+    for (instance, original_ids) in zip(instances, unmasked_ids):
+      length = len(original_ids)
+      self.assertEqual(len(instance.input_ids), length)
+      positions = list(instance.masked_lm_positions)
+      self.assertEqual(len(positions),
+                       min(5, max(1, int(np.rint(length * 0.15)))))
+      self.assertEqual(positions, sorted(set(positions)))
+      # No position is in the padding of the batch.
+      self.assertLess(max(positions), length)
+      self.assertEqual(list(instance.masked_lm_ids),
+                       [original_ids[x] for x in positions])
+      for position in range(length):
+        if position in positions:
+          self.assertNotIn(original_ids[position],
+                           [vocab.cls_id, vocab.sep_id])
+        else:
+          # [CLS], [SEP] and the other unpredicted tokens are left alone.
+          self.assertEqual(instance.input_ids[position],
+                           original_ids[position])
+
+      num_predictions += len(positions)
+      for position in positions:
+        if instance.input_ids[position] == vocab.mask_id:
+          num_masked += 1
+        elif instance.input_ids[position] == original_ids[position]:
+          num_kept += 1
+
+    # 80% [MASK], 10% unchanged and 10% random. With this small vocabulary,
+    # about 1 in 12 random tokens is [MASK] or the original token.
+    self.assertAllClose(num_masked / num_predictions, 0.8, atol=0.02)
+    self.assertAllClose(num_kept / num_predictions, 0.1, atol=0.02)
+    self.assertAllClose((num_predictions - num_masked - num_kept) /
+                        num_predictions, 0.1, atol=0.02)
+
+  def _shuffle_records(self, records, name, seed):
+    """Returns the records that `external_shuffle` writes, by output file."""
+    output_dir = os.path.join(self.get_temp_dir(), name)
+    tf.gfile.MakeDirs(output_dir)
+    output_files = [
+        os.path.join(output_dir, "output-%d.tfrecord" % i) for i in range(2)
+    ]
+    num_written = create_pretraining_data.external_shuffle(
+        iter(records), output_files, num_buckets=4, rng=random.Random(seed))
+    self.assertEqual(num_written, len(records))
+    # The temporary buckets are removed.
+    self.assertFalse(tf.gfile.Exists(output_files[0] + ".shuffle-tmp"))
+    return [
+        list(tf.python_io.tf_record_iterator(output_file))
+        for output_file in output_files
+    ]
+
+  def test_external_shuffle(self):
+    records = [("record-%d" % i).encode("utf-8") for i in range(100)]
+
+    shuffled = self._shuffle_records(records, "a", seed=12345)
+    # Round-robin into the output files, and a permutation of the input.
+    self.assertEqual([len(x) for x in shuffled], [50, 50])
+    all_shuffled = shuffled[0] + shuffled[1]
+    self.assertEqual(sorted(all_shuffled), sorted(records))
+    self.assertNotEqual(shuffled[0], records[0::2])
+
+    # The order only depends on the seed.
+    self.assertEqual(self._shuffle_records(records, "b", seed=12345), shuffled)
+    self.assertNotEqual(self._shuffle_records(records, "c", seed=54321),
+                        shuffled)
+
+  def test_packed_examples(self):
+    tokenizer = self._create_full_tokenizer(_VOCAB_TOKENS)
+    rng = random.Random(12345)
+    instances = [
+        self._create_instance(1, 1, rng, num_predictions=1),
+        self._create_instance(2, 1, rng, num_predictions=1,
+                              is_random_next=True),
+        self._create_instance(3, 1, rng, num_predictions=2),
+    ]
+    # The first two fill a pack of two sequences, the third does not fit.
+    packs = list(
+        create_pretraining_data.pack_instances(
+            instances, max_seq_length=12, max_predictions_per_seq=4,
+            max_sequences_per_pack=2))
+    self.assertEqual(packs, [instances[0:2], instances[2:3]])
+
+    records = list(
+        create_pretraining_data.serialize_instances(
+            packs, tokenizer, max_seq_length=12, max_predictions_per_seq=4,
+            max_sequences_per_pack=2))
+    features = tf.train.Example.FromString(records[0]).features.feature
+
+    def values(name):
+      feature = features[name]
+      return list(feature.int64_list.value or feature.float_list.value)
+
+    self.assertEqual(
+        values("input_ids"),
+        list(instances[0].input_ids) + list(instances[1].input_ids) + [0])
+    self.assertEqual(values("input_mask"), [1] * 11 + [0])
+    self.assertEqual(values("segment_ids"),
+                     [0, 0, 0, 1, 1, 0, 0, 0, 0, 1, 1, 0])
+    # Positions restart for every sequence, and padding is sequence 0.
+    self.assertEqual(values("position_ids"),
+                     [0, 1, 2, 3, 4, 0, 1, 2, 3, 4, 5, 0])
+    self.assertEqual(values("sequence_ids"),
+                     [1, 1, 1, 1, 1, 2, 2, 2, 2, 2, 2, 0])
+    self.assertEqual(
+        values("masked_lm_positions"),
+        [instances[0].masked_lm_positions[0],
+         5 + instances[1].masked_lm_positions[0], 0, 0])
+    self.assertEqual(
+        values("masked_lm_ids"),
+        list(instances[0].masked_lm_ids) + list(instances[1].masked_lm_ids) +
+        [0, 0])
+    self.assertEqual(values("masked_lm_weights"), [1.0, 1.0, 0.0, 0.0])
+    self.assertEqual(values("next_sentence_positions"), [0, 5])
+    self.assertEqual(values("next_sentence_labels"), [0, 1])
+    self.assertEqual(values("next_sentence_weights"), [1.0, 1.0])
+
+    # The second pack has one sequence, and a padded next sentence label.
+    features = tf.train.Example.FromString(records[1]).features.feature
+    self.assertEqual(values("sequence_ids"), [1] * 7 + [0] * 5)
+    self.assertEqual(values("next_sentence_positions"), [0, 0])
+    self.assertEqual(values("next_sentence_weights"), [1.0, 0.0])
+
+    # The sequence ids make a block-diagonal attention mask.
+    sequence_ids = np.array(
+        [[1, 1, 1, 1, 1, 2, 2, 2, 2, 2, 2, 0]], dtype=np.int32)
+    expected_mask = np.zeros([1, 12, 12], dtype=np.float32)
+    expected_mask[0, 0:5, 0:5] = 1.0
+    expected_mask[0, 5:11, 5:11] = 1.0
+    with self.test_session() as sess:
+      mask = sess.run(
+          modeling.create_attention_mask_from_sequence_ids(
+              tf.constant(sequence_ids)))
+    self.assertAllEqual(mask, expected_mask)
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -0,0 +1,417 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tokenization as TensorFlow ops, for tokenizing raw text inside `input_fn`.
+
+`GraphTokenizer` produces the same wordpiece ids as
+`tokenization.FullTokenizer`, but as part of the graph, so a `tf.data`
+pipeline can tokenize raw text with `num_parallel_calls` while the model
+trains instead of in a separate preprocessing step. For example:
+
+  def input_fn(params):
+    tokenizer = graph_tokenization.GraphTokenizer(vocab_file)
+    d = tf.data.TextLineDataset(input_files)
+    d = tokenizer.encode_dataset(d, max_length=128, num_parallel_calls=8)
+    return d.batch(params["batch_size"], drop_remainder=True)
+
+The character classification tables and the lower casing map are generated
+from the ones in `tokenization.py`, and vocabulary lookups use a hash table
+built from the same vocab file.
+
+Lower casing is applied one character at a time, so the two context-sensitive
+cases of `unicode.lower()` on a whole word are not reproduced: a word-final
+capital sigma becomes "σ" rather than "ς", and combining marks that are not
+stripped as accents are not canonically reordered. Invalid UTF-8 is dropped
+byte-wise by the decoder rather than by Python's codec, which can keep or
+drop slightly different characters around the invalid bytes.
+
+This needs TensorFlow 1.13 or later for the `tf.strings.unicode_*` ops.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import unicodedata
+import numpy as np
+import six
+import tensorflow as tf
+import tokenization
+
+if not hasattr(getattr(tf, "strings", None), "unicode_decode"):
+  raise ImportError(
+      "graph_tokenization needs TensorFlow 1.13 or later for the "
+      "`tf.strings.unicode_*` ops, but TensorFlow %s is installed." %
+      tf.__version__)
+
+
+class GraphTokenizer(object):
+  """Runs end-to-end tokenization as TensorFlow ops."""
+
+  def __init__(self,
+               vocab_file,
+               do_lower_case=True,
+               unk_token="[UNK]",
+               max_input_chars_per_word=100):
+    self.vocab = tokenization.load_vocab(vocab_file)
+    self.do_lower_case = do_lower_case
+    self.unk_token = unk_token
+    self.max_input_chars_per_word = max_input_chars_per_word
+    self.unk_id = self.vocab[unk_token]
+    self.cls_id = self.vocab["[CLS]"]
+    self.sep_id = self.vocab["[SEP]"]
+    # Candidate pieces longer than the longest vocabulary entry can never
+    # match, so they are never looked up.
+    self.max_piece_chars = min(
+        max([len(token) for token in self.vocab] + [1]),
+        max_input_chars_per_word)
+    self._tables = None
+    self._tables_graph = None
+
+  def tokenize_to_ids(self, text):
+    """Tokenizes a scalar string tensor into an int32 vector of wordpiece ids.
+
+    This is the graph equivalent of `FullTokenizer.tokenize_to_ids`.
+    """
+    return self._tokenize_to_ids(text, self._get_tables())
+
+  def encode(self, text, pair=None, max_length=128):
+    """Tokenizes text (and an optional second segment) into model inputs.
+
+    This is the graph equivalent of `FullTokenizer.encode`.
+
+    Args:
+      text: A scalar string tensor.
+      pair: Optional scalar string tensor with the second segment. An empty
+        second segment is treated like a missing one.
+      max_length: The (static) length of the outputs.
+
+    Returns:
+      A dict with int32 `input_ids`, `input_mask` and `segment_ids` tensors of
+      shape [max_length].
+    """
+    return self._encode(text, pair, max_length, self._get_tables())
+
+  def encode_dataset(self, dataset, max_length, num_parallel_calls=None):
+    """Maps a dataset of raw text to model inputs with `encode`.
+
+    Args:
+      dataset: A `tf.data.Dataset` of scalar strings, or of
+        `(text, pair)` tuples of scalar strings.
+      max_length: The length of the outputs.
+      num_parallel_calls: Passed to `Dataset.map`.
+
+    Returns:
+      A dataset of dicts with `input_ids`, `input_mask` and `segment_ids`.
+    """
+    # The tables have to be created outside of the function `Dataset.map`
+    # traces, which then captures them.
+    tables = self._get_tables()
+
+    def encode_fn(text, pair=None):
+      return self._encode(text, pair, max_length, tables)
+
+    return dataset.map(encode_fn, num_parallel_calls=num_parallel_calls)
+
+  def _get_tables(self):
+    """Returns the lookup tables for the current graph, creating them once."""
+    graph = tf.get_default_graph()
+    if self._tables is None or self._tables_graph is not graph:
+      keys = list(self.vocab.keys())
+      vocab_table = tf.contrib.lookup.HashTable(
+          tf.contrib.lookup.KeyValueTensorInitializer(
+              keys,
+              np.array([self.vocab[key] for key in keys], dtype=np.int64),
+              key_dtype=tf.string,
+              value_dtype=tf.int64), -1)
+      fold_table = None
+      if self.do_lower_case:
+        (fold_keys, _) = _lower_case_fold_map()
+        fold_table = tf.contrib.lookup.HashTable(
+            tf.contrib.lookup.KeyValueTensorInitializer(
+                fold_keys,
+                np.arange(len(fold_keys), dtype=np.int64),
+                key_dtype=tf.int64,
+                value_dtype=tf.int64), -1)
+      self._tables = (vocab_table, fold_table)
+      self._tables_graph = graph
+    return self._tables
+
+  def _encode(self, text, pair, max_length, tables):
+    ids_a = self._tokenize_to_ids(text, tables)
+    if pair is None:
+      (input_ids, segment_ids) = self._frame_single(ids_a, max_length)
+    else:
+      ids_b = self._tokenize_to_ids(pair, tables)
+      (input_ids, segment_ids) = tf.cond(
+          tf.size(ids_b) > 0,
+          lambda: self._frame_pair(ids_a, ids_b, max_length),
+          lambda: self._frame_single(ids_a, max_length))
+
+    padding = [[0, max_length - tf.size(input_ids)]]
+    input_mask = tf.pad(tf.ones_like(input_ids), padding)
+    input_ids = tf.pad(input_ids, padding)
+    segment_ids = tf.pad(segment_ids, padding)
+    for tensor in (input_ids, input_mask, segment_ids):
+      tensor.set_shape([max_length])
+    return {
+        "input_ids": input_ids,
+        "input_mask": input_mask,
+        "segment_ids": segment_ids,
+    }
+
+  def _frame_single(self, ids_a, max_length):
+    # Account for [CLS] and [SEP] with "- 2"
+    ids_a = ids_a[0:max_length - 2]
+    input_ids = tf.concat([[self.cls_id], ids_a, [self.sep_id]], 0)
+    return (input_ids, tf.zeros_like(input_ids))
+
+  def _frame_pair(self, ids_a, ids_b, max_length):
+    # Account for [CLS], [SEP], [SEP] with "- 3". This is
+    # `tokenization._truncated_pair_lengths`.
+    limit = max_length - 3
+    len_a = tf.size(ids_a)
+    len_b = tf.size(ids_b)
+    fits = len_a + len_b <= limit
+    a_short = len_a <= limit // 2
+    b_short = len_b <= limit // 2
+    new_len_a = tf.where(
+        fits | a_short, len_a,
+        tf.where(b_short, limit - len_b, (limit + 1) // 2))
+    new_len_b = tf.where(
+        fits, len_b,
+        tf.where(a_short, limit - len_a,
+                 tf.where(b_short, len_b, limit // 2)))
+    first = tf.concat([[self.cls_id], ids_a[0:new_len_a], [self.sep_id]], 0)
+    second = tf.concat([ids_b[0:new_len_b], [self.sep_id]], 0)
+    return (tf.concat([first, second], 0),
+            tf.concat([tf.zeros_like(first), tf.ones_like(second)], 0))
+
+  def _tokenize_to_ids(self, text, tables):
+    (vocab_table, fold_table) = tables
+    cps = tf.strings.unicode_decode(text, "UTF-8", errors="ignore")
+    flags = _lookup_char_flags(cps)
+    keep = tf.equal(_flag(flags, tokenization._REMOVED), 0)
+    cps = tf.boolean_mask(cps, keep)
+    flags = tf.boolean_mask(flags, keep)
+
+    # Words are separated by whitespace, and every CJK character is a word of
+    # its own.
+    is_separator = tf.not_equal(_flag(flags, tokenization._SEPARATOR), 0)
+    is_chinese = tf.not_equal(_flag(flags, tokenization._CHINESE), 0)
+    after_boundary = tf.concat(
+        [[True], tf.logical_or(is_separator, is_chinese)[:-1]], 0)
+    word_start = tf.logical_and(
+        tf.logical_not(is_separator),
+        tf.logical_or(is_chinese, after_boundary))
+    word_ids = tf.cumsum(tf.cast(word_start, tf.int32))
+    in_word = tf.logical_not(is_separator)
+    cps = tf.boolean_mask(cps, in_word)
+    word_ids = tf.boolean_mask(word_ids, in_word)
+
+    if self.do_lower_case:
+      (cps, word_ids) = self._fold_chars(cps, word_ids, fold_table)
+
+    # Every punctuation character (after normalization) is a token of its
+    # own, and the rest of each word is split around them.
+    is_punctuation = tf.not_equal(
+        _flag(_lookup_char_flags(cps), tokenization._PUNCTUATION), 0)
+    token_start = tf.logical_or(
+        tf.not_equal(word_ids, tf.concat([[-1], word_ids[:-1]], 0)),
+        tf.logical_or(is_punctuation,
+                      tf.concat([[False], is_punctuation[:-1]], 0)))
+    return self._wordpiece(cps, token_start, vocab_table)
+
+  def _fold_chars(self, cps, word_ids, fold_table):
+    """Lower cases, NFD normalizes and strips accents one char at a time."""
+    (_, fold_values) = _lower_case_fold_map()
+    width = fold_values.shape[1]
+    index = fold_table.lookup(tf.cast(cps, tf.int64))
+    folded = tf.gather(fold_values, tf.maximum(index, 0))
+    unchanged = tf.concat(
+        [tf.expand_dims(cps, 1),
+         tf.fill(tf.stack([tf.size(cps), width - 1]), -1)], 1)
+    folded = tf.where(index >= 0, folded, unchanged)
+    # Unused slots (and the characters of accents that are stripped entirely)
+    # are -1.
+    valid = folded >= 0
+    return (tf.boolean_mask(folded, valid),
+            tf.boolean_mask(
+                tf.tile(tf.expand_dims(word_ids, 1), [1, width]), valid))
+
+  def _wordpiece(self, cps, token_start, vocab_table):
+    """Runs greedy longest-match-first WordPiece over every token at once."""
+    num_chars = tf.size(cps)
+    positions = tf.range(num_chars)
+    token_begin = tf.boolean_mask(positions, token_start)
+    token_end = tf.concat([token_begin[1:], [num_chars]], 0)
+    char_token_end = tf.gather(
+        token_end, tf.cumsum(tf.cast(token_start, tf.int32)) - 1)
+
+    # Look up every candidate piece `chars[p:p + length]` (with a "##" prefix
+    # unless `p` starts a token) that stays inside its token, and keep the
+    # longest match at each position.
+    max_piece_chars = self.max_piece_chars
+    chars = tf.strings.unicode_encode(tf.expand_dims(cps, 1), "UTF-8")
+    chars = tf.concat([chars, tf.fill([max_piece_chars], "")], 0)
+    candidate = tf.where(token_start, tf.fill([num_chars], ""),
+                         tf.fill([num_chars], "##"))
+    match_length = tf.zeros([num_chars], dtype=tf.int32)
+    match_id = tf.fill([num_chars], tf.constant(-1, dtype=tf.int64))
+    for length in range(1, max_piece_chars + 1):
+      candidate = tf.strings.join(
+          [candidate, tf.gather(chars, positions + length - 1)])
+      piece_id = vocab_table.lookup(candidate)
+      found = tf.logical_and(positions + length <= char_token_end,
+                             piece_id >= 0)
+      match_length = tf.where(found, tf.fill([num_chars], length),
+                              match_length)
+      match_id = tf.where(found, piece_id, match_id)
+
+    # Walk all tokens in lockstep, each iteration emitting one more piece of
+    # every token that is neither finished nor known to be unknown.
+    def active_mask(cursor, failed):
+      return tf.logical_and(cursor < token_end, tf.logical_not(failed))
+
+    def cond(cursor, failed, pieces):
+      del pieces  # Unused.
+      return tf.reduce_any(active_mask(cursor, failed))
+
+    def body(cursor, failed, pieces):
+      active = active_mask(cursor, failed)
+      safe_cursor = tf.minimum(cursor, num_chars - 1)
+      length = tf.gather(match_length, safe_cursor)
+      emit = tf.logical_and(active, length > 0)
+      failed = tf.logical_or(failed, tf.logical_and(active,
+                                                    tf.equal(length, 0)))
+      piece = tf.where(emit, tf.gather(match_id, safe_cursor),
+                       tf.fill(tf.shape(cursor), tf.constant(-1, tf.int64)))
+      pieces = tf.concat([pieces, tf.expand_dims(piece, 1)], 1)
+      cursor = tf.where(emit, cursor + length, cursor)
+      return (cursor, failed, pieces)
+
+    num_tokens = tf.size(token_begin)
+    too_long = token_end - token_begin > self.max_input_chars_per_word
+    (_, failed, pieces) = tf.while_loop(
+        cond,
+        body, [
+            token_begin, too_long,
+            tf.fill(tf.stack([num_tokens, 1]), tf.constant(-1, tf.int64))
+        ],
+        shape_invariants=[
+            token_begin.shape, too_long.shape,
+            tf.TensorShape([None, None])
+        ],
+        back_prop=False)
+
+    # Tokens that cannot be fully split become a single unknown token.
+    failed = tf.logical_and(
+        tf.expand_dims(failed, 1), tf.ones_like(pieces, dtype=tf.bool))
+    first_column = tf.equal(tf.zeros_like(pieces, dtype=tf.int32),
+                            tf.expand_dims(tf.range(tf.shape(pieces)[1]), 0))
+    pieces = tf.where(failed, tf.fill(tf.shape(pieces),
+                                      tf.constant(-1, tf.int64)), pieces)
+    pieces = tf.where(
+        tf.logical_and(failed, first_column),
+        tf.fill(tf.shape(pieces), tf.constant(self.unk_id, tf.int64)), pieces)
+    pieces = tf.reshape(pieces, [-1])
+    return tf.cast(tf.boolean_mask(pieces, pieces >= 0), tf.int32)
+
+
+def _flag(flags, bit):
+  return tf.bitwise.bitwise_and(flags, bit)
+
+
+def _lookup_char_flags(cps):
+  """Looks up the `tokenization` classification flags of codepoints."""
+  (table, plane_offsets, plane_fill) = _char_flag_tables()
+  plane = tf.bitwise.right_shift(cps, 16)
+  offset = tf.gather(plane_offsets, plane)
+  flags = tf.gather(table,
+                    tf.maximum(offset, 0) + tf.bitwise.bitwise_and(cps, 0xFFFF))
+  return tf.where(offset >= 0, tf.cast(flags, tf.int32),
+                  tf.gather(plane_fill, plane))
+
+
+# Memoized results of `_char_flag_tables` and `_lower_case_fold_map`.
+_CHAR_FLAG_TABLES = None
+_LOWER_CASE_FOLD_MAP = None
+
+
+def _char_flag_tables():
+  """Packs the `tokenization` classification tables into NumPy arrays.
+
+  Most Unicode planes consist entirely of unassigned or private use
+  codepoints that all have the same flags, so only the other planes are
+  stored.
+
+  Returns:
+    A `(table, plane_offsets, plane_fill)` tuple. Codepoint `cp` has flags
+    `table[plane_offsets[cp >> 16] + (cp & 0xFFFF)]`, or `plane_fill[cp >> 16]`
+    if that offset is -1.
+  """
+  global _CHAR_FLAG_TABLES
+  if _CHAR_FLAG_TABLES is None:
+    tables = []
+    plane_offsets = np.full(17, -1, dtype=np.int32)
+    plane_fill = np.zeros(17, dtype=np.int32)
+    for plane in range(17):
+      flags = np.frombuffer(
+          bytes(tokenization._char_flag_plane(plane)), dtype=np.uint8)
+      if (flags == flags[0]).all():
+        plane_fill[plane] = flags[0]
+      else:
+        plane_offsets[plane] = 0x10000 * len(tables)
+        tables.append(flags)
+    _CHAR_FLAG_TABLES = (np.concatenate(tables), plane_offsets, plane_fill)
+  return _CHAR_FLAG_TABLES
+
+
+def _lower_case_fold_map():
+  """Builds the per-character lower casing and accent stripping map.
+
+  Returns:
+    A `(keys, values)` tuple. `keys` holds every codepoint that lower casing,
+    NFD normalization and accent stripping change, and row `i` of `values`
+    holds the codepoints `keys[i]` turns into, padded with -1.
+  """
+  global _LOWER_CASE_FOLD_MAP
+  if _LOWER_CASE_FOLD_MAP is None:
+    (table, plane_offsets, _) = _char_flag_tables()
+    keys = []
+    folds = []
+    for plane in range(17):
+      if plane_offsets[plane] < 0:
+        continue
+      for low in range(0x10000):
+        flags = table[plane_offsets[plane] + low]
+        if flags & (tokenization._REMOVED | tokenization._SEPARATOR):
+          continue
+        cp = (plane << 16) + low
+        char = six.unichr(cp)
+        fold = [
+            ord(c)
+            for c in unicodedata.normalize("NFD", char.lower())
+            if not tokenization._codepoint_flags(ord(c)) &
+            tokenization._NONSPACING_MARK
+        ]
+        if fold != [cp]:
+          keys.append(cp)
+          folds.append(fold)
+    width = max([len(fold) for fold in folds] + [1])
+    values = np.full((len(folds), width), -1, dtype=np.int32)
+    for (i, fold) in enumerate(folds):
+      values[i, 0:len(fold)] = fold
+    _LOWER_CASE_FOLD_MAP = (np.array(keys, dtype=np.int64), values)
+  return _LOWER_CASE_FOLD_MAP
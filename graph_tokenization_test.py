@@ -0,0 +1,94 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import tempfile
+
+import graph_tokenization
+import tokenization
+import tensorflow as tf
+
+
+class GraphTokenizationTest(tf.test.TestCase):
+
+  vocab_tokens = [
+      "[UNK]", "[CLS]", "[SEP]", "want", "##want", "##ed", "wa", "un", "runn",
+      "##ing", ",", "hello", "!", "how", "are", "you", "?", "ah", u"\u535A",
+      u"\u63A8", "zz", "##zz", "ete", "e", "`", "f", "HeLLo", "Are", "##U",
+      "yo", "##yo", "abcd", "a", "##b"
+  ]
+
+  texts = [
+      u"UNwant\u00E9d,running", u" \tHeLLo!how  \n Are yoU?  ",
+      u"ah\u535A\u63A8zz", u"ab\u0000c\uFFFDd\u2028e\u1FEFF\u00AD",
+      u"\u00C9t\u00E9\u535Ax", u"unwantedX running", u"", u"  ",
+      u"a" * 120 + u" ab", u"yoyoyo,yoU\u0301", u"\U0002070E\U000E0100ab"
+  ]
+
+  def _create_vocab_file(self):
+    with tempfile.NamedTemporaryFile(delete=False) as vocab_writer:
+      vocab_writer.write("".join([x + "\n" for x in self.vocab_tokens]).encode(
+          "utf-8"))
+      return vocab_writer.name
+
+  def test_tokenize_to_ids_parity(self):
+    vocab_file = self._create_vocab_file()
+    for do_lower_case in (True, False):
+      tokenizer = tokenization.FullTokenizer(
+          vocab_file, do_lower_case=do_lower_case)
+      graph_tokenizer = graph_tokenization.GraphTokenizer(
+          vocab_file, do_lower_case=do_lower_case)
+
+      with tf.Graph().as_default() as graph:
+        text = tf.placeholder(tf.string, shape=[])
+        ids = graph_tokenizer.tokenize_to_ids(text)
+        with self.test_session(graph=graph) as sess:
+          sess.run(tf.tables_initializer())
+          for t in self.texts:
+            self.assertAllEqual(
+                sess.run(ids, feed_dict={text: t.encode("utf-8")}),
+                tokenizer.tokenize_to_ids(t))
+    os.unlink(vocab_file)
+
+  def test_encode_dataset(self):
+    vocab_file = self._create_vocab_file()
+    tokenizer = tokenization.FullTokenizer(vocab_file)
+    graph_tokenizer = graph_tokenization.GraphTokenizer(vocab_file)
+    pairs = [(u"unwanted running", u"want"), (u"want", u""),
+             (u"UNwant\u00E9d,running " * 5, u"how are you " * 5)]
+
+    with tf.Graph().as_default() as graph:
+      dataset = tf.data.Dataset.from_tensor_slices(
+          ([a for (a, _) in pairs], [b for (_, b) in pairs]))
+      dataset = graph_tokenizer.encode_dataset(
+          dataset, max_length=16, num_parallel_calls=2)
+      iterator = tf.data.make_initializable_iterator(dataset)
+      features = iterator.get_next()
+      with self.test_session(graph=graph) as sess:
+        sess.run([tf.tables_initializer(), iterator.initializer])
+        for (a, b) in pairs:
+          expected = tokenizer.encode(a, pair=b, max_length=16)
+          actual = sess.run(features)
+          self.assertAllEqual(actual["input_ids"], expected.input_ids)
+          self.assertAllEqual(actual["input_mask"], expected.input_mask)
+          self.assertAllEqual(actual["segment_ids"], expected.segment_ids)
+    os.unlink(vocab_file)
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -0,0 +1,292 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Learns a WordPiece vocabulary from a text corpus.
+
+The corpus is streamed through `BasicTokenizer` (so the words are exactly the
+ones `WordpieceTokenizer` will later see), the words are counted in bounded
+memory, and pieces are built up from single characters by repeatedly merging
+the most frequent pair of adjacent pieces, as in byte pair encoding. The
+result is written in the vocab.txt format read by `tokenization.load_vocab`.
+
+Example:
+  python learn_vocab.py \
+    --input_file=./sample_text.txt \
+    --output_file=/tmp/vocab.txt \
+    --vocab_size=8000 \
+    --compare_vocab_file=$BERT_BASE_DIR/vocab.txt
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import collections
+import glob
+import heapq
+import io
+
+import tokenization
+
+
+class BoundedCounter(object):
+  """Counts items while keeping at most `max_size` distinct ones in memory.
+
+  Whenever the limit is exceeded, the least frequent half of the items is
+  dropped. An item that is frequent over the whole stream can only be
+  dropped while its count is still low, so the counts of the frequent items,
+  which are the ones that matter for the vocabulary, come out close to exact.
+  """
+
+  def __init__(self, max_size):
+    self.max_size = max_size
+    self.counts = collections.defaultdict(int)
+    # The highest count that has been dropped so far.
+    self.max_dropped_count = 0
+
+  def add(self, item, count=1):
+    self.counts[item] += count
+    if len(self.counts) > self.max_size:
+      self._prune()
+
+  def _prune(self):
+    items = sorted(self.counts.items(), key=lambda x: (-x[1], x[0]))
+    keep = self.max_size // 2
+    for (_, count) in items[keep:]:
+      self.max_dropped_count = max(self.max_dropped_count, count)
+    self.counts = collections.defaultdict(int, items[0:keep])
+
+
+def read_lines(input_patterns):
+  """Yields the lines of all files matching comma-separated glob patterns."""
+  for pattern in input_patterns.split(","):
+    for input_file in sorted(glob.glob(pattern)):
+      with io.open(input_file, "rb") as reader:
+        for line in reader:
+          yield tokenization.convert_to_unicode(line)
+
+
+def count_words(lines, do_lower_case, max_unique_words):
+  """Counts the `BasicTokenizer` words of `lines` in bounded memory."""
+  basic_tokenizer = tokenization.BasicTokenizer(do_lower_case=do_lower_case)
+  counter = BoundedCounter(max_unique_words)
+  for line in lines:
+    for word in basic_tokenizer.tokenize(line):
+      counter.add(word)
+  return counter
+
+
+def learn_wordpieces(word_counts, vocab_size, special_tokens=(),
+                     max_input_chars_per_word=100, alphabet_word_counts=None):
+  """Learns a WordPiece vocabulary with byte pair encoding style merges.
+
+  Every word starts out split into single characters, written as WordPiece
+  tokens ("w", "##o", "##r", "##d"). The most frequent adjacent pair of
+  pieces (weighted by word count) is then merged into a new piece until the
+  vocabulary reaches `vocab_size` or nothing is left to merge.
+
+  Args:
+    word_counts: A dict from word to count.
+    vocab_size: Target vocabulary size, including `special_tokens`.
+    special_tokens: Tokens that are put at the start of the vocabulary.
+    max_input_chars_per_word: Words longer than this are not merged, since
+      `WordpieceTokenizer` maps them to the unknown token anyway.
+    alphabet_word_counts: (optional) A dict from word to count of all words of
+      the corpus, of which `word_counts` may only be the frequent ones.
+      Defaults to `word_counts`. Every character of these words is added to
+      the vocabulary both as a leading piece and as a "##" continuation, so
+      that none of them becomes unknown.
+
+  Returns:
+    The list of vocabulary tokens.
+  """
+  if alphabet_word_counts is None:
+    alphabet_word_counts = word_counts
+
+  words = []
+  counts = []
+  for (word, count) in sorted(word_counts.items()):
+    if not word or len(word) > max_input_chars_per_word:
+      continue
+    words.append([word[0]] + ["##" + char for char in word[1:]])
+    counts.append(count)
+
+  char_counts = collections.defaultdict(int)
+  for (word, count) in alphabet_word_counts.items():
+    for char in word:
+      char_counts[char] += count
+
+  vocab = list(special_tokens)
+  seen = set(vocab)
+  # Every character has to be in the vocabulary in both positions, so that no
+  # word that appeared in the corpus becomes unknown, whatever pieces the
+  # merges leave it with.
+  for (char, _) in sorted(char_counts.items(), key=lambda x: (-x[1], x[0])):
+    for piece in (char, "##" + char):
+      if piece not in seen:
+        vocab.append(piece)
+        seen.add(piece)
+  if len(vocab) > vocab_size:
+    raise ValueError(
+        "The corpus has %d distinct characters, which with their \"##\" "
+        "forms and the special tokens (%d tokens) do not fit in a vocabulary "
+        "of %d." % (len(char_counts), len(vocab), vocab_size))
+
+  pair_counts = collections.defaultdict(int)
+  pair_words = collections.defaultdict(set)
+  for (index, pieces) in enumerate(words):
+    for pair in zip(pieces[:-1], pieces[1:]):
+      pair_counts[pair] += counts[index]
+      pair_words[pair].add(index)
+  # A max-heap of pairs by count. Counts only change when a merge touches a
+  # word, so stale entries are simply re-checked when they come up.
+  heap = [(-count, pair) for (pair, count) in pair_counts.items()]
+  heapq.heapify(heap)
+
+  while len(vocab) < vocab_size and heap:
+    (negative_count, pair) = heapq.heappop(heap)
+    count = pair_counts.get(pair, 0)
+    if count <= 0:
+      continue
+    if count != -negative_count:
+      heapq.heappush(heap, (-count, pair))
+      continue
+
+    (left, right) = pair
+    merged = left + right[2:]
+    if merged not in seen:
+      vocab.append(merged)
+      seen.add(merged)
+
+    changed_pairs = set()
+    for index in pair_words.pop(pair):
+      pieces = words[index]
+      count = counts[index]
+      for old_pair in zip(pieces[:-1], pieces[1:]):
+        pair_counts[old_pair] -= count
+        pair_words[old_pair].discard(index)
+        changed_pairs.add(old_pair)
+      new_pieces = []
+      i = 0
+      while i < len(pieces):
+        if i + 1 < len(pieces) and pieces[i] == left and pieces[i + 1] == right:
+          new_pieces.append(merged)
+          i += 2
+        else:
+          new_pieces.append(pieces[i])
+          i += 1
+      words[index] = new_pieces
+      for new_pair in zip(new_pieces[:-1], new_pieces[1:]):
+        pair_counts[new_pair] += count
+        pair_words[new_pair].add(index)
+        changed_pairs.add(new_pair)
+    pair_counts.pop(pair, None)
+    for changed_pair in changed_pairs:
+      changed_count = pair_counts.get(changed_pair, 0)
+      if changed_count <= 0:
+        pair_counts.pop(changed_pair, None)
+        pair_words.pop(changed_pair, None)
+      else:
+        heapq.heappush(heap, (-changed_count, changed_pair))
+
+  return vocab
+
+
+def pieces_per_word(vocab, word_counts):
+  """Measures how a vocabulary splits the words of a corpus.
+
+  A word that becomes [UNK] is a single piece, so counting it would make a
+  vocabulary that loses words look better. Unknown words are left out of the
+  average and reported separately instead.
+
+  Returns:
+    A `(pieces_per_word, unknown_rate)` tuple: the average number of
+    wordpieces per occurrence of a known word, and the share of word
+    occurrences that become [UNK].
+  """
+  wordpiece_tokenizer = tokenization.WordpieceTokenizer(vocab=vocab)
+  total_pieces = 0
+  total_known_words = 0
+  total_unknown_words = 0
+  for (word, count) in word_counts.items():
+    pieces = wordpiece_tokenizer.tokenize(word)
+    if pieces == [wordpiece_tokenizer.unk_token]:
+      total_unknown_words += count
+      continue
+    total_pieces += count * len(pieces)
+    total_known_words += count
+  return (total_pieces / max(total_known_words, 1),
+          total_unknown_words / max(total_known_words + total_unknown_words,
+                                    1))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--input_file", required=True,
+                      help="Input raw text file (or comma-separated list of "
+                      "glob patterns).")
+  parser.add_argument("--output_file", required=True,
+                      help="Where to write the vocab.txt file.")
+  parser.add_argument("--vocab_size", type=int, default=30000,
+                      help="Target vocabulary size.")
+  parser.add_argument("--do_lower_case", type=lambda x: x.lower() == "true",
+                      default=True,
+                      help="Whether to lower case the input text. Should be "
+                      "True for uncased models and False for cased models.")
+  parser.add_argument("--max_unique_words", type=int, default=2000000,
+                      help="Maximum number of distinct words kept in memory "
+                      "while counting.")
+  parser.add_argument("--min_word_count", type=int, default=2,
+                      help="Words seen fewer times than this are not used "
+                      "for learning the vocabulary.")
+  parser.add_argument("--special_tokens",
+                      default="[PAD],[UNK],[CLS],[SEP],[MASK]",
+                      help="Comma-separated tokens to put at the start of the "
+                      "vocabulary.")
+  parser.add_argument("--compare_vocab_file", default=None,
+                      help="An existing vocab.txt file to compare the "
+                      "pieces per word against.")
+  args = parser.parse_args()
+
+  counter = count_words(
+      read_lines(args.input_file), args.do_lower_case, args.max_unique_words)
+  word_counts = dict((word, count)
+                     for (word, count) in counter.counts.items()
+                     if count >= args.min_word_count)
+  print("Counted %d distinct words (%d kept, counts up to %d dropped)" %
+        (len(counter.counts), len(word_counts), counter.max_dropped_count))
+
+  vocab_tokens = learn_wordpieces(
+      word_counts,
+      args.vocab_size,
+      args.special_tokens.split(","),
+      alphabet_word_counts=counter.counts)
+  with io.open(args.output_file, "w", encoding="utf-8") as writer:
+    for token in vocab_tokens:
+      writer.write(token + u"\n")
+  print("Wrote %d tokens to %s" % (len(vocab_tokens), args.output_file))
+
+  vocab_files = [("learned vocab", args.output_file)]
+  if args.compare_vocab_file:
+    vocab_files.append((args.compare_vocab_file, args.compare_vocab_file))
+  for (name, vocab_file) in vocab_files:
+    (average, unknown_rate) = pieces_per_word(
+        tokenization.load_vocab(vocab_file), counter.counts)
+    print("Pieces per known word (%s): %.3f, unknown words: %.2f%%" %
+          (name, average, 100.0 * unknown_rate))
+
+
+if __name__ == "__main__":
+  main()
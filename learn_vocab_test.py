@@ -0,0 +1,81 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import os
+
+import learn_vocab
+import tokenization
+import tensorflow as tf
+
+
+class LearnVocabTest(tf.test.TestCase):
+
+  def _sample_word_counts(self):
+    sample_file = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "sample_text.txt")
+    counter = learn_vocab.count_words(
+        learn_vocab.read_lines(sample_file), do_lower_case=True,
+        max_unique_words=1000000)
+    return counter.counts
+
+  def _vocab_dict(self, tokens):
+    vocab = collections.OrderedDict()
+    for (index, token) in enumerate(tokens):
+      vocab[token] = index
+    return vocab
+
+  def test_learn_wordpieces(self):
+    tokens = learn_vocab.learn_wordpieces(
+        {"low": 5, "lower": 2, "lowest": 3}, vocab_size=100,
+        special_tokens=["[UNK]"])
+    self.assertEqual(tokens[0], "[UNK]")
+    self.assertIn("low", tokens)
+    self.assertEqual(len(tokens), len(set(tokens)))
+    # Every character is there in both positions.
+    for char in "lowerst":
+      self.assertIn(char, tokens)
+      self.assertIn("##" + char, tokens)
+
+  def test_learned_vocab_covers_every_corpus_word(self):
+    all_word_counts = self._sample_word_counts()
+    frequent_word_counts = dict(
+        (word, count) for (word, count) in all_word_counts.items()
+        if count >= 2)
+    tokens = learn_vocab.learn_wordpieces(
+        frequent_word_counts, vocab_size=1000,
+        special_tokens=["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"],
+        alphabet_word_counts=all_word_counts)
+    self.assertLessEqual(len(tokens), 1000)
+
+    tokenizer = tokenization.WordpieceTokenizer(vocab=self._vocab_dict(tokens))
+    for word in all_word_counts:
+      self.assertNotIn("[UNK]", tokenizer.tokenize(word), word)
+
+  def test_pieces_per_word(self):
+    vocab = self._vocab_dict(["[UNK]", "low", "##er", "l", "##o", "##w"])
+    (average, unknown_rate) = learn_vocab.pieces_per_word(
+        vocab, {"low": 3, "lower": 1, "xyz": 4})
+    # [UNK] words are left out of the average rather than counted as one
+    # piece.
+    self.assertAllClose(average, (3 * 1 + 1 * 2) / 4.0)
+    self.assertAllClose(unknown_rate, 0.5)
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -134,7 +134,10 @@ class BertModel(object):
                input_mask=None,
                token_type_ids=None,
                use_one_hot_embeddings=True,
-               scope=None):
+               scope=None,
+               position_ids=None,
+               sequence_ids=None,
+               sequence_start_positions=None):
     """Constructor for BertModel.
 
     Args:
@@ -149,6 +152,18 @@ class BertModel(object):
         it is must faster if this is True, on the CPU or GPU, it is faster if
         this is False.
       scope: (optional) variable scope. Defaults to "bert".
+      position_ids: (optional) int32 Tensor of shape [batch_size, seq_length]
+        with the position of every token for the position embeddings.
+        Defaults to [0, 1, ..., seq_length - 1]. Packed inputs restart at 0
+        for every packed sequence.
+      sequence_ids: (optional) int32 Tensor of shape [batch_size, seq_length].
+        For inputs that pack several sequences into one row, the packed
+        sequence (1, 2, ...) that every token belongs to, or 0 for padding.
+        Tokens then only attend to the tokens of their own sequence, and
+        `input_mask` is not used.
+      sequence_start_positions: (optional) int32 Tensor of shape
+        [batch_size, num_sequences] with the position of the first token of
+        every packed sequence, for `get_sequence_pooled_output`.
 
     Raises:
       ValueError: The config is invalid or one of the input tensor shapes
@@ -192,14 +207,20 @@ class BertModel(object):
             position_embedding_name="position_embeddings",
             initializer_range=config.initializer_range,
             max_position_embeddings=config.max_position_embeddings,
-            dropout_prob=config.hidden_dropout_prob)
+            dropout_prob=config.hidden_dropout_prob,
+            position_ids=position_ids,
+            use_one_hot_embeddings=use_one_hot_embeddings)
 
       with tf.variable_scope("encoder"):
         # This converts a 2D mask of shape [batch_size, seq_length] to a 3D
         # mask of shape [batch_size, seq_length, seq_length] which is used
         # for the attention scores.
-        attention_mask = create_attention_mask_from_input_mask(
-            input_ids, input_mask)
+        if sequence_ids is None:
+          attention_mask = create_attention_mask_from_input_mask(
+              input_ids, input_mask)
+        else:
+          attention_mask = create_attention_mask_from_sequence_ids(
+              sequence_ids)
 
         # Run the stacked transformer.
         # `sequence_output` shape = [batch_size, seq_length, hidden_size].
@@ -232,9 +253,40 @@ class BertModel(object):
             activation=tf.tanh,
             kernel_initializer=create_initializer(config.initializer_range))
 
+        # The same pooler, applied to the first token of every packed
+        # sequence.
+        self.sequence_pooled_output = None
+        if sequence_start_positions is not None:
+          num_sequences = get_shape_list(
+              sequence_start_positions, expected_rank=2)[1]
+          flat_offsets = tf.reshape(
+              tf.range(0, batch_size, dtype=tf.int32) * seq_length, [-1, 1])
+          flat_positions = tf.reshape(sequence_start_positions + flat_offsets,
+                                      [-1])
+          start_token_tensor = tf.gather(
+              tf.reshape(self.sequence_output, [-1, config.hidden_size]),
+              flat_positions)
+          self.sequence_pooled_output = tf.reshape(
+              tf.layers.dense(
+                  start_token_tensor,
+                  config.hidden_size,
+                  activation=tf.tanh,
+                  name="dense",
+                  reuse=True),
+              [batch_size, num_sequences, config.hidden_size])
+
   def get_pooled_output(self):
     return self.pooled_output
 
+  def get_sequence_pooled_output(self):
+    """Gets the pooled output of every packed sequence.
+
+    Returns:
+      float Tensor of shape [batch_size, num_sequences, hidden_size], or None
+      if no `sequence_start_positions` were given.
+    """
+    return self.sequence_pooled_output
+
   def get_sequence_output(self):
     """Gets final hidden layer of encoder.
 
@@ -436,7 +488,9 @@ def embedding_postprocessor(input_tensor,
                             position_embedding_name="position_embeddings",
                             initializer_range=0.02,
                             max_position_embeddings=512,
-                            dropout_prob=0.1):
+                            dropout_prob=0.1,
+                            position_ids=None,
+                            use_one_hot_embeddings=False):
   """Performs various post-processing on a word embedding tensor.
 
   Args:
@@ -457,6 +511,11 @@ def embedding_postprocessor(input_tensor,
       used with this model. This can be longer than the sequence length of
       input_tensor, but cannot be shorter.
     dropout_prob: float. Dropout probability applied to the final output tensor.
+    position_ids: (optional) int32 Tensor of shape [batch_size, seq_length]
+      with the position of every token. Defaults to [0, 1, ..., seq_length - 1]
+      in every row.
+    use_one_hot_embeddings: bool. If True, use one-hot method for looking up
+      `position_ids`. If false, use `tf.gather()`.
 
   Returns:
     float tensor with same shape as `input_tensor`.
@@ -507,24 +566,39 @@ def embedding_postprocessor(input_tensor,
     # for position [0, 1, 2, ..., max_position_embeddings-1], and the current
     # sequence has positions [0, 1, 2, ... seq_length-1], so we can just
     # perform a slice.
-    if seq_length < max_position_embeddings:
-      position_embeddings = tf.slice(full_position_embeddings, [0, 0],
-                                     [seq_length, -1])
+    if position_ids is not None:
+      # Explicit positions (e.g., restarting for every packed sequence) are
+      # looked up row by row instead.
+      if use_one_hot_embeddings:
+        flat_position_ids = tf.reshape(position_ids, [-1])
+        one_hot_ids = tf.one_hot(
+            flat_position_ids, depth=max_position_embeddings)
+        position_embeddings = tf.matmul(one_hot_ids, full_position_embeddings)
+        position_embeddings = tf.reshape(position_embeddings,
+                                         [batch_size, seq_length, width])
+      else:
+        position_embeddings = tf.gather(full_position_embeddings,
+                                        position_ids)
+      output += position_embeddings
     else:
-      position_embeddings = full_position_embeddings
-
-    num_dims = len(output.shape.as_list())
-
-    # Only the last two dimensions are relevant (`seq_length` and `width`), so
-    # we broadcast among the first dimensions, which is typically just
-    # the batch size.
-    position_broadcast_shape = []
-    for _ in range(num_dims - 2):
-      position_broadcast_shape.append(1)
-    position_broadcast_shape.extend([seq_length, width])
-    position_embeddings = tf.reshape(position_embeddings,
-                                     position_broadcast_shape)
-    output += position_embeddings
+      if seq_length < max_position_embeddings:
+        position_embeddings = tf.slice(full_position_embeddings, [0, 0],
+                                       [seq_length, -1])
+      else:
+        position_embeddings = full_position_embeddings
+
+      num_dims = len(output.shape.as_list())
+
+      # Only the last two dimensions are relevant (`seq_length` and `width`),
+      # so we broadcast among the first dimensions, which is typically just
+      # the batch size.
+      position_broadcast_shape = []
+      for _ in range(num_dims - 2):
+        position_broadcast_shape.append(1)
+      position_broadcast_shape.extend([seq_length, width])
+      position_embeddings = tf.reshape(position_embeddings,
+                                       position_broadcast_shape)
+      output += position_embeddings
 
   output = layer_norm_and_dropout(output, dropout_prob)
   return output
@@ -564,6 +638,24 @@ def create_attention_mask_from_input_mask(from_tensor, to_mask):
   return mask
 
 
+def create_attention_mask_from_sequence_ids(sequence_ids):
+  """Create a block-diagonal 3D attention mask for packed sequences.
+
+  Args:
+    sequence_ids: int32 Tensor of shape [batch_size, seq_length] with the
+      packed sequence (1, 2, ...) of every token, or 0 for padding.
+
+  Returns:
+    float Tensor of shape [batch_size, seq_length, seq_length] which is 1 where
+    the "from" and "to" tokens are in the same sequence, and 0 elsewhere
+    (including everywhere for padding tokens).
+  """
+  from_ids = tf.expand_dims(sequence_ids, axis=2)
+  to_ids = tf.expand_dims(sequence_ids, axis=1)
+  mask = tf.logical_and(tf.equal(from_ids, to_ids), tf.greater(to_ids, 0))
+  return tf.cast(mask, tf.float32)
+
+
 def attention_layer(from_tensor,
                     to_tensor,
                     attention_mask=None,
@@ -132,6 +132,39 @@ class BertModelTest(tf.test.TestCase):
     self.assertEqual(obj["vocab_size"], 99)
     self.assertEqual(obj["hidden_size"], 37)
 
+  def test_create_attention_mask_from_sequence_ids(self):
+    with self.test_session() as sess:
+      mask = sess.run(
+          modeling.create_attention_mask_from_sequence_ids(
+              tf.constant([[1, 1, 2, 0], [1, 1, 1, 1]])))
+    self.assertAllEqual(mask, [
+        [[1, 1, 0, 0], [1, 1, 0, 0], [0, 0, 1, 0], [0, 0, 0, 0]],
+        [[1, 1, 1, 1], [1, 1, 1, 1], [1, 1, 1, 1], [1, 1, 1, 1]],
+    ])
+
+  def test_embedding_postprocessor_position_ids(self):
+    input_tensor = tf.zeros([2, 4, 3])
+    position_ids = tf.constant([[0, 1, 0, 1], [2, 0, 1, 2]])
+    outputs = []
+    for use_one_hot_embeddings in (False, True):
+      with tf.variable_scope(
+          "one_hot_%s" % use_one_hot_embeddings, reuse=tf.AUTO_REUSE):
+        output = modeling.embedding_postprocessor(
+            input_tensor,
+            max_position_embeddings=8,
+            dropout_prob=0.0,
+            position_ids=position_ids,
+            use_one_hot_embeddings=use_one_hot_embeddings)
+        table = tf.get_variable("position_embeddings")
+      outputs.append((output, table))
+    with self.test_session() as sess:
+      sess.run(tf.global_variables_initializer())
+      # Give both lookups the same table.
+      sess.run(tf.assign(outputs[1][1], outputs[0][1]))
+      (gather_output, one_hot_output) = sess.run(
+          [outputs[0][0], outputs[1][0]])
+    self.assertAllClose(gather_output, one_hot_output)
+
   def run_tester(self, tester):
     with self.test_session() as sess:
       ops = tester.create_model()
@@ -18,9 +18,11 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
 import os
 import modeling
 import optimization
+import tokenization
 import tensorflow as tf
 
 flags = tf.flags
@@ -57,6 +59,28 @@ flags.DEFINE_integer(
     "Maximum number of masked LM predictions per sequence. "
     "Must match data generation.")
 
+flags.DEFINE_bool(
+    "dynamic_masking", False,
+    "Whether to choose the masked LM predictions in the input pipeline, "
+    "with fresh masks for every batch, instead of reading them from the "
+    "input. The input must then be unmasked, as written by "
+    "`create_pretraining_data.py --dynamic_masking`.")
+
+flags.DEFINE_float(
+    "masked_lm_prob", 0.15,
+    "Masked LM probability. Only used with `dynamic_masking`.")
+
+flags.DEFINE_string(
+    "vocab_file", None,
+    "The vocabulary file that the BERT model was trained on, for the ids of "
+    "[CLS], [SEP] and [MASK]. Only used (and required) with "
+    "`dynamic_masking`.")
+
+flags.DEFINE_integer(
+    "max_sequences_per_pack", 0,
+    "Maximum number of sequences packed into one example. Only used to read "
+    "packed examples, and must match data generation.")
+
 flags.DEFINE_bool("do_train", False, "Whether to run training.")
 
 flags.DEFINE_bool("do_eval", False, "Whether to run eval on the dev set.")
@@ -126,6 +150,10 @@ def model_fn_builder(bert_config, init_checkpoint, learning_rate,
     masked_lm_weights = features["masked_lm_weights"]
     next_sentence_labels = features["next_sentence_labels"]
 
+    # Packed examples hold several sequences, each with its own positions,
+    # attention block and next sentence prediction.
+    is_packed = "sequence_ids" in features
+
     is_training = (mode == tf.estimator.ModeKeys.TRAIN)
 
     model = modeling.BertModel(
@@ -134,16 +162,30 @@ def model_fn_builder(bert_config, init_checkpoint, learning_rate,
         input_ids=input_ids,
         input_mask=input_mask,
         token_type_ids=segment_ids,
-        use_one_hot_embeddings=use_one_hot_embeddings)
+        use_one_hot_embeddings=use_one_hot_embeddings,
+        position_ids=features.get("position_ids"),
+        sequence_ids=features.get("sequence_ids"),
+        sequence_start_positions=features.get("next_sentence_positions"))
 
     (masked_lm_loss,
      masked_lm_example_loss, masked_lm_log_probs) = get_masked_lm_output(
          bert_config, model.get_sequence_output(), model.get_embedding_table(),
          masked_lm_positions, masked_lm_ids, masked_lm_weights)
 
-    (next_sentence_loss, next_sentence_example_loss,
-     next_sentence_log_probs) = get_next_sentence_output(
-         bert_config, model.get_pooled_output(), next_sentence_labels)
+    if is_packed:
+      (next_sentence_loss, next_sentence_example_loss,
+       next_sentence_log_probs) = get_next_sentence_output(
+           bert_config,
+           tf.reshape(model.get_sequence_pooled_output(),
+                      [-1, bert_config.hidden_size]), next_sentence_labels,
+           features["next_sentence_weights"])
+      next_sentence_weights = features["next_sentence_weights"]
+    else:
+      (next_sentence_loss, next_sentence_example_loss,
+       next_sentence_log_probs) = get_next_sentence_output(
+           bert_config, model.get_pooled_output(), next_sentence_labels)
+      next_sentence_weights = tf.ones_like(
+          next_sentence_labels, dtype=tf.float32)
 
     total_loss = masked_lm_loss + next_sentence_loss
 
@@ -186,7 +228,8 @@ def model_fn_builder(bert_config, init_checkpoint, learning_rate,
 
       def metric_fn(masked_lm_example_loss, masked_lm_log_probs, masked_lm_ids,
                     masked_lm_weights, next_sentence_example_loss,
-                    next_sentence_log_probs, next_sentence_labels):
+                    next_sentence_log_probs, next_sentence_labels,
+                    next_sentence_weights):
         """Computes the loss and accuracy of the model."""
         masked_lm_log_probs = tf.reshape(masked_lm_log_probs,
                                          [-1, masked_lm_log_probs.shape[-1]])
@@ -207,10 +250,13 @@ def model_fn_builder(bert_config, init_checkpoint, learning_rate,
         next_sentence_predictions = tf.argmax(
             next_sentence_log_probs, axis=-1, output_type=tf.int32)
         next_sentence_labels = tf.reshape(next_sentence_labels, [-1])
+        next_sentence_weights = tf.reshape(next_sentence_weights, [-1])
         next_sentence_accuracy = tf.metrics.accuracy(
-            labels=next_sentence_labels, predictions=next_sentence_predictions)
+            labels=next_sentence_labels,
+            predictions=next_sentence_predictions,
+            weights=next_sentence_weights)
         next_sentence_mean_loss = tf.metrics.mean(
-            values=next_sentence_example_loss)
+            values=next_sentence_example_loss, weights=next_sentence_weights)
 
         return {
             "masked_lm_accuracy": masked_lm_accuracy,
@@ -222,7 +268,7 @@ def model_fn_builder(bert_config, init_checkpoint, learning_rate,
       eval_metrics = (metric_fn, [
           masked_lm_example_loss, masked_lm_log_probs, masked_lm_ids,
           masked_lm_weights, next_sentence_example_loss,
-          next_sentence_log_probs, next_sentence_labels
+          next_sentence_log_probs, next_sentence_labels, next_sentence_weights
       ])
       output_spec = tf.contrib.tpu.TPUEstimatorSpec(
           mode=mode,
@@ -282,8 +328,11 @@ def get_masked_lm_output(bert_config, input_tensor, output_weights, positions,
   return (loss, per_example_loss, log_probs)
 
 
-def get_next_sentence_output(bert_config, input_tensor, labels):
-  """Get loss and log probs for the next sentence prediction."""
+def get_next_sentence_output(bert_config, input_tensor, labels, weights=None):
+  """Get loss and log probs for the next sentence prediction.
+
+  `weights` (one per label) leave out the padding of packed examples.
+  """
 
   # Simple binary classification. Note that 0 is "next sentence" and 1 is
   # "random sentence". This weight matrix is not used after pre-training.
@@ -301,7 +350,12 @@ def get_next_sentence_output(bert_config, input_tensor, labels):
     labels = tf.reshape(labels, [-1])
     one_hot_labels = tf.one_hot(labels, depth=2, dtype=tf.float32)
     per_example_loss = -tf.reduce_sum(one_hot_labels * log_probs, axis=-1)
-    loss = tf.reduce_mean(per_example_loss)
+    if weights is None:
+      loss = tf.reduce_mean(per_example_loss)
+    else:
+      weights = tf.reshape(weights, [-1])
+      loss = (tf.reduce_sum(weights * per_example_loss) /
+              (tf.reduce_sum(weights) + 1e-5))
     return (loss, per_example_loss, log_probs)
 
 
@@ -321,33 +375,70 @@ def gather_indexes(sequence_tensor, positions):
   return output_tensor
 
 
+# What `mask_batch` needs to know to choose masked LM predictions.
+DynamicMasking = collections.namedtuple(
+    "DynamicMasking",
+    ["masked_lm_prob", "vocab_size", "cls_id", "sep_id", "mask_id"])
+
+
 def input_fn_builder(input_files,
                      max_seq_length,
                      max_predictions_per_seq,
                      is_training,
-                     num_cpu_threads=4):
-  """Creates an `input_fn` closure to be passed to TPUEstimator."""
+                     num_cpu_threads=4,
+                     dynamic_masking=None,
+                     max_sequences_per_pack=0):
+  """Creates an `input_fn` closure to be passed to TPUEstimator.
+
+  With a `DynamicMasking`, the input is expected to be unmasked, and the
+  masked LM features are created by `mask_batch` for every batch.
+
+  Both the padded examples and the compact ones written by
+  `create_pretraining_data.py --compact_records` can be read, packed or not.
+  The format is detected from the first input file, and compact examples are
+  padded to `max_seq_length`, `max_predictions_per_seq` and (if packed)
+  `max_sequences_per_pack` when they are batched.
+  """
 
   def input_fn(params):
     """The actual input function."""
     batch_size = params["batch_size"]
 
-    name_to_features = {
-        "input_ids":
-            tf.FixedLenFeature([max_seq_length], tf.int64),
-        "input_mask":
-            tf.FixedLenFeature([max_seq_length], tf.int64),
-        "segment_ids":
-            tf.FixedLenFeature([max_seq_length], tf.int64),
-        "masked_lm_positions":
-            tf.FixedLenFeature([max_predictions_per_seq], tf.int64),
-        "masked_lm_ids":
-            tf.FixedLenFeature([max_predictions_per_seq], tf.int64),
-        "masked_lm_weights":
-            tf.FixedLenFeature([max_predictions_per_seq], tf.float32),
-        "next_sentence_labels":
-            tf.FixedLenFeature([1], tf.int64),
-    }
+    record_format = read_record_format(input_files[0])
+    if record_format.packed and max_sequences_per_pack <= 0:
+      raise ValueError("The input examples are packed, so "
+                       "`max_sequences_per_pack` must be set.")
+
+    # The length of every feature after padding.
+    feature_lengths = collections.OrderedDict()
+    feature_lengths["input_ids"] = max_seq_length
+    feature_lengths["input_mask"] = max_seq_length
+    feature_lengths["segment_ids"] = max_seq_length
+    if record_format.packed:
+      feature_lengths["position_ids"] = max_seq_length
+      feature_lengths["sequence_ids"] = max_seq_length
+    if dynamic_masking is None:
+      feature_lengths["masked_lm_positions"] = max_predictions_per_seq
+      feature_lengths["masked_lm_ids"] = max_predictions_per_seq
+      feature_lengths["masked_lm_weights"] = max_predictions_per_seq
+    if record_format.packed:
+      feature_lengths["next_sentence_positions"] = max_sequences_per_pack
+      feature_lengths["next_sentence_labels"] = max_sequences_per_pack
+      feature_lengths["next_sentence_weights"] = max_sequences_per_pack
+    else:
+      feature_lengths["next_sentence_labels"] = 1
+
+    name_to_features = {}
+    for (name, length) in feature_lengths.items():
+      dtype = tf.float32 if name.endswith("_weights") else tf.int64
+      if not record_format.compact:
+        name_to_features[name] = tf.FixedLenFeature([length], dtype)
+      elif name in _COMPACT_DERIVED_FEATURES:
+        continue
+      elif name == "next_sentence_labels" and not record_format.packed:
+        name_to_features[name] = tf.FixedLenFeature([1], dtype)
+      else:
+        name_to_features[name] = tf.VarLenFeature(dtype)
 
     # For training, we want a lot of parallel reading and shuffling.
     # For eval, we want no shuffling and parallel reading doesn't matter.
@@ -377,17 +468,122 @@ def input_fn_builder(input_files,
     # size dimensions. For eval, we assume we are evaluating on the CPU or GPU
     # and we *don't* want to drop the remainder, otherwise we wont cover
     # every sample.
-    d = d.apply(
-        tf.contrib.data.map_and_batch(
-            lambda record: _decode_record(record, name_to_features),
-            batch_size=batch_size,
-            num_parallel_batches=num_cpu_threads,
-            drop_remainder=True))
+    if record_format.compact:
+      d = d.map(
+          lambda record: _decode_compact_record(record, name_to_features),
+          num_parallel_calls=num_cpu_threads)
+      padded_shapes = dict(
+          (name, [length]) for (name, length) in feature_lengths.items())
+      d = d.padded_batch(
+          batch_size, padded_shapes=padded_shapes, drop_remainder=True)
+    else:
+      d = d.apply(
+          tf.contrib.data.map_and_batch(
+              lambda record: _decode_record(record, name_to_features),
+              batch_size=batch_size,
+              num_parallel_batches=num_cpu_threads,
+              drop_remainder=True))
+    if dynamic_masking is not None:
+      d = d.map(
+          lambda features: mask_batch(features, max_predictions_per_seq,
+                                      dynamic_masking),
+          num_parallel_calls=num_cpu_threads)
     return d
 
   return input_fn
 
 
+def mask_batch(features, max_predictions_per_seq, dynamic_masking):
+  """Chooses the masked LM predictions for a batch of unmasked sequences.
+
+  This does in the graph what `create_masked_lm_predictions` in
+  `create_pretraining_data.py` does for a single sequence: it predicts
+  `min(max_predictions_per_seq, max(1, round(length * masked_lm_prob)))`
+  random tokens other than [CLS] and [SEP], of which 80% are replaced by
+  [MASK], 10% by a random token and 10% are left alone. The positions are
+  in increasing order and padded with zeros (with zero weight). A packed row
+  is masked as a whole, so its sequences share the `max_predictions_per_seq`.
+
+  Args:
+    features: A dict of int32 `input_ids`, `input_mask` and `segment_ids` of
+      shape [batch_size, seq_length], and `next_sentence_labels`.
+    max_predictions_per_seq: Number of masked LM predictions to pad to.
+    dynamic_masking: A `DynamicMasking`.
+
+  Returns:
+    A copy of `features` with masked `input_ids` and the `masked_lm_positions`,
+    `masked_lm_ids` and `masked_lm_weights` of shape
+    [batch_size, max_predictions_per_seq].
+  """
+  input_ids = features["input_ids"]
+  input_mask = features["input_mask"]
+  input_shape = modeling.get_shape_list(input_ids, expected_rank=2)
+  batch_size = input_shape[0]
+  seq_length = input_shape[1]
+
+  lengths = tf.reduce_sum(input_mask, axis=1)
+  num_to_predict = tf.minimum(
+      max_predictions_per_seq,
+      tf.maximum(
+          1,
+          tf.to_int32(
+              tf.round(
+                  tf.to_float(lengths) * dynamic_masking.masked_lm_prob))))
+
+  is_candidate = tf.logical_and(
+      tf.equal(input_mask, 1),
+      tf.logical_and(
+          tf.not_equal(input_ids, dynamic_masking.cls_id),
+          tf.not_equal(input_ids, dynamic_masking.sep_id)))
+
+  # Giving every candidate a random score and taking the `num_to_predict`
+  # highest ones picks a uniformly random subset of the candidates.
+  scores = tf.where(is_candidate, tf.random_uniform(input_shape),
+                    -tf.ones(input_shape))
+  top_scores = tf.nn.top_k(scores, k=max_predictions_per_seq).values
+  threshold = tf.reduce_sum(
+      top_scores * tf.one_hot(num_to_predict - 1, max_predictions_per_seq),
+      axis=1,
+      keepdims=True)
+  is_masked = tf.logical_and(is_candidate, scores >= threshold)
+
+  # The masked positions in increasing order: the `top_k` of
+  # `seq_length - position` over the masked positions.
+  positions = tf.range(seq_length)[tf.newaxis, :]
+  reversed_positions = tf.nn.top_k(
+      tf.where(is_masked, seq_length - positions * tf.ones_like(input_ids),
+               tf.zeros_like(input_ids)),
+      k=max_predictions_per_seq).values
+  is_prediction = reversed_positions > 0
+  masked_lm_positions = tf.where(is_prediction,
+                                 seq_length - reversed_positions,
+                                 tf.zeros_like(reversed_positions))
+
+  flat_offsets = tf.range(batch_size)[:, tf.newaxis] * seq_length
+  masked_lm_ids = tf.gather(
+      tf.reshape(input_ids, [-1]), masked_lm_positions + flat_offsets)
+  masked_lm_ids = tf.where(is_prediction, masked_lm_ids,
+                           tf.zeros_like(masked_lm_ids))
+
+  # 80% [MASK], 10% random token, 10% unchanged.
+  replacement = tf.random_uniform(input_shape)
+  random_ids = tf.random_uniform(
+      input_shape, maxval=dynamic_masking.vocab_size, dtype=tf.int32)
+  masked_input_ids = tf.where(
+      tf.logical_and(is_masked, replacement < 0.8),
+      dynamic_masking.mask_id * tf.ones_like(input_ids),
+      tf.where(
+          tf.logical_and(is_masked, replacement >= 0.9), random_ids,
+          input_ids))
+
+  output = dict(features)
+  output["input_ids"] = masked_input_ids
+  output["masked_lm_positions"] = masked_lm_positions
+  output["masked_lm_ids"] = masked_lm_ids
+  output["masked_lm_weights"] = tf.to_float(is_prediction)
+  return output
+
+
 def _decode_record(record, name_to_features):
   """Decodes a record to a TensorFlow example."""
   example = tf.parse_single_example(record, name_to_features)
@@ -396,6 +592,8 @@ def _decode_record(record, name_to_features):
   # So cast all int64 to int32.
   for name in list(example.keys()):
     t = example[name]
+    if isinstance(t, tf.SparseTensor):
+      t = tf.sparse_tensor_to_dense(t)
     if t.dtype == tf.int64:
       t = tf.to_int32(t)
     example[name] = t
@@ -403,6 +601,45 @@ def _decode_record(record, name_to_features):
   return example
 
 
+# The features that compact examples leave out, since they only mark the
+# padding, and the features that they are derived from.
+_COMPACT_DERIVED_FEATURES = {
+    "input_mask": "input_ids",
+    "masked_lm_weights": "masked_lm_ids",
+    "next_sentence_weights": "next_sentence_positions",
+}
+
+
+def _decode_compact_record(record, name_to_features):
+  """Decodes a compact record, adding back the features it leaves out."""
+  example = _decode_record(record, name_to_features)
+  # They are all ones, and the padding added by `padded_batch` is zero.
+  for (name, source_name) in _COMPACT_DERIVED_FEATURES.items():
+    if source_name in example:
+      dtype = tf.float32 if name.endswith("_weights") else tf.int32
+      example[name] = tf.ones_like(example[source_name], dtype=dtype)
+  return example
+
+
+# How the examples of an input file are stored.
+RecordFormat = collections.namedtuple("RecordFormat", ["compact", "packed"])
+
+
+def read_record_format(input_file):
+  """Returns the `RecordFormat` of the first example in `input_file`.
+
+  Compact examples, written by `create_pretraining_data.py --compact_records`,
+  are the only ones without an `input_mask` feature, and packed ones (written
+  with `--max_sequences_per_pack`) the only ones with `sequence_ids`.
+  """
+  for record in tf.python_io.tf_record_iterator(input_file):
+    features = tf.train.Example.FromString(record).features.feature
+    return RecordFormat(
+        compact="input_mask" not in features,
+        packed="sequence_ids" in features)
+  return RecordFormat(compact=False, packed=False)
+
+
 def main(_):
   tf.logging.set_verbosity(tf.logging.INFO)
 
@@ -455,6 +692,18 @@ def main(_):
       train_batch_size=FLAGS.train_batch_size,
       eval_batch_size=FLAGS.eval_batch_size)
 
+  dynamic_masking = None
+  if FLAGS.dynamic_masking:
+    if not FLAGS.vocab_file:
+      raise ValueError("`vocab_file` is required with `dynamic_masking`.")
+    vocab = tokenization.load_vocab(FLAGS.vocab_file)
+    dynamic_masking = DynamicMasking(
+        masked_lm_prob=FLAGS.masked_lm_prob,
+        vocab_size=len(vocab),
+        cls_id=vocab["[CLS]"],
+        sep_id=vocab["[SEP]"],
+        mask_id=vocab["[MASK]"])
+
   if FLAGS.do_train:
     tf.logging.info("***** Running training *****")
     tf.logging.info("  Batch size = %d", FLAGS.train_batch_size)
@@ -462,7 +711,9 @@ def main(_):
         input_files=input_files,
         max_seq_length=FLAGS.max_seq_length,
         max_predictions_per_seq=FLAGS.max_predictions_per_seq,
-        is_training=True)
+        is_training=True,
+        dynamic_masking=dynamic_masking,
+        max_sequences_per_pack=FLAGS.max_sequences_per_pack)
     estimator.train(input_fn=train_input_fn, max_steps=FLAGS.num_train_steps)
 
   if FLAGS.do_eval:
@@ -473,7 +724,9 @@ def main(_):
         input_files=input_files,
         max_seq_length=FLAGS.max_seq_length,
         max_predictions_per_seq=FLAGS.max_predictions_per_seq,
-        is_training=False)
+        is_training=False,
+        dynamic_masking=dynamic_masking,
+        max_sequences_per_pack=FLAGS.max_sequences_per_pack)
 
     result = estimator.evaluate(
         input_fn=eval_input_fn, steps=FLAGS.max_eval_steps)
@@ -0,0 +1,254 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import os
+
+import numpy as np
+
+import run_pretraining
+import tensorflow as tf
+
+
+class RunPretrainingTest(tf.test.TestCase):
+
+  def _write_examples(self, name, examples, compact, max_seq_length,
+                      max_predictions_per_seq, max_sequences_per_pack=0):
+    """Writes examples like `create_pretraining_data.py` and returns the path.
+
+    Every example is a dict of its unpadded features; the padded (unless
+    `compact`) and derived features are added here.
+    """
+
+    def pad(values, length):
+      return values if compact else values + [0] * (length - len(values))
+
+    def int_feature(values):
+      return tf.train.Feature(int64_list=tf.train.Int64List(value=values))
+
+    def float_feature(values):
+      return tf.train.Feature(float_list=tf.train.FloatList(value=values))
+
+    path = os.path.join(self.get_temp_dir(), name)
+    writer = tf.python_io.TFRecordWriter(path)
+    for example in examples:
+      num_tokens = len(example["input_ids"])
+      num_predictions = len(example["masked_lm_ids"])
+      features = collections.OrderedDict()
+      features["input_ids"] = int_feature(
+          pad(example["input_ids"], max_seq_length))
+      if not compact:
+        features["input_mask"] = int_feature(
+            pad([1] * num_tokens, max_seq_length))
+      features["segment_ids"] = int_feature(
+          pad(example["segment_ids"], max_seq_length))
+      if max_sequences_per_pack:
+        features["position_ids"] = int_feature(
+            pad(example["position_ids"], max_seq_length))
+        features["sequence_ids"] = int_feature(
+            pad(example["sequence_ids"], max_seq_length))
+      features["masked_lm_positions"] = int_feature(
+          pad(example["masked_lm_positions"], max_predictions_per_seq))
+      features["masked_lm_ids"] = int_feature(
+          pad(example["masked_lm_ids"], max_predictions_per_seq))
+      if not compact:
+        features["masked_lm_weights"] = float_feature(
+            pad([1.0] * num_predictions, max_predictions_per_seq))
+      if max_sequences_per_pack:
+        num_sequences = len(example["next_sentence_labels"])
+        features["next_sentence_positions"] = int_feature(
+            pad(example["next_sentence_positions"], max_sequences_per_pack))
+        features["next_sentence_labels"] = int_feature(
+            pad(example["next_sentence_labels"], max_sequences_per_pack))
+        if not compact:
+          features["next_sentence_weights"] = float_feature(
+              pad([1.0] * num_sequences, max_sequences_per_pack))
+      else:
+        features["next_sentence_labels"] = int_feature(
+            example["next_sentence_labels"])
+      writer.write(
+          tf.train.Example(features=tf.train.Features(
+              feature=features)).SerializeToString())
+    writer.close()
+    return path
+
+  def _read_batch(self, input_file, batch_size, max_seq_length,
+                  max_predictions_per_seq, max_sequences_per_pack=0):
+    """Returns the first batch that `input_fn_builder` reads from a file."""
+    with tf.Graph().as_default() as graph:
+      input_fn = run_pretraining.input_fn_builder(
+          input_files=[input_file],
+          max_seq_length=max_seq_length,
+          max_predictions_per_seq=max_predictions_per_seq,
+          is_training=False,
+          max_sequences_per_pack=max_sequences_per_pack)
+      dataset = input_fn({"batch_size": batch_size})
+      features = dataset.make_one_shot_iterator().get_next()
+      with self.test_session(graph=graph) as sess:
+        return sess.run(features)
+
+  def _assert_compact_matches_padded(self, examples, max_seq_length,
+                                     max_predictions_per_seq,
+                                     max_sequences_per_pack=0):
+    padded_file = self._write_examples(
+        "padded.tfrecord", examples, False, max_seq_length,
+        max_predictions_per_seq, max_sequences_per_pack)
+    compact_file = self._write_examples(
+        "compact.tfrecord", examples, True, max_seq_length,
+        max_predictions_per_seq, max_sequences_per_pack)
+    packed = max_sequences_per_pack > 0
+    self.assertEqual(
+        run_pretraining.read_record_format(padded_file),
+        run_pretraining.RecordFormat(compact=False, packed=packed))
+    self.assertEqual(
+        run_pretraining.read_record_format(compact_file),
+        run_pretraining.RecordFormat(compact=True, packed=packed))
+
+    padded = self._read_batch(padded_file, len(examples), max_seq_length,
+                              max_predictions_per_seq, max_sequences_per_pack)
+    compact = self._read_batch(compact_file, len(examples), max_seq_length,
+                               max_predictions_per_seq, max_sequences_per_pack)
+    self.assertEqual(sorted(compact.keys()), sorted(padded.keys()))
+    for name in padded:
+      self.assertEqual(compact[name].dtype, padded[name].dtype, name)
+      self.assertAllEqual(compact[name], padded[name])
+
+  def test_compact_records(self):
+    examples = [{
+        "input_ids": [1, 11, 12, 2, 13, 2],
+        "segment_ids": [0, 0, 0, 0, 1, 1],
+        "masked_lm_positions": [2],
+        "masked_lm_ids": [12],
+        "next_sentence_labels": [1],
+    }, {
+        "input_ids": [1, 14, 2, 15, 16, 17, 18, 2],
+        "segment_ids": [0, 0, 0, 1, 1, 1, 1, 1],
+        "masked_lm_positions": [1, 4],
+        "masked_lm_ids": [14, 16],
+        "next_sentence_labels": [0],
+    }]
+    self._assert_compact_matches_padded(
+        examples, max_seq_length=10, max_predictions_per_seq=3)
+
+  def test_compact_packed_records(self):
+    examples = [{
+        "input_ids": [1, 11, 2, 12, 2, 1, 13, 2, 14, 2],
+        "segment_ids": [0, 0, 0, 1, 1, 0, 0, 0, 1, 1],
+        "position_ids": [0, 1, 2, 3, 4, 0, 1, 2, 3, 4],
+        "sequence_ids": [1, 1, 1, 1, 1, 2, 2, 2, 2, 2],
+        "masked_lm_positions": [1, 8],
+        "masked_lm_ids": [11, 14],
+        "next_sentence_positions": [0, 5],
+        "next_sentence_labels": [1, 0],
+    }, {
+        "input_ids": [1, 15, 2, 16, 2],
+        "segment_ids": [0, 0, 0, 1, 1],
+        "position_ids": [0, 1, 2, 3, 4],
+        "sequence_ids": [1, 1, 1, 1, 1],
+        "masked_lm_positions": [3],
+        "masked_lm_ids": [16],
+        "next_sentence_positions": [0],
+        "next_sentence_labels": [1],
+    }]
+    self._assert_compact_matches_padded(
+        examples, max_seq_length=12, max_predictions_per_seq=3,
+        max_sequences_per_pack=3)
+
+  def test_mask_batch(self):
+    dynamic_masking = run_pretraining.DynamicMasking(
+        masked_lm_prob=0.15, vocab_size=100, cls_id=1, sep_id=2, mask_id=3)
+    batch_size = 64
+    seq_length = 32
+    max_predictions_per_seq = 4
+
+    # [CLS] A [SEP] B [SEP] of random lengths, followed by padding.
+    rng = np.random.RandomState(12345)
+    input_ids = np.zeros([batch_size, seq_length], dtype=np.int32)
+    input_mask = np.zeros([batch_size, seq_length], dtype=np.int32)
+    segment_ids = np.zeros([batch_size, seq_length], dtype=np.int32)
+    lengths = rng.randint(5, seq_length + 1, size=batch_size)
+    for (i, length) in enumerate(lengths):
+      len_a = rng.randint(1, length - 3)
+      input_ids[i, 0:length] = rng.randint(10, 100, size=length)
+      input_ids[i, 0] = dynamic_masking.cls_id
+      input_ids[i, len_a + 1] = dynamic_masking.sep_id
+      input_ids[i, length - 1] = dynamic_masking.sep_id
+      input_mask[i, 0:length] = 1
+      segment_ids[i, len_a + 2:length] = 1
+    features = {
+        "input_ids": tf.constant(input_ids),
+        "input_mask": tf.constant(input_mask),
+        "segment_ids": tf.constant(segment_ids),
+        "next_sentence_labels": tf.zeros([batch_size, 1], dtype=tf.int32),
+    }
+    expected_num_predictions = np.minimum(
+        max_predictions_per_seq,
+        np.maximum(1, np.rint(lengths.astype(np.float32) *
+                              np.float32(dynamic_masking.masked_lm_prob))))
+
+    tf.set_random_seed(1)
+    output = run_pretraining.mask_batch(features, max_predictions_per_seq,
+                                        dynamic_masking)
+    num_predictions = 0
+    num_masked = 0
+    num_kept = 0
+    with self.test_session() as sess:
+      for _ in range(20):
+        output_result = sess.run(output)
+        self.assertAllEqual(output_result["input_mask"], input_mask)
+        self.assertAllEqual(output_result["segment_ids"], segment_ids)
+        for i in range(batch_size):
+          weights = output_result["masked_lm_weights"][i]
+          positions = output_result["masked_lm_positions"][i]
+          ids = output_result["masked_lm_ids"][i]
+          masked_ids = output_result["input_ids"][i]
+          count = int(weights.sum())
+          self.assertEqual(count, expected_num_predictions[i])
+          self.assertAllEqual(weights[0:count], [1.0] * count)
+
+          # The predictions are distinct, increasing positions of tokens
+          # other than [CLS], [SEP] and padding, and the padding is zero.
+          predicted = positions[0:count]
+          self.assertAllEqual(predicted, np.unique(predicted))
+          self.assertAllEqual(ids[0:count], input_ids[i, predicted])
+          self.assertAllEqual(positions[count:], [0] * (len(positions) - count))
+          self.assertAllEqual(ids[count:], [0] * (len(ids) - count))
+          for position in predicted:
+            self.assertLess(position, lengths[i])
+            self.assertNotIn(input_ids[i, position],
+                             [dynamic_masking.cls_id, dynamic_masking.sep_id])
+
+          # Only the predicted tokens may change.
+          unpredicted = np.ones([seq_length], dtype=bool)
+          unpredicted[predicted] = False
+          self.assertAllEqual(masked_ids[unpredicted],
+                              input_ids[i, unpredicted])
+
+          num_predictions += count
+          num_masked += np.sum(masked_ids[predicted] == dynamic_masking.mask_id)
+          num_kept += np.sum(masked_ids[predicted] == input_ids[i, predicted])
+
+    # 80% [MASK], 10% unchanged and 10% random.
+    self.assertAllClose(num_masked / num_predictions, 0.8, atol=0.03)
+    self.assertAllClose(num_kept / num_predictions, 0.1, atol=0.03)
+    self.assertAllClose((num_predictions - num_masked - num_kept) /
+                        num_predictions, 0.1, atol=0.03)
+
+
+if __name__ == "__main__":
+  tf.test.main()
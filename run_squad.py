@@ -288,16 +288,10 @@ def convert_examples_to_features(examples, tokenizer, max_seq_length,
 
     if len(query_tokens) > max_query_length:
       query_tokens = query_tokens[0:max_query_length]
+    query_ids = tokenizer.convert_tokens_to_ids(query_tokens)
 
-    tok_to_orig_index = []
-    orig_to_tok_index = []
-    all_doc_tokens = []
-    for (i, token) in enumerate(example.doc_tokens):
-      orig_to_tok_index.append(len(all_doc_tokens))
-      sub_tokens = tokenizer.tokenize(token)
-      for sub_token in sub_tokens:
-        tok_to_orig_index.append(i)
-        all_doc_tokens.append(sub_token)
+    (all_doc_tokens, tok_to_orig_index,
+     orig_to_tok_index) = tokenizer.tokenize_words(example.doc_tokens)
 
     tok_start_position = None
     tok_end_position = None
@@ -311,6 +305,8 @@ def convert_examples_to_features(examples, tokenizer, max_seq_length,
           all_doc_tokens, tok_start_position, tok_end_position, tokenizer,
           example.orig_answer_text)
 
+    all_doc_ids = tokenizer.convert_tokens_to_ids(all_doc_tokens)
+
     # The -3 accounts for [CLS], [SEP] and [SEP]
     max_tokens_for_doc = max_seq_length - len(query_tokens) - 3
 
@@ -334,14 +330,10 @@ def convert_examples_to_features(examples, tokenizer, max_seq_length,
       tokens = []
       token_to_orig_map = {}
       token_is_max_context = {}
-      segment_ids = []
       tokens.append("[CLS]")
-      segment_ids.append(0)
       for token in query_tokens:
         tokens.append(token)
-        segment_ids.append(0)
       tokens.append("[SEP]")
-      segment_ids.append(0)
 
       for i in range(doc_span.length):
         split_token_index = doc_span.start + i
@@ -351,21 +343,15 @@ def convert_examples_to_features(examples, tokenizer, max_seq_length,
                                                split_token_index)
         token_is_max_context[len(tokens)] = is_max_context
         tokens.append(all_doc_tokens[split_token_index])
-        segment_ids.append(1)
       tokens.append("[SEP]")
-      segment_ids.append(1)
-
-      input_ids = tokenizer.convert_tokens_to_ids(tokens)
 
-      # The mask has 1 for real tokens and 0 for padding tokens. Only real
-      # tokens are attended to.
-      input_mask = [1] * len(input_ids)
-
-      # Zero-pad up to the sequence length.
-      while len(input_ids) < max_seq_length:
-        input_ids.append(0)
-        input_mask.append(0)
-        segment_ids.append(0)
+      # This adds [CLS] and [SEP]s around the query and document span and
+      # zero-pads up to the sequence length. The mask has 1 for real tokens
+      # and 0 for padding tokens. Only real tokens are attended to.
+      (input_ids, input_mask, segment_ids) = tokenizer.encode_ids(
+          query_ids,
+          all_doc_ids[doc_span.start:doc_span.start + doc_span.length],
+          max_length=max_seq_length)
 
       assert len(input_ids) == max_seq_length
       assert len(input_mask) == max_seq_length
@@ -697,7 +683,7 @@ RawResult = collections.namedtuple("RawResult",
 
 def write_predictions(all_examples, all_features, all_results, n_best_size,
                       max_answer_length, do_lower_case, output_prediction_file,
-                      output_nbest_file):
+                      output_nbest_file, tokenizer):
   """Write final predictions to the json file."""
   tf.logging.info("Writing predictions to: %s" % (output_prediction_file))
   tf.logging.info("Writing nbest to: %s" % (output_nbest_file))
@@ -768,19 +754,12 @@ def write_predictions(all_examples, all_features, all_results, n_best_size,
         break
       feature = features[pred.feature_index]
 
-      tok_tokens = feature.tokens[pred.start_index:(pred.end_index + 1)]
+      # De-tokenize WordPieces that have been split off.
+      tok_text = tokenizer.decode(
+          feature.input_ids[pred.start_index:(pred.end_index + 1)])
       orig_doc_start = feature.token_to_orig_map[pred.start_index]
       orig_doc_end = feature.token_to_orig_map[pred.end_index]
       orig_tokens = example.doc_tokens[orig_doc_start:(orig_doc_end + 1)]
-      tok_text = " ".join(tok_tokens)
-
-      # De-tokenize WordPieces that have been split off.
-      tok_text = tok_text.replace(" ##", "")
-      tok_text = tok_text.replace("##", "")
-
-      # Clean whitespace
-      tok_text = tok_text.strip()
-      tok_text = " ".join(tok_text.split())
       orig_text = " ".join(orig_tokens)
 
       final_text = get_final_text(tok_text, orig_text, do_lower_case)
@@ -1169,7 +1148,7 @@ def main(_):
     write_predictions(eval_examples, eval_features, all_results,
                       FLAGS.n_best_size, FLAGS.max_answer_length,
                       FLAGS.do_lower_case, output_prediction_file,
-                      output_nbest_file)
+                      output_nbest_file, tokenizer)
 
 
 if __name__ == "__main__":
@@ -18,10 +18,19 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import bisect
 import collections
+import io
+import mmap
+import multiprocessing
+import os
+import re
+import struct
+import sys
 import unicodedata
+import zlib
+import numpy as np
 import six
-import tensorflow as tf
 
 
 def convert_to_unicode(text):
@@ -68,10 +77,24 @@ def printable_text(text):
 
 
 def load_vocab(vocab_file):
-  """Loads a vocabulary file into a dictionary."""
+  """Loads a vocabulary file into a dictionary.
+
+  If `vocab_file` is a compiled vocabulary (see `compile_vocab`), or an up to
+  date compiled copy of it exists at `compiled_vocab_path(vocab_file)`, the
+  compiled file is memory mapped and returned as a read-only `CompiledVocab`
+  instead, which avoids parsing the text file.
+  """
+  compiled_file = _find_compiled_vocab(vocab_file)
+  if compiled_file is not None:
+    return CompiledVocab(compiled_file)
+  return _load_text_vocab(vocab_file)
+
+
+def _load_text_vocab(vocab_file):
+  """Loads a vocab.txt file into an `OrderedDict`."""
   vocab = collections.OrderedDict()
   index = 0
-  with tf.gfile.GFile(vocab_file, "r") as reader:
+  with _open_file(vocab_file) as reader:
     while True:
       token = convert_to_unicode(reader.readline())
       if not token:
@@ -82,6 +105,31 @@ def load_vocab(vocab_file):
   return vocab
 
 
+def _open_file(path):
+  """Opens a file for reading lines of UTF-8 bytes.
+
+  TensorFlow is only imported for paths that need `tf.gfile` (such as
+  "gs://..."), so that tokenization does not depend on it otherwise.
+  """
+  if "://" in path:
+    import tensorflow as tf  # pylint: disable=g-import-not-at-top
+    return tf.gfile.GFile(path, "rb")
+  return io.open(path, "rb")
+
+
+def _read_line_chunks(input_file, chunk_size):
+  """Yields the stripped lines of a text file in lists of `chunk_size`."""
+  lines = []
+  with _open_file(input_file) as reader:
+    for line in reader:
+      lines.append(convert_to_unicode(line).strip())
+      if len(lines) >= chunk_size:
+        yield lines
+        lines = []
+  if lines:
+    yield lines
+
+
 def convert_tokens_to_ids(vocab, tokens):
   """Converts a sequence of tokens into ids using the vocab."""
   ids = []
@@ -102,10 +150,12 @@ def whitespace_tokenize(text):
 class FullTokenizer(object):
   """Runs end-to-end tokenziation."""
 
-  def __init__(self, vocab_file, do_lower_case=True):
+  def __init__(self, vocab_file, do_lower_case=True, cache_size=50000):
     self.vocab = load_vocab(vocab_file)
     self.basic_tokenizer = BasicTokenizer(do_lower_case=do_lower_case)
-    self.wordpiece_tokenizer = WordpieceTokenizer(vocab=self.vocab)
+    self.wordpiece_tokenizer = WordpieceTokenizer(
+        vocab=self.vocab, cache_size=cache_size)
+    self._decode_tables = None
 
   def tokenize(self, text):
     split_tokens = []
@@ -118,6 +168,516 @@ class FullTokenizer(object):
   def convert_tokens_to_ids(self, tokens):
     return convert_tokens_to_ids(self.vocab, tokens)
 
+  def convert_ids_to_tokens(self, ids):
+    inv_vocab = self.wordpiece_tokenizer.inv_vocab
+    return [inv_vocab[i] for i in ids]
+
+  def decode(self, ids, skip_special=False):
+    """Turns wordpiece ids back into text.
+
+    Continuation pieces are merged into the word before them, so
+    "un ##want ##ed" becomes "unwanted", and words are separated by single
+    spaces. This is the text as the model sees it (e.g. lower cased and
+    split at punctuation), not the original text.
+
+    Args:
+      ids: A sequence of ids, or a batch of them (a list of sequences or a 2-D
+        array).
+      skip_special: Whether to leave out the [CLS], [SEP] and [PAD] tokens
+        that frame and pad the model input.
+
+    Returns:
+      A string, or a list of strings for a batch.
+    """
+    (pieces, is_special) = self._get_decode_tables()
+    if len(ids) > 0 and np.ndim(ids[0]) > 0:
+      return [
+          _decode_ids(row, pieces, is_special, skip_special) for row in ids
+      ]
+    return _decode_ids(ids, pieces, is_special, skip_special)
+
+  def _get_decode_tables(self):
+    """Returns the id-indexed arrays used by `decode`, building them once.
+
+    `pieces[i]` is the text that id `i` adds to the output: a space and the
+    token, or just the rest of the token for a "##" continuation.
+    """
+    if self._decode_tables is None:
+      inv_vocab = self.wordpiece_tokenizer.inv_vocab
+      if isinstance(inv_vocab, dict):
+        id_tokens = inv_vocab.items()
+        size = max(inv_vocab) + 1 if inv_vocab else 0
+      else:
+        size = len(inv_vocab)
+        id_tokens = ((i, inv_vocab[i]) for i in range(size))
+      pieces = np.full(size, u"", dtype=object)
+      is_special = np.zeros(size, dtype=np.bool_)
+      for (token_id, token) in id_tokens:
+        if token.startswith("##"):
+          pieces[token_id] = token[2:]
+        else:
+          pieces[token_id] = u" " + token
+        is_special[token_id] = token in _SPECIAL_TOKENS
+      self._decode_tables = (pieces, is_special)
+    return self._decode_tables
+
+  def tokenize_to_ids(self, text, max_tokens=None):
+    """Tokenizes a piece of text directly into wordpiece ids.
+
+    Args:
+      text: The text to tokenize.
+      max_tokens: If set, only the first `max_tokens` ids are returned, and
+        the text is only tokenized as far as needed to produce them.
+
+    Returns:
+      A list of wordpiece ids.
+    """
+    if max_tokens is None:
+      return self._tokenize_to_ids(text)
+
+    # Tokenization never crosses whitespace, so the text can be tokenized one
+    # chunk at a time as long as the chunks are split at whitespace. The
+    # chunks grow geometrically, so a short budget on a long text stops after
+    # a small prefix, while a text that is used in full costs at most about
+    # twice as much as tokenizing it in one go.
+    text = convert_to_unicode(text)
+    output_ids = []
+    start = 0
+    chunk_chars = _BUDGET_CHARS_PER_TOKEN * max_tokens + 1
+    while start < len(text) and len(output_ids) < max_tokens:
+      end = _next_separator(text, start + chunk_chars)
+      output_ids.extend(self._tokenize_to_ids(text[start:end]))
+      start = end
+      chunk_chars *= 2
+    return output_ids[0:max_tokens]
+
+  def _tokenize_to_ids(self, text):
+    wordpiece_tokenizer = self.wordpiece_tokenizer
+    output_ids = []
+    for token in self.basic_tokenizer.tokenize(text):
+      ids = wordpiece_tokenizer._word_to_ids(token)
+      if ids is None:
+        output_ids.append(self.vocab[wordpiece_tokenizer.unk_token])
+      else:
+        output_ids.extend(ids)
+    return output_ids
+
+  def encode(self, text, pair=None, max_length=None):
+    """Tokenizes text (and an optional second segment) into model inputs.
+
+    This is equivalent to tokenizing, truncating, adding [CLS] and [SEP],
+    converting to ids and zero-padding as the feature builders in
+    `run_classifier.py` and `extract_features.py` do, without building the
+    intermediate token lists.
+
+    Args:
+      text: The first segment.
+      pair: Optional second segment.
+      max_length: If set, the segments are truncated so the output (including
+        [CLS] and [SEP]) fits, and the output is zero-padded to this length.
+
+    Returns:
+      An `EncodedInput` of int32 NumPy arrays.
+    """
+    if max_length is None or max_length <= 3:
+      ids_b = None
+      if pair:
+        ids_b = self.tokenize_to_ids(pair)
+      return self.encode_ids(
+          self.tokenize_to_ids(text), ids_b, max_length=max_length)
+
+    # `_truncated_pair_lengths` only depends on how far each segment goes
+    # up to the budget of the pair, so neither segment has to be tokenized
+    # beyond it. An empty second segment leaves the whole budget (minus one
+    # [SEP]) to the first one.
+    pair_budget = max_length - 3
+    ids_b = None
+    if pair:
+      ids_b = self.tokenize_to_ids(pair, max_tokens=pair_budget)
+    if ids_b:
+      ids_a = self.tokenize_to_ids(text, max_tokens=pair_budget)
+    else:
+      ids_a = self.tokenize_to_ids(text, max_tokens=max_length - 2)
+    return self.encode_ids(ids_a, ids_b, max_length=max_length)
+
+  def encode_ids(self, ids_a, ids_b=None, max_length=None):
+    """Like `encode`, but for segments that are already wordpiece ids."""
+    has_b = ids_b is not None and len(ids_b) > 0
+    if max_length is not None:
+      if has_b:
+        # Account for [CLS], [SEP], [SEP] with "- 3"
+        (len_a, len_b) = _truncated_pair_lengths(
+            len(ids_a), len(ids_b), max_length - 3)
+        ids_a = ids_a[0:len_a]
+        ids_b = ids_b[0:len_b]
+        # A second segment truncated away gets no [SEP] of its own.
+        has_b = len_b > 0
+      else:
+        # Account for [CLS] and [SEP] with "- 2"
+        ids_a = ids_a[0:max_length - 2]
+
+    sep_a = len(ids_a) + 1
+    length = sep_a + 1
+    if has_b:
+      length += len(ids_b) + 1
+    if max_length is None:
+      max_length = length
+
+    input_ids = np.zeros(max_length, dtype=np.int32)
+    input_mask = np.zeros(max_length, dtype=np.int32)
+    segment_ids = np.zeros(max_length, dtype=np.int32)
+    input_ids[0] = self.vocab["[CLS]"]
+    input_ids[1:sep_a] = ids_a
+    input_ids[sep_a] = self.vocab["[SEP]"]
+    if has_b:
+      input_ids[sep_a + 1:length - 1] = ids_b
+      input_ids[length - 1] = self.vocab["[SEP]"]
+      segment_ids[sep_a + 1:length] = 1
+    input_mask[0:length] = 1
+    return EncodedInput(
+        input_ids=input_ids, input_mask=input_mask, segment_ids=segment_ids)
+
+  def tokenize_batch(self, texts, num_workers=1, chunk_size=256):
+    """Tokenizes a list of texts, optionally across a pool of processes.
+
+    Worker processes receive this tokenizer once, when they start (on
+    platforms that fork this is inherited rather than pickled), so only the
+    texts and the results are sent between processes.
+
+    Args:
+      texts: A list of strings.
+      num_workers: Number of worker processes. With 1 (or fewer), the texts
+        are tokenized serially in the calling process.
+      chunk_size: Number of texts sent to a worker at a time.
+
+    Returns:
+      A list with one `(tokens, ids)` tuple per input text, in input order.
+    """
+    if num_workers <= 1:
+      return [self._tokenize_with_ids(text) for text in texts]
+
+    pool = multiprocessing.Pool(
+        processes=num_workers,
+        initializer=_init_batch_worker,
+        initargs=(self,))
+    try:
+      return pool.map(_tokenize_in_batch_worker, texts, chunksize=chunk_size)
+    finally:
+      pool.close()
+      pool.join()
+
+  def tokenize_with_offsets(self, text):
+    """Tokenizes a piece of text, keeping track of where each token came from.
+
+    The offsets are computed in the same pass as the tokens, so spans of
+    wordpieces can be mapped back to the original text with index arithmetic
+    instead of re-tokenizing and re-aligning strings.
+
+    Args:
+      text: The text to tokenize.
+
+    Returns:
+      A `(tokens, offsets)` tuple, where `tokens` is what `tokenize` returns
+      and `offsets` holds a `(start, end)` tuple for every token such that
+      `text[start:end]` (after conversion to Unicode) is the span of the
+      original text the token was produced from. When lower casing and
+      accent stripping change the length of a word in a way that cannot be
+      attributed to individual characters, all of the pieces of that word
+      share the span of the whole word, as do unknown words.
+    """
+    text = convert_to_unicode(text)
+    wordpiece_tokenizer = self.wordpiece_tokenizer
+    inv_vocab = wordpiece_tokenizer.inv_vocab
+    tokens = []
+    offsets = []
+    for (token, start, end,
+         char_spans) in self.basic_tokenizer._tokenize_with_char_spans(text):
+      ids = wordpiece_tokenizer._word_to_ids(token)
+      if ids is None:
+        tokens.append(wordpiece_tokenizer.unk_token)
+        offsets.append((start, end))
+        continue
+      piece_start = 0
+      for (i, token_id) in enumerate(ids):
+        piece = inv_vocab[token_id]
+        piece_end = piece_start + len(piece)
+        if i > 0:
+          # Account for the "##" prefix of continuation pieces.
+          piece_end -= 2
+        if char_spans is None:
+          offsets.append((start + piece_start, start + piece_end))
+        else:
+          offsets.append((char_spans[piece_start][0],
+                          char_spans[piece_end - 1][1]))
+        tokens.append(piece)
+        piece_start = piece_end
+    return (tokens, offsets)
+
+  def tokenize_words(self, words):
+    """Tokenizes a list of pre-split words in one call.
+
+    This gives the same wordpieces as calling `tokenize` on every word
+    separately (as `run_squad.py` does for its whitespace-split documents),
+    along with the alignment between words and wordpieces.
+
+    Args:
+      words: A list of strings.
+
+    Returns:
+      A `(tokens, tok_to_orig_index, orig_to_tok_index)` tuple. `tokens` holds
+      the wordpieces of all of the words, `tok_to_orig_index[i]` is the index
+      of the word `tokens[i]` came from, and `orig_to_tok_index[j]` is the
+      index of the first wordpiece of word `j` (or of the next word's first
+      wordpiece, if word `j` has none).
+    """
+    words = [convert_to_unicode(word) for word in words]
+    tokens = []
+    tok_to_orig_index = []
+    orig_to_tok_index = []
+    if _overrides_basic_tokenizer_hooks(type(self.basic_tokenizer)):
+      # The single passes below would skip the overridden hooks.
+      for (i, word) in enumerate(words):
+        orig_to_tok_index.append(len(tokens))
+        self._add_wordpieces(
+            self.basic_tokenizer.tokenize(word), i, tokens, tok_to_orig_index)
+      return (tokens, tok_to_orig_index, orig_to_tok_index)
+
+    # Runs of pure ASCII words are joined and split with a single regex pass
+    # (see `BasicTokenizer._tokenize_ascii`); any other word goes through the
+    # full `BasicTokenizer` on its own.
+    run_start = 0
+    for (i, word) in enumerate(words):
+      if _is_ascii(word):
+        continue
+      self._tokenize_ascii_words(words, run_start, i, tokens,
+                                 tok_to_orig_index, orig_to_tok_index)
+      orig_to_tok_index.append(len(tokens))
+      self._add_wordpieces(
+          self.basic_tokenizer._tokenize_unicode(word), i, tokens,
+          tok_to_orig_index)
+      run_start = i + 1
+    self._tokenize_ascii_words(words, run_start, len(words), tokens,
+                               tok_to_orig_index, orig_to_tok_index)
+    return (tokens, tok_to_orig_index, orig_to_tok_index)
+
+  def _tokenize_ascii_words(self, words, begin, end, tokens,
+                            tok_to_orig_index, orig_to_tok_index):
+    """Runs `tokenize_words` for the ASCII words `words[begin:end]`."""
+    if begin >= end:
+      return
+    text = " ".join(words[begin:end])
+    if text.translate(_ASCII_CONTROL_CHARS) != text:
+      # Deleted control characters would shift the offsets below.
+      for i in range(begin, end):
+        orig_to_tok_index.append(len(tokens))
+        self._add_wordpieces(
+            self.basic_tokenizer.tokenize(words[i]), i, tokens,
+            tok_to_orig_index)
+      return
+
+    if self.basic_tokenizer.do_lower_case:
+      text = text.lower()
+    # Basic tokens never span the joining spaces, so each of them lies in a
+    # single word, which is found by walking the word offsets.
+    i = begin
+    orig_to_tok_index.append(len(tokens))
+    next_word_start = len(words[i]) + 1
+    basic_tokens = []
+    for match in _ASCII_TOKEN_RE.finditer(text):
+      if match.start() >= next_word_start:
+        self._add_wordpieces(basic_tokens, i, tokens, tok_to_orig_index)
+        basic_tokens = []
+        while match.start() >= next_word_start:
+          i += 1
+          orig_to_tok_index.append(len(tokens))
+          next_word_start += len(words[i]) + 1
+      basic_tokens.append(match.group())
+    self._add_wordpieces(basic_tokens, i, tokens, tok_to_orig_index)
+    for i in range(i + 1, end):
+      orig_to_tok_index.append(len(tokens))
+
+  def _add_wordpieces(self, basic_tokens, word_index, tokens,
+                      tok_to_orig_index):
+    """Appends the wordpieces of the basic tokens of one word to `tokens`."""
+    wordpiece_tokenizer = self.wordpiece_tokenizer
+    inv_vocab = wordpiece_tokenizer.inv_vocab
+    for token in basic_tokens:
+      ids = wordpiece_tokenizer._word_to_ids(token)
+      if ids is None:
+        tokens.append(wordpiece_tokenizer.unk_token)
+        tok_to_orig_index.append(word_index)
+        continue
+      for token_id in ids:
+        tokens.append(inv_vocab[token_id])
+      tok_to_orig_index.extend([word_index] * len(ids))
+
+  def tokenize_file(self,
+                    input_file,
+                    by_document=False,
+                    num_workers=1,
+                    chunk_size=256,
+                    max_pending_chunks=None):
+    """Streams the wordpiece ids of a text file.
+
+    The file is read and tokenized `chunk_size` lines at a time, and only a
+    bounded number of chunks are read ahead of the consumer, so memory use
+    does not grow with the size of the file.
+
+    Args:
+      input_file: Path of a UTF-8 text file.
+      by_document: If False, yields one int32 NumPy array of ids per line
+        (empty for blank lines). If True, yields one list of such arrays per
+        document instead, in the `create_pretraining_data.py` input format:
+        documents are separated by blank lines, and lines that produce no
+        tokens are dropped.
+      num_workers: Number of worker processes, as in `tokenize_batch`.
+      chunk_size: Number of lines read (and sent to a worker) at a time.
+      max_pending_chunks: Maximum number of chunks read and tokenized ahead
+        of the consumer when using workers. Defaults to twice `num_workers`.
+
+    Yields:
+      Arrays of ids, or lists of arrays of ids, as described above.
+    """
+    chunks = self._tokenize_file_chunks(input_file, num_workers, chunk_size,
+                                        max_pending_chunks)
+    if not by_document:
+      for (_, chunk_ids) in chunks:
+        for ids in chunk_ids:
+          yield ids
+      return
+
+    document = []
+    for (lines, chunk_ids) in chunks:
+      for (line, ids) in zip(lines, chunk_ids):
+        if not line:
+          if document:
+            yield document
+            document = []
+        elif len(ids):
+          document.append(ids)
+    if document:
+      yield document
+
+  def _tokenize_file_chunks(self, input_file, num_workers, chunk_size,
+                            max_pending_chunks):
+    """Yields `(lines, ids)` for each chunk of lines of `input_file`."""
+    chunks = _read_line_chunks(input_file, chunk_size)
+    if num_workers <= 1:
+      for lines in chunks:
+        yield (lines, self._tokenize_chunk_to_ids(lines))
+      return
+
+    if max_pending_chunks is None:
+      max_pending_chunks = 2 * num_workers
+    pool = multiprocessing.Pool(
+        processes=num_workers,
+        initializer=_init_batch_worker,
+        initargs=(self,))
+    try:
+      # `Pool.imap` would read the whole input ahead of the consumer, so
+      # chunks are submitted by hand and at most `max_pending_chunks` are in
+      # flight at a time.
+      pending = collections.deque()
+      for lines in chunks:
+        if len(pending) >= max_pending_chunks:
+          (done_lines, result) = pending.popleft()
+          yield (done_lines, result.get())
+        pending.append((lines,
+                        pool.apply_async(_tokenize_chunk_in_batch_worker,
+                                         (lines,))))
+      while pending:
+        (done_lines, result) = pending.popleft()
+        yield (done_lines, result.get())
+    finally:
+      pool.terminate()
+      pool.join()
+
+  def _tokenize_chunk_to_ids(self, lines):
+    return [
+        np.array(self.tokenize_to_ids(line), dtype=np.int32) for line in lines
+    ]
+
+  def _tokenize_with_ids(self, text):
+    tokens = self.tokenize(text)
+    return (tokens, self.convert_tokens_to_ids(tokens))
+
+
+EncodedInput = collections.namedtuple(
+    "EncodedInput", ["input_ids", "input_mask", "segment_ids"])
+
+
+def _truncated_pair_lengths(len_a, len_b, max_length):
+  """Computes the lengths a sequence pair is truncated to.
+
+  This is the closed form of the usual heuristic of repeatedly removing the
+  last token of the longer sequence (of the second one on ties) until the
+  pair fits in `max_length`.
+  """
+  if len_a + len_b <= max_length:
+    return (len_a, len_b)
+  if len_a <= max_length // 2:
+    return (len_a, max_length - len_a)
+  if len_b <= max_length // 2:
+    return (max_length - len_b, len_b)
+  return ((max_length + 1) // 2, max_length // 2)
+
+
+def _decode_ids(ids, pieces, is_special, skip_special):
+  """Decodes one sequence of ids for `FullTokenizer.decode`."""
+  ids = np.asarray(ids, dtype=np.int64)
+  if skip_special:
+    ids = ids[~is_special[ids]]
+  # Besides the "##" of continuations, this drops any stray "##", like at the
+  # start of a span that begins in the middle of a word.
+  text = u"".join(pieces[ids]).replace(u"##", u"")
+  return u" ".join(text.split())
+
+
+# The tokens skipped by `FullTokenizer.decode(..., skip_special=True)`.
+_SPECIAL_TOKENS = frozenset([u"[CLS]", u"[SEP]", u"[PAD]"])
+
+
+def _next_separator(text, position):
+  """Returns the index of the first word separator at or after `position`.
+
+  Returns `len(text)` if there is none.
+  """
+  while True:
+    match = _SPACE_RE.search(text, position)
+    if match is None:
+      return len(text)
+    # `\s` also matches a few control characters, which are removed rather
+    # than treated as whitespace.
+    if _char_flags(match.group()) & _SEPARATOR:
+      return match.start()
+    position = match.end()
+
+
+# Every word separator is matched by this, but not the other way around.
+_SPACE_RE = re.compile(r"\s", re.UNICODE)
+
+# How many characters of text per wordpiece to tokenize at first when
+# tokenizing with a budget. Natural text averages well under this.
+_BUDGET_CHARS_PER_TOKEN = 8
+
+
+# The tokenizer used by the current `FullTokenizer.tokenize_batch` (or
+# `tokenize_file`) worker process. Set once per worker by `_init_batch_worker`.
+_batch_worker_tokenizer = None
+
+
+def _init_batch_worker(tokenizer):
+  global _batch_worker_tokenizer
+  _batch_worker_tokenizer = tokenizer
+
+
+def _tokenize_in_batch_worker(text):
+  return _batch_worker_tokenizer._tokenize_with_ids(text)
+
+
+def _tokenize_chunk_in_batch_worker(lines):
+  return _batch_worker_tokenizer._tokenize_chunk_to_ids(lines)
+
 
 class BasicTokenizer(object):
   """Runs basic tokenization (punctuation splitting, lower casing, etc.)."""
@@ -131,16 +691,29 @@ class BasicTokenizer(object):
     self.do_lower_case = do_lower_case
 
   def tokenize(self, text):
-    """Tokenizes a piece of text."""
+    """Tokenizes a piece of text.
+
+    Invalid character removal, whitespace cleanup, CJK character splitting,
+    lower casing, accent stripping and punctuation splitting all happen in a
+    single pass over the text, using the precomputed codepoint classification
+    tables at the bottom of this file.
+
+    A subclass that overrides one of the step hooks (`_clean_text`,
+    `_tokenize_chinese_chars`, `_is_chinese_char`, `_run_strip_accents` or
+    `_run_split_on_punc`) is instead tokenized one step at a time through the
+    hooks, as before the single pass existed. `tokenize_with_offsets` always
+    uses the single pass.
+    """
     text = convert_to_unicode(text)
-    text = self._clean_text(text)
+    if _overrides_basic_tokenizer_hooks(type(self)):
+      return self._tokenize_with_hooks(text)
+    if _is_ascii(text):
+      return self._tokenize_ascii(text)
+    return self._tokenize_unicode(text)
 
-    # This was added on November 1st, 2018 for the multilingual and Chinese
-    # models. This is also applied to the English models now, but it doesn't
-    # matter since the English models were not trained on any Chinese data
-    # and generally don't have any Chinese data in them (there are Chinese
-    # characters in the vocabulary because Wikipedia does have some Chinese
-    # words in the English Wikipedia.).
+  def _tokenize_with_hooks(self, text):
+    """Tokenizes Unicode text one step at a time through the hooks."""
+    text = self._clean_text(text)
     text = self._tokenize_chinese_chars(text)
 
     orig_tokens = whitespace_tokenize(text)
@@ -157,40 +730,29 @@ class BasicTokenizer(object):
   def _run_strip_accents(self, text):
     """Strips accents from a piece of text."""
     text = unicodedata.normalize("NFD", text)
-    output = []
-    for char in text:
-      cat = unicodedata.category(char)
-      if cat == "Mn":
-        continue
-      output.append(char)
-    return "".join(output)
+    return "".join(
+        char for char in text if not _char_flags(char) & _NONSPACING_MARK)
 
   def _run_split_on_punc(self, text):
     """Splits punctuation on a piece of text."""
-    chars = list(text)
-    i = 0
-    start_new_word = True
     output = []
-    while i < len(chars):
-      char = chars[i]
-      if _is_punctuation(char):
-        output.append([char])
+    start_new_word = True
+    for char in text:
+      if _char_flags(char) & _PUNCTUATION:
+        output.append(char)
         start_new_word = True
       else:
         if start_new_word:
-          output.append([])
+          output.append("")
         start_new_word = False
-        output[-1].append(char)
-      i += 1
-
-    return ["".join(x) for x in output]
+        output[-1] += char
+    return output
 
   def _tokenize_chinese_chars(self, text):
     """Adds whitespace around any CJK character."""
     output = []
     for char in text:
-      cp = ord(char)
-      if self._is_chinese_char(cp):
+      if self._is_chinese_char(ord(char)):
         output.append(" ")
         output.append(char)
         output.append(" ")
@@ -200,47 +762,300 @@ class BasicTokenizer(object):
 
   def _is_chinese_char(self, cp):
     """Checks whether CP is the codepoint of a CJK character."""
-    # This defines a "chinese character" as anything in the CJK Unicode block:
-    #   https://en.wikipedia.org/wiki/CJK_Unified_Ideographs_(Unicode_block)
-    #
-    # Note that the CJK Unicode block is NOT all Japanese and Korean characters,
-    # despite its name. The modern Korean Hangul alphabet is a different block,
-    # as is Japanese Hiragana and Katakana. Those alphabets are used to write
-    # space-separated words, so they are not treated specially and handled
-    # like the all of the other languages.
-    if ((cp >= 0x4E00 and cp <= 0x9FFF) or  #
-        (cp >= 0x3400 and cp <= 0x4DBF) or  #
-        (cp >= 0x20000 and cp <= 0x2A6DF) or  #
-        (cp >= 0x2A700 and cp <= 0x2B73F) or  #
-        (cp >= 0x2B740 and cp <= 0x2B81F) or  #
-        (cp >= 0x2B820 and cp <= 0x2CEAF) or
-        (cp >= 0xF900 and cp <= 0xFAFF) or  #
-        (cp >= 0x2F800 and cp <= 0x2FA1F)):  #
-      return True
-
-    return False
+    return _is_chinese_char(cp)
 
   def _clean_text(self, text):
     """Performs invalid character removal and whitespace cleanup on text."""
     output = []
     for char in text:
-      cp = ord(char)
-      if cp == 0 or cp == 0xfffd or _is_control(char):
+      flags = _char_flags(char)
+      if flags & _REMOVED:
         continue
-      if _is_whitespace(char):
+      if flags & _WHITESPACE:
         output.append(" ")
       else:
         output.append(char)
     return "".join(output)
 
+  def _tokenize_ascii(self, text):
+    """Tokenizes text that is known to be pure ASCII.
+
+    In ASCII the only characters that survive cleanup are whitespace,
+    punctuation (every non-alphanumeric printable character) and letters and
+    digits, and there are no CJK characters or accents. Tokenization reduces
+    to deleting control characters, lower casing, and matching runs of
+    alphanumerics or single punctuation characters.
+    """
+    text = text.translate(_ASCII_CONTROL_CHARS)
+    if self.do_lower_case:
+      text = text.lower()
+    return _ASCII_TOKEN_RE.findall(text)
+
+  def tokenize_with_offsets(self, text):
+    """Tokenizes a piece of text, keeping track of where each token came from.
+
+    Returns:
+      A list of `(token, start, end)` tuples, where `text[start:end]` (after
+      conversion to Unicode) is the span of the original text that `token`
+      was produced from.
+    """
+    text = convert_to_unicode(text)
+    return [(token, start, end)
+            for (token, start, end, _) in self._tokenize_with_char_spans(text)]
+
+  def _tokenize_with_char_spans(self, text):
+    """Tokenizes Unicode text into `(token, start, end, char_spans)` tuples.
+
+    `char_spans` holds the `(start, end)` span of the original text that each
+    character of `token` came from. It is None when character `i` of `token`
+    simply came from `text[start + i]`, which is by far the common case.
+    """
+    if _is_ascii(text) and text.translate(_ASCII_CONTROL_CHARS) == text:
+      lower = self.do_lower_case
+      output = []
+      for match in _ASCII_TOKEN_RE.finditer(text):
+        token = match.group()
+        if lower:
+          token = token.lower()
+        output.append((token, match.start(), match.end(), None))
+      return output
+
+    planes = _CHAR_FLAG_PLANES
+    output = []
+    word = []
+    positions = []
+    word_flags = 0
+    for (i, char) in enumerate(text):
+      cp = ord(char)
+      table = planes[cp >> 16] or _char_flag_plane(cp >> 16)
+      flags = table[cp & 0xFFFF]
+      if flags & _REMOVED:
+        continue
+      if flags & (_SEPARATOR | _CHINESE):
+        if word:
+          self._add_word_with_char_spans(word, positions, word_flags, output)
+          word = []
+          positions = []
+          word_flags = 0
+        if flags & _CHINESE:
+          self._add_word_with_char_spans([char], [i], flags, output)
+        continue
+      word.append(char)
+      positions.append(i)
+      word_flags |= flags
+    if word:
+      self._add_word_with_char_spans(word, positions, word_flags, output)
+
+    return output
+
+  def _add_word_with_char_spans(self, chars, positions, word_flags, output):
+    """Like `_add_word`, but also tracks where each character came from."""
+    token = "".join(chars)
+    start = positions[0]
+    end = positions[-1] + 1
+    needs_split = word_flags & _PUNCTUATION
+    char_spans = None
+    if end - start != len(chars):
+      # Removed characters inside the word.
+      char_spans = [(pos, pos + 1) for pos in positions]
+    if self.do_lower_case:
+      token = token.lower()
+      if not _is_ascii(token):
+        token = unicodedata.normalize("NFD", token)
+        needs_split = True
+        char_spans = _normalized_char_spans(chars, positions, token)
+    if not needs_split:
+      output.append((token, start, end, char_spans))
+      return
+
+    strip_accents = self.do_lower_case
+    planes = _CHAR_FLAG_PLANES
+    pieces = []
+    piece_indices = []
+    for (i, char) in enumerate(token):
+      cp = ord(char)
+      table = planes[cp >> 16] or _char_flag_plane(cp >> 16)
+      flags = table[cp & 0xFFFF]
+      if flags & _PUNCTUATION:
+        if pieces:
+          output.append(
+              _piece_with_char_spans(pieces, piece_indices, start, char_spans))
+          pieces = []
+          piece_indices = []
+        output.append(_piece_with_char_spans([char], [i], start, char_spans))
+      elif strip_accents and flags & _NONSPACING_MARK:
+        continue
+      else:
+        pieces.append(char)
+        piece_indices.append(i)
+    if pieces:
+      output.append(
+          _piece_with_char_spans(pieces, piece_indices, start, char_spans))
+
+  def _tokenize_unicode(self, text):
+    """Tokenizes arbitrary Unicode text."""
+    planes = _CHAR_FLAG_PLANES
+    output_tokens = []
+    word = []
+    word_flags = 0
+    for char in text:
+      cp = ord(char)
+      table = planes[cp >> 16] or _char_flag_plane(cp >> 16)
+      flags = table[cp & 0xFFFF]
+      if not flags:
+        word.append(char)
+        continue
+      if flags & _REMOVED:
+        continue
+      if flags & _SEPARATOR:
+        if word:
+          self._add_word(word, word_flags, output_tokens)
+          word = []
+          word_flags = 0
+        continue
+      # This was added on November 1st, 2018 for the multilingual and Chinese
+      # models. This is also applied to the English models now, but it doesn't
+      # matter since the English models were not trained on any Chinese data
+      # and generally don't have any Chinese data in them (there are Chinese
+      # characters in the vocabulary because Wikipedia does have some Chinese
+      # words in the English Wikipedia.).
+      if flags & _CHINESE:
+        if word:
+          self._add_word(word, word_flags, output_tokens)
+          word = []
+          word_flags = 0
+        self._add_word([char], flags, output_tokens)
+        continue
+      word.append(char)
+      word_flags |= flags
+    if word:
+      self._add_word(word, word_flags, output_tokens)
+
+    return output_tokens
+
+  def _add_word(self, chars, word_flags, output_tokens):
+    """Normalizes a whitespace-delimited word and splits it on punctuation."""
+    token = "".join(chars)
+    needs_split = word_flags & _PUNCTUATION
+    if self.do_lower_case:
+      token = token.lower()
+      if not _is_ascii(token):
+        # Lower casing and NFD can both introduce characters (combining marks,
+        # and occasionally punctuation) that were not in the original word, so
+        # the word has to be classified again after normalization.
+        token = unicodedata.normalize("NFD", token)
+        needs_split = True
+    if not needs_split:
+      output_tokens.append(token)
+      return
+
+    strip_accents = self.do_lower_case
+    planes = _CHAR_FLAG_PLANES
+    pieces = []
+    for char in token:
+      cp = ord(char)
+      table = planes[cp >> 16] or _char_flag_plane(cp >> 16)
+      flags = table[cp & 0xFFFF]
+      if flags & _PUNCTUATION:
+        if pieces:
+          output_tokens.append("".join(pieces))
+          pieces = []
+        output_tokens.append(char)
+      elif strip_accents and flags & _NONSPACING_MARK:
+        continue
+      else:
+        pieces.append(char)
+    if pieces:
+      output_tokens.append("".join(pieces))
+
+
+# The methods of `BasicTokenizer` that subclasses can override to change one
+# step of the tokenization.
+_BASIC_TOKENIZER_HOOKS = ("_clean_text", "_tokenize_chinese_chars",
+                          "_is_chinese_char", "_run_strip_accents",
+                          "_run_split_on_punc")
+
+# Whether each `BasicTokenizer` class overrides any of the hooks, by class.
+_overridden_hooks_by_class = {}
+
+
+def _overrides_basic_tokenizer_hooks(cls):
+  """Checks whether a `BasicTokenizer` class overrides any step hook."""
+  overrides = _overridden_hooks_by_class.get(cls)
+  if overrides is None:
+    overrides = any(
+        six.get_unbound_function(getattr(cls, name)) is not
+        six.get_unbound_function(getattr(BasicTokenizer, name))
+        for name in _BASIC_TOKENIZER_HOOKS)
+    _overridden_hooks_by_class[cls] = overrides
+  return overrides
+
+
+def _normalized_char_spans(chars, positions, token):
+  """Maps the characters of a lower cased, NFD normalized word to the text.
+
+  Each original character is normalized on its own, and the characters it
+  produces are attributed to it. Normalizing characters one at a time does
+  not always give the same result as normalizing the whole word (for example
+  because of context-sensitive lower casing, or the reordering of combining
+  marks), in which case every character gets the span of the whole word.
+  """
+  char_spans = []
+  normalized = []
+  for (char, pos) in zip(chars, positions):
+    char = unicodedata.normalize("NFD", char.lower())
+    normalized.append(char)
+    char_spans.extend([(pos, pos + 1)] * len(char))
+  if "".join(normalized) != token:
+    return [(positions[0], positions[-1] + 1)] * len(token)
+  return char_spans
+
+
+def _piece_with_char_spans(pieces, indices, start, char_spans):
+  """Builds a `_tokenize_with_char_spans` entry for part of a word."""
+  piece = "".join(pieces)
+  if char_spans is None and indices[-1] - indices[0] + 1 == len(indices):
+    return (piece, start + indices[0], start + indices[-1] + 1, None)
+  if char_spans is None:
+    spans = [(start + i, start + i + 1) for i in indices]
+  else:
+    spans = [char_spans[i] for i in indices]
+  return (piece, spans[0][0], spans[-1][1], spans)
+
 
 class WordpieceTokenizer(object):
   """Runs WordPiece tokenziation."""
 
-  def __init__(self, vocab, unk_token="[UNK]", max_input_chars_per_word=100):
+  def __init__(self,
+               vocab,
+               unk_token="[UNK]",
+               max_input_chars_per_word=100,
+               cache_size=0):
+    """Constructs a WordpieceTokenizer.
+
+    Args:
+      vocab: A dict from wordpiece to id, or a `CompiledVocab`.
+      unk_token: The token emitted for words that cannot be tokenized.
+      max_input_chars_per_word: Words longer than this are emitted as
+        `unk_token` without being split.
+      cache_size: Maximum number of words whose wordpiece ids are kept in a
+        least-recently-used cache. Natural text is dominated by a small set
+        of frequent words, so most words are looked up rather than split. 0
+        disables the cache.
+    """
     self.vocab = vocab
     self.unk_token = unk_token
     self.max_input_chars_per_word = max_input_chars_per_word
+    if isinstance(vocab, CompiledVocab):
+      self.inv_vocab = vocab.inv_vocab
+      self.trie = vocab.trie
+    else:
+      self.inv_vocab = {v: k for (k, v) in vocab.items()}
+      self.trie = WordpieceTrie(vocab)
+    self.cache_size = cache_size
+    self.cache_hits = 0
+    self.cache_misses = 0
+    self._cache = collections.OrderedDict()
 
   def tokenize(self, text):
     """Tokenizes a piece of text into its word pieces.
@@ -262,75 +1077,607 @@ class WordpieceTokenizer(object):
 
     text = convert_to_unicode(text)
 
+    inv_vocab = self.inv_vocab
     output_tokens = []
     for token in whitespace_tokenize(text):
-      chars = list(token)
-      if len(chars) > self.max_input_chars_per_word:
-        output_tokens.append(self.unk_token)
-        continue
-
-      is_bad = False
-      start = 0
-      sub_tokens = []
-      while start < len(chars):
-        end = len(chars)
-        cur_substr = None
-        while start < end:
-          substr = "".join(chars[start:end])
-          if start > 0:
-            substr = "##" + substr
-          if substr in self.vocab:
-            cur_substr = substr
-            break
-          end -= 1
-        if cur_substr is None:
-          is_bad = True
-          break
-        sub_tokens.append(cur_substr)
-        start = end
-
-      if is_bad:
+      ids = self._word_to_ids(token)
+      if ids is None:
         output_tokens.append(self.unk_token)
       else:
-        output_tokens.extend(sub_tokens)
+        output_tokens.extend([inv_vocab[i] for i in ids])
     return output_tokens
 
+  def cache_info(self):
+    """Reports cache statistics, in the style of `functools.lru_cache`."""
+    return WordpieceCacheInfo(
+        hits=self.cache_hits,
+        misses=self.cache_misses,
+        maxsize=self.cache_size,
+        currsize=len(self._cache))
+
+  def cache_clear(self):
+    """Empties the cache and resets its statistics."""
+    self._cache.clear()
+    self.cache_hits = 0
+    self.cache_misses = 0
+
+  def warm_cache(self, num_words=None):
+    """Pre-populates the cache with whole-word vocabulary entries.
+
+    Entries are taken in vocabulary order, which for the released BERT
+    vocabularies roughly follows corpus frequency, skipping "##" continuation
+    pieces. A whole-word entry always tokenizes to itself, so no splitting is
+    needed to fill the cache.
+
+    Args:
+      num_words: Maximum number of words to add. Defaults to filling the
+        cache.
+    """
+    limit = self.cache_size
+    if num_words is not None:
+      limit = min(limit, len(self._cache) + num_words)
+    for (token, token_id) in sorted(self.vocab.items(), key=lambda x: x[1]):
+      if len(self._cache) >= limit:
+        break
+      if (not token or token.startswith("##") or
+          len(token) > self.max_input_chars_per_word or token in self._cache):
+        continue
+      self._cache[token] = (token_id,)
+
+  def _word_to_ids(self, word):
+    """Returns the wordpiece ids of a single word, or None if it is unknown."""
+    if not self.cache_size:
+      return self._split_word(word)
+
+    cache = self._cache
+    ids = cache.get(word, _CACHE_MISS)
+    if ids is not _CACHE_MISS:
+      self.cache_hits += 1
+      # Mark the word as most recently used.
+      del cache[word]
+      cache[word] = ids
+      return ids
+
+    self.cache_misses += 1
+    ids = self._split_word(word)
+    if len(cache) >= self.cache_size:
+      cache.popitem(last=False)
+    cache[word] = ids
+    return ids
+
+  def _split_word(self, word):
+    """Greedily splits a single word into wordpiece ids."""
+    if len(word) > self.max_input_chars_per_word:
+      return None
+
+    vocab = self.vocab
+    start = 0
+    sub_ids = []
+    while start < len(word):
+      (cur_substr, end) = self.trie.longest_match(word, start)
+      if cur_substr is None:
+        return None
+      sub_ids.append(vocab[cur_substr])
+      start = end
+    return tuple(sub_ids)
+
+
+WordpieceCacheInfo = collections.namedtuple(
+    "WordpieceCacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+# Marks a word that is not in the `WordpieceTokenizer` cache (the cache itself
+# stores None for words that tokenize to the unknown token).
+_CACHE_MISS = object()
+
+
+class WordpieceTrie(object):
+  """Prefix trie over a WordPiece vocabulary.
+
+  Two tries are kept: one over every vocabulary entry (used for the first
+  piece of a word) and one over the "##" continuation entries with the
+  prefix removed (used for every later piece). Finding the longest piece
+  starting at a given position is then a single walk over the word instead
+  of one vocabulary probe per candidate end position.
+  """
+
+  # Key under which a node stores the vocabulary entry that ends there. Trie
+  # edges are labelled with single characters, so this can never collide.
+  _TOKEN_KEY = ""
+
+  def __init__(self, vocab):
+    self.root = {}
+    self.suffix_root = {}
+    for token in vocab:
+      if not token:
+        continue
+      self._insert(self.root, token, token)
+      if token.startswith("##") and len(token) > 2:
+        self._insert(self.suffix_root, token[2:], token)
+
+  def _insert(self, node, key, token):
+    for char in key:
+      child = node.get(char)
+      if child is None:
+        child = {}
+        node[char] = child
+      node = child
+    node[self._TOKEN_KEY] = token
+
+  def longest_match(self, word, start):
+    """Finds the longest vocabulary entry that begins at `word[start]`.
+
+    Args:
+      word: A single whitespace-free token.
+      start: Index into `word`. Entries are matched with a "##" prefix when
+        `start` is greater than zero, mirroring WordPiece continuation pieces.
+
+    Returns:
+      A `(token, end)` tuple, where `token` is the matching vocabulary entry
+      (including any "##" prefix) and `end` is the index just past the match.
+      `token` is None if no entry matches.
+    """
+    node = self.root if start == 0 else self.suffix_root
+    token_key = self._TOKEN_KEY
+    match = None
+    match_end = start
+    end = start
+    for char in word[start:]:
+      node = node.get(char)
+      if node is None:
+        break
+      end += 1
+      token = node.get(token_key)
+      if token is not None:
+        match = token
+        match_end = end
+    return (match, match_end)
+
+
+def compiled_vocab_path(vocab_file):
+  """Returns where `load_vocab` looks for a compiled copy of `vocab_file`."""
+  return vocab_file + ".compiled"
+
+
+def compile_vocab(vocab_file, output_file=None):
+  """Compiles a vocab.txt file into a memory-mappable binary file.
+
+  The compiled file holds the token table, a hash index from token to id and
+  the prebuilt `WordpieceTrie`, all as flat little-endian int32 arrays, so it
+  can be loaded without parsing anything and shared read-only between
+  processes by the operating system's page cache.
+
+  Layout (after a `_COMPILED_VOCAB_HEADER` header):
+    offsets:      int32[num_ids + 1], byte offsets of each token in `blob`.
+    hash_index:   int32[hash_size], token ids (-1 for empty slots) by the
+                  crc32 of the token's UTF-8 bytes, with linear probing.
+    For the root trie and then the "##" suffix trie (see `WordpieceTrie`):
+      node_edges:    int32[num_nodes + 1], range of each node's edges.
+      edge_chars:    int32[num_edges], codepoints, sorted within each node.
+      edge_children: int32[num_edges], child node of each edge.
+      node_tokens:   int32[num_nodes], id of the token ending at each node,
+                     or -1.
+    blob:         The UTF-8 encoded tokens, back to back.
+
+  Args:
+    vocab_file: The vocab.txt file to compile.
+    output_file: Where to write the compiled vocabulary. Defaults to
+      `compiled_vocab_path(vocab_file)`, where `load_vocab` finds it.
+
+  Returns:
+    The path of the compiled file.
+  """
+  if output_file is None:
+    output_file = compiled_vocab_path(vocab_file)
+
+  tokens = []
+  with _open_file(vocab_file) as reader:
+    while True:
+      token = convert_to_unicode(reader.readline())
+      if not token:
+        break
+      tokens.append(token.strip())
+  # Like `_load_text_vocab`, a token that appears more than once maps to its
+  # last id.
+  vocab = collections.OrderedDict()
+  for (index, token) in enumerate(tokens):
+    vocab[token] = index
+
+  encoded = [token.encode("utf-8") for token in tokens]
+  offsets = [0]
+  for token_bytes in encoded:
+    offsets.append(offsets[-1] + len(token_bytes))
+
+  hash_size = 1
+  while hash_size < 2 * len(vocab):
+    hash_size *= 2
+  hash_index = [-1] * hash_size
+  for (token, index) in vocab.items():
+    slot = _vocab_hash(encoded[index]) & (hash_size - 1)
+    while hash_index[slot] != -1:
+      slot = (slot + 1) & (hash_size - 1)
+    hash_index[slot] = index
+
+  trie = WordpieceTrie(vocab)
+  root_arrays = _flatten_trie(trie.root, vocab)
+  suffix_arrays = _flatten_trie(trie.suffix_root, vocab)
+
+  header = struct.pack(_COMPILED_VOCAB_HEADER, _COMPILED_VOCAB_MAGIC,
+                       len(tokens), len(vocab), offsets[-1], hash_size,
+                       len(root_arrays[3]), len(root_arrays[1]),
+                       len(suffix_arrays[3]), len(suffix_arrays[1]))
+  with open(output_file, "wb") as writer:
+    writer.write(header)
+    for array in [offsets, hash_index] + root_arrays + suffix_arrays:
+      writer.write(struct.pack("<%di" % len(array), *array))
+    writer.write(b"".join(encoded))
+  return output_file
+
+
+def _flatten_trie(root, vocab):
+  """Flattens a `WordpieceTrie` dict trie into CSR int32 arrays."""
+  node_edges = [0]
+  edge_chars = []
+  edge_children = []
+  node_tokens = []
+  nodes = [root]
+  # Nodes are numbered in breadth-first order, so each node's children are
+  # numbered when its edges are written out.
+  for node in nodes:
+    token = node.get(WordpieceTrie._TOKEN_KEY)
+    node_tokens.append(-1 if token is None else vocab[token])
+    for char in sorted(k for k in node if k != WordpieceTrie._TOKEN_KEY):
+      edge_chars.append(ord(char))
+      edge_children.append(len(nodes))
+      nodes.append(node[char])
+    node_edges.append(len(edge_chars))
+  return [node_edges, edge_chars, edge_children, node_tokens]
+
+
+def _vocab_hash(token_bytes):
+  return zlib.crc32(token_bytes) & 0xFFFFFFFF
+
+
+def _find_compiled_vocab(vocab_file):
+  """Returns the compiled vocab `load_vocab` should use, or None."""
+  if "://" in vocab_file:
+    return None
+  if _is_compiled_vocab(vocab_file):
+    if not _CAN_MAP_COMPILED_VOCAB:
+      raise ValueError(
+          "Compiled vocab files can only be loaded on little-endian Python 3: "
+          "%s" % vocab_file)
+    return vocab_file
+  if not _CAN_MAP_COMPILED_VOCAB:
+    return None
+  compiled_file = compiled_vocab_path(vocab_file)
+  try:
+    if os.path.getmtime(compiled_file) < os.path.getmtime(vocab_file):
+      return None
+  except OSError:
+    return None
+  if not _is_compiled_vocab(compiled_file):
+    return None
+  return compiled_file
+
+
+def _is_compiled_vocab(path):
+  try:
+    with open(path, "rb") as reader:
+      return reader.read(len(_COMPILED_VOCAB_MAGIC)) == _COMPILED_VOCAB_MAGIC
+  except (IOError, OSError):
+    return False
+
+
+# Bump the version in the magic string when the layout changes.
+_COMPILED_VOCAB_MAGIC = b"BERTVOC1"
+# magic, num_ids, num_tokens, blob_size, hash_size, root_nodes, root_edges,
+# suffix_nodes, suffix_edges.
+_COMPILED_VOCAB_HEADER = "<8s8I"
+
+# `memoryview.cast` is Python 3 only, and the arrays are stored little-endian.
+_CAN_MAP_COMPILED_VOCAB = six.PY3 and sys.byteorder == "little"
+
+try:
+  from collections.abc import Mapping as _Mapping
+except ImportError:
+  _Mapping = collections.Mapping
+
+
+class CompiledVocab(_Mapping):
+  """A read-only, memory-mapped vocabulary built by `compile_vocab`.
+
+  This behaves like the dict returned by `load_vocab` for a text vocabulary
+  (token to id, iterating in id order), and also provides the inverse table
+  and the `WordpieceTrie` that `WordpieceTokenizer` needs, without building
+  any per-token Python objects up front.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    with open(path, "rb") as reader:
+      self._mmap = mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_READ)
+    header_size = struct.calcsize(_COMPILED_VOCAB_HEADER)
+    (magic, num_ids, self._num_tokens, blob_size, hash_size, root_nodes,
+     root_edges, suffix_nodes, suffix_edges) = struct.unpack(
+         _COMPILED_VOCAB_HEADER, self._mmap[0:header_size])
+    if magic != _COMPILED_VOCAB_MAGIC:
+      raise ValueError("Not a compiled vocab file: %s" % path)
+
+    buf = memoryview(self._mmap)
+    position = [header_size]
+
+    def take(length):
+      start = position[0]
+      position[0] += 4 * length
+      return buf[start:position[0]].cast("i")
+
+    self._offsets = take(num_ids + 1)
+    self._hash_index = take(hash_size)
+    root = [take(root_nodes + 1), take(root_edges), take(root_edges),
+            take(root_nodes)]
+    suffix = [take(suffix_nodes + 1), take(suffix_edges), take(suffix_edges),
+              take(suffix_nodes)]
+    self._blob = buf[position[0]:position[0] + blob_size]
+    self._hash_mask = hash_size - 1
+    # Ids of the tokens looked up so far. Only the part of the vocabulary that
+    # is actually used ends up in here.
+    self._ids = {}
+    self.inv_vocab = _CompiledTokenTable(self._offsets, self._blob)
+    self.trie = ArrayWordpieceTrie(root, suffix, self.inv_vocab)
+
+  def __reduce__(self):
+    # Processes that receive this vocab map the same file again rather than
+    # being sent a copy of it.
+    return (CompiledVocab, (self.path,))
+
+  def __getitem__(self, token):
+    token_id = self._lookup(token)
+    if token_id < 0:
+      raise KeyError(token)
+    return token_id
+
+  def __contains__(self, token):
+    return self._lookup(token) >= 0
+
+  def __len__(self):
+    return self._num_tokens
+
+  def __iter__(self):
+    # Like an `OrderedDict` built from the text file, a duplicated token is
+    # listed at its first position (but maps to its last id).
+    inv_vocab = self.inv_vocab
+    duplicates = set()
+    for token_id in range(len(inv_vocab)):
+      token = inv_vocab[token_id]
+      if token in duplicates:
+        continue
+      if self._probe(token) != token_id:
+        duplicates.add(token)
+      yield token
+
+  def _lookup(self, token):
+    token_id = self._ids.get(token)
+    if token_id is not None:
+      return token_id
+    if not isinstance(token, six.text_type):
+      return -1
+    token_id = self._probe(token)
+    if token_id >= 0:
+      self._ids[token] = token_id
+    return token_id
+
+  def _probe(self, token):
+    """Looks `token` up in the hash index."""
+    token_bytes = token.encode("utf-8")
+    hash_index = self._hash_index
+    offsets = self._offsets
+    blob = self._blob
+    mask = self._hash_mask
+    slot = _vocab_hash(token_bytes) & mask
+    while True:
+      token_id = hash_index[slot]
+      if token_id < 0:
+        return -1
+      if blob[offsets[token_id]:offsets[token_id + 1]] == token_bytes:
+        return token_id
+      slot = (slot + 1) & mask
+
+
+class _CompiledTokenTable(object):
+  """Id to token lookups into the token table of a `CompiledVocab`."""
+
+  def __init__(self, offsets, blob):
+    self._offsets = offsets
+    self._blob = blob
+    # Tokens decoded so far, by id.
+    self._tokens = {}
+
+  def __len__(self):
+    return len(self._offsets) - 1
+
+  def __getitem__(self, token_id):
+    token = self._tokens.get(token_id)
+    if token is not None:
+      return token
+    if token_id < 0 or token_id >= len(self):
+      raise KeyError(token_id)
+    offsets = self._offsets
+    token = self._blob[offsets[token_id]:offsets[token_id + 1]].tobytes(
+    ).decode("utf-8")
+    self._tokens[token_id] = token
+    return token
+
+
+class ArrayWordpieceTrie(object):
+  """A `WordpieceTrie` stored as flat arrays, as found in a `CompiledVocab`.
+
+  Each trie is stored in compressed sparse row form: the edges leaving node
+  `n` are `node_edges[n]` to `node_edges[n + 1]`, sorted by codepoint, so
+  following an edge is a binary search over `edge_chars`.
+  """
+
+  def __init__(self, root, suffix, inv_vocab):
+    self.root = root
+    self.suffix_root = suffix
+    self._inv_vocab = inv_vocab
+
+  def longest_match(self, word, start):
+    """See `WordpieceTrie.longest_match`."""
+    (node_edges, edge_chars, edge_children,
+     node_tokens) = self.root if start == 0 else self.suffix_root
+    node = 0
+    match = -1
+    match_end = start
+    end = start
+    for char in word[start:]:
+      lo = node_edges[node]
+      hi = node_edges[node + 1]
+      cp = ord(char)
+      i = bisect.bisect_left(edge_chars, cp, lo, hi)
+      if i == hi or edge_chars[i] != cp:
+        break
+      node = edge_children[i]
+      end += 1
+      if node_tokens[node] >= 0:
+        match = node_tokens[node]
+        match_end = end
+    if match < 0:
+      return (None, start)
+    return (self._inv_vocab[match], match_end)
+
+
+def _is_ascii(text):
+  """Checks whether every character of `text` is 7-bit ASCII."""
+  if _HAS_ISASCII:
+    return text.isascii()
+  try:
+    text.encode("ascii")
+  except UnicodeError:
+    return False
+  return True
+
 
 def _is_whitespace(char):
   """Checks whether `chars` is a whitespace character."""
-  # \t, \n, and \r are technically contorl characters but we treat them
-  # as whitespace since they are generally considered as such.
-  if char == " " or char == "\t" or char == "\n" or char == "\r":
-    return True
-  cat = unicodedata.category(char)
-  if cat == "Zs":
-    return True
-  return False
+  return bool(_char_flags(char) & _WHITESPACE)
 
 
 def _is_control(char):
   """Checks whether `chars` is a control character."""
-  # These are technically control characters but we count them as whitespace
-  # characters.
-  if char == "\t" or char == "\n" or char == "\r":
-    return False
-  cat = unicodedata.category(char)
-  if cat.startswith("C"):
-    return True
-  return False
+  return bool(_char_flags(char) & _CONTROL)
 
 
 def _is_punctuation(char):
   """Checks whether `chars` is a punctuation character."""
-  cp = ord(char)
+  return bool(_char_flags(char) & _PUNCTUATION)
+
+
+def _is_chinese_char(cp):
+  """Checks whether CP is the codepoint of a CJK character."""
+  return bool(_codepoint_flags(cp) & _CHINESE)
+
+
+# `str.isascii` is a constant-time check, but only exists on Python 3.7+.
+_HAS_ISASCII = hasattr(six.text_type, "isascii")
+
+# Translation table deleting the ASCII control characters (everything below
+# 0x20 except \t, \n and \r, plus DEL).
+_ASCII_CONTROL_CHARS = dict.fromkeys(
+    [cp for cp in range(0x20) if cp not in (0x09, 0x0A, 0x0D)] + [0x7F])
+
+# A run of ASCII letters and digits, or a single ASCII punctuation character.
+_ASCII_TOKEN_RE = re.compile(r"[0-9A-Za-z]+|[!-/:-@\[-`{-~]")
+
+# Bit flags stored for every codepoint in the classification tables.
+_WHITESPACE = 0x01
+_CONTROL = 0x02
+_PUNCTUATION = 0x04
+_CHINESE = 0x08
+_NONSPACING_MARK = 0x10
+# Characters that are dropped by the text cleanup (controls, NUL and U+FFFD).
+_REMOVED = 0x20
+# Characters that end a word: everything `_is_whitespace` accepts plus the
+# remaining characters `str.split()` treats as whitespace (U+2028, U+2029).
+_SEPARATOR = 0x40
+
+# One lazily-built bytearray of flags per Unicode plane, indexed by the low 16
+# bits of the codepoint. Most text only ever touches the BMP, so the other
+# planes are not computed until a character from them is seen.
+_CHAR_FLAG_PLANES = [None] * 17
+
+
+def _char_flags(char):
+  """Returns the classification bit flags for a single character."""
+  return _codepoint_flags(ord(char))
+
+
+def _codepoint_flags(cp):
+  """Returns the classification bit flags for a codepoint."""
+  table = _CHAR_FLAG_PLANES[cp >> 16] or _char_flag_plane(cp >> 16)
+  return table[cp & 0xFFFF]
+
+
+def _char_flag_plane(plane):
+  """Returns the flag table for a Unicode plane, building it if needed."""
+  table = _CHAR_FLAG_PLANES[plane]
+  if table is None:
+    table = bytearray(0x10000)
+    base = plane << 16
+    for low in range(0x10000):
+      table[low] = _compute_char_flags(base + low)
+    _CHAR_FLAG_PLANES[plane] = table
+  return table
+
+
+def _compute_char_flags(cp):
+  """Classifies a codepoint from scratch using `unicodedata`."""
+  char = six.unichr(cp)
+  cat = unicodedata.category(char)
+  flags = 0
+
+  # \t, \n, and \r are technically contorl characters but we treat them
+  # as whitespace since they are generally considered as such.
+  if char == " " or char == "\t" or char == "\n" or char == "\r":
+    flags |= _WHITESPACE | _SEPARATOR
+  elif cat == "Zs":
+    flags |= _WHITESPACE | _SEPARATOR
+  elif cat.startswith("C"):
+    flags |= _CONTROL | _REMOVED
+  elif char.isspace():
+    flags |= _SEPARATOR
+
+  if cp == 0 or cp == 0xfffd:
+    flags |= _REMOVED
+
   # We treat all non-letter/number ASCII as punctuation.
   # Characters such as "^", "$", and "`" are not in the Unicode
   # Punctuation class but we treat them as punctuation anyways, for
   # consistency.
   if ((cp >= 33 and cp <= 47) or (cp >= 58 and cp <= 64) or
       (cp >= 91 and cp <= 96) or (cp >= 123 and cp <= 126)):
-    return True
-  cat = unicodedata.category(char)
-  if cat.startswith("P"):
-    return True
-  return False
+    flags |= _PUNCTUATION
+  elif cat.startswith("P"):
+    flags |= _PUNCTUATION
+
+  # This defines a "chinese character" as anything in the CJK Unicode block:
+  #   https://en.wikipedia.org/wiki/CJK_Unified_Ideographs_(Unicode_block)
+  #
+  # Note that the CJK Unicode block is NOT all Japanese and Korean characters,
+  # despite its name. The modern Korean Hangul alphabet is a different block,
+  # as is Japanese Hiragana and Katakana. Those alphabets are used to write
+  # space-separated words, so they are not treated specially and handled
+  # like the all of the other languages.
+  if ((cp >= 0x4E00 and cp <= 0x9FFF) or  #
+      (cp >= 0x3400 and cp <= 0x4DBF) or  #
+      (cp >= 0x20000 and cp <= 0x2A6DF) or  #
+      (cp >= 0x2A700 and cp <= 0x2B73F) or  #
+      (cp >= 0x2B740 and cp <= 0x2B81F) or  #
+      (cp >= 0x2B820 and cp <= 0x2CEAF) or
+      (cp >= 0xF900 and cp <= 0xFAFF) or  #
+      (cp >= 0x2F800 and cp <= 0x2FA1F)):  #
+    flags |= _CHINESE
+
+  if cat == "Mn":
+    flags |= _NONSPACING_MARK
+
+  return flags
@@ -0,0 +1,371 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Throughput benchmarks for tokenization.py.
+
+Measures characters and tokens per second of `BasicTokenizer`,
+`WordpieceTokenizer` and `FullTokenizer` on the input file and on synthetic
+English, CJK-heavy, accent-heavy and long-word corpora built from it, along
+with the peak memory allocated while tokenizing each corpus. The wordpiece
+stages are measured both with the wordpiece cache emptied before every pass
+and with it kept warm, along with its hit rate. The results can be written as
+JSON to track them over time.
+
+Example:
+  python tokenization_benchmark.py \
+    --input_file=sample_text.txt \
+    --vocab_file=$BERT_BASE_DIR/vocab.txt \
+    --repeats=20 \
+    --output_json=/tmp/tokenization_benchmark.json
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import collections
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import six
+import tokenization
+
+
+def read_lines(input_file):
+  """Reads the non-empty lines of a UTF-8 text file."""
+  lines = []
+  with io.open(input_file, "r", encoding="utf-8") as reader:
+    for line in reader:
+      line = line.strip()
+      if line:
+        lines.append(line)
+  return lines
+
+
+def time_tokenizer(tokenize_fn, lines, repeats, before_pass=None):
+  """Runs `tokenize_fn` over `lines` `repeats` times.
+
+  Args:
+    tokenize_fn: Function that tokenizes one line.
+    lines: The lines to tokenize.
+    repeats: Number of passes over `lines`.
+    before_pass: (optional) Function called before every pass, outside of
+      the timing.
+
+  Returns:
+    A `(seconds, num_tokens)` tuple covering all repeats.
+  """
+  num_tokens = 0
+  seconds = 0.0
+  for _ in range(repeats):
+    if before_pass is not None:
+      before_pass()
+    start = time.time()
+    for line in lines:
+      num_tokens += len(tokenize_fn(line))
+    seconds += time.time() - start
+  return (seconds, num_tokens)
+
+
+CORPORA = ("sample_text", "english", "cjk", "accented", "long_words")
+
+# Accented letters, both precomposed and as a base letter followed by a
+# combining mark, which exercise accent stripping and the non-ASCII path.
+_ACCENTED_CHARS = [
+    u"\u00e0", u"\u00e1", u"\u00e2", u"\u00e4", u"\u00e7", u"\u00e8",
+    u"\u00e9", u"\u00ea", u"\u00ed", u"\u00f1", u"\u00f3", u"\u00f6",
+    u"\u00fa", u"\u00fc", u"\u0161", u"\u017e", u"e\u0301", u"a\u0300",
+    u"o\u0308", u"u\u0302"
+]
+
+
+def make_corpus(name, lines, num_lines, seed=12345):
+  """Builds a benchmark corpus from the words of `lines`.
+
+  Args:
+    name: One of `CORPORA`. "sample_text" is `lines` itself, "english" is
+      random sentences of its words, "cjk" mixes them with CJK ideographs,
+      "accented" puts accents on about a third of the letters and
+      "long_words" glues several words together, including some longer than
+      `WordpieceTokenizer`'s `max_input_chars_per_word`.
+    lines: The lines of the input file.
+    num_lines: Number of lines of the synthetic corpora.
+    seed: Random seed, so that the corpora are the same from run to run.
+
+  Returns:
+    A list of lines.
+  """
+  if name == "sample_text":
+    return list(lines)
+  if name not in CORPORA:
+    raise ValueError("Unknown corpus: %s" % name)
+
+  rng = random.Random(seed)
+  vocab_words = sorted(set(word for line in lines for word in line.split()))
+
+  def random_words(n):
+    return [rng.choice(vocab_words) for _ in range(n)]
+
+  corpus = []
+  for _ in range(num_lines):
+    if name == "english":
+      words = random_words(rng.randint(5, 40))
+    elif name == "cjk":
+      words = []
+      for word in random_words(rng.randint(5, 40)):
+        if rng.random() < 0.7:
+          word = u"".join(
+              six.unichr(rng.randint(0x4E00, 0x9FFF))
+              for _ in range(rng.randint(1, 6)))
+        words.append(word)
+    elif name == "accented":
+      words = []
+      for word in random_words(rng.randint(5, 40)):
+        words.append(u"".join(
+            rng.choice(_ACCENTED_CHARS)
+            if char.isalpha() and rng.random() < 0.3 else char
+            for char in word))
+    else:
+      words = [
+          u"".join(random_words(rng.choice([2, 3, 5, 8, 30])))
+          for _ in range(rng.randint(2, 10))
+      ]
+    corpus.append(u" ".join(words))
+  return corpus
+
+
+def peak_memory_mb(fn):
+  """Returns the peak memory in MB allocated by Python objects during `fn()`.
+
+  Returns None where `tracemalloc` is not available (Python 2).
+  """
+  try:
+    import tracemalloc  # pylint: disable=g-import-not-at-top
+  except ImportError:
+    return None
+  tracemalloc.start()
+  try:
+    fn()
+    (_, peak) = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return peak / (1024.0 * 1024.0)
+
+
+def benchmark_corpus(tokenizer, lines, repeats):
+  """Benchmarks each stage of `tokenizer` on `lines`.
+
+  `WordpieceTokenizer` is timed on the output of `BasicTokenizer`, so the two
+  stages add up to roughly the `FullTokenizer` time.
+
+  The stages that split words into wordpieces are timed twice. The "cold"
+  runs (`wordpiece` and `full`) empty the wordpiece cache before every pass,
+  so every pass splits the words of the corpus as the first one does, and
+  vocabulary or domain changes show up in the numbers. The "warm" runs
+  (`wordpiece_warm` and `full_warm`) keep the cache from pass to pass, as a
+  long tokenization job does. Each reports the hit rate of the cache.
+
+  Args:
+    tokenizer: A `FullTokenizer`.
+    lines: The lines of the corpus.
+    repeats: Number of passes over `lines` for each measurement.
+
+  Returns:
+    A dict of results, suitable for JSON.
+  """
+  basic_tokenizer = tokenizer.basic_tokenizer
+  wordpiece_tokenizer = tokenizer.wordpiece_tokenizer
+  words = [basic_tokenizer.tokenize(line) for line in lines]
+  num_chars = sum(len(line) for line in lines) * repeats
+
+  def wordpiece_tokenize(line_words):
+    output_tokens = []
+    for word in line_words:
+      output_tokens.extend(wordpiece_tokenizer.tokenize(word))
+    return output_tokens
+
+  stages = collections.OrderedDict()
+  for (stage, fn, inputs, uses_cache, cold) in [
+      ("basic", basic_tokenizer.tokenize, lines, False, False),
+      ("wordpiece", wordpiece_tokenize, words, True, True),
+      ("wordpiece_warm", wordpiece_tokenize, words, True, False),
+      ("full", tokenizer.tokenize, lines, True, True),
+      ("full_warm", tokenizer.tokenize, lines, True, False)]:
+    wordpiece_tokenizer.cache_clear()
+    before_pass = wordpiece_tokenizer.cache_clear if cold else None
+    (seconds, num_tokens) = time_tokenizer(fn, inputs, repeats, before_pass)
+    stages[stage] = collections.OrderedDict([
+        ("seconds", seconds),
+        ("chars_per_sec", num_chars / seconds),
+        ("tokens_per_sec", num_tokens / seconds),
+        ("num_tokens", num_tokens // repeats),
+    ])
+    if uses_cache:
+      # With `cold`, this is the hit rate of the last pass, which is that of
+      # every pass.
+      cache_info = wordpiece_tokenizer.cache_info()
+      lookups = cache_info.hits + cache_info.misses
+      stages[stage]["cache_hit_rate"] = (
+          cache_info.hits / lookups if lookups else None)
+
+  staged_seconds = stages["basic"]["seconds"] + stages["wordpiece"]["seconds"]
+  wordpiece_tokenizer.cache_clear()
+  return collections.OrderedDict([
+      ("num_lines", len(lines)),
+      ("num_chars", num_chars // repeats),
+      ("stages", stages),
+      ("basic_time_fraction", stages["basic"]["seconds"] / staged_seconds),
+      ("wordpiece_time_fraction",
+       stages["wordpiece"]["seconds"] / staged_seconds),
+      ("peak_memory_mb",
+       peak_memory_mb(lambda: [tokenizer.tokenize(line) for line in lines])),
+  ])
+
+
+def benchmark_ascii_fast_path(lines, do_lower_case, repeats):
+  """Compares the ASCII fast path of `BasicTokenizer` to the general path.
+
+  Only the ASCII lines of `lines` are used, since those are the only ones the
+  fast path applies to. Both paths must produce identical tokens.
+  """
+  tokenizer = tokenization.BasicTokenizer(do_lower_case=do_lower_case)
+  ascii_lines = [line for line in lines if tokenization._is_ascii(line)]
+  for line in ascii_lines:
+    assert (tokenizer._tokenize_ascii(line) ==
+            tokenizer._tokenize_unicode(line)), line
+
+  results = []
+  for (name, fn) in [("ascii_fast_path", tokenizer._tokenize_ascii),
+                     ("general_path", tokenizer._tokenize_unicode)]:
+    (seconds, num_tokens) = time_tokenizer(fn, ascii_lines, repeats)
+    results.append((name, num_tokens / seconds))
+  return results
+
+
+def benchmark_import(module_name):
+  """Measures the cost of importing `module_name` in a fresh interpreter.
+
+  Returns:
+    A `(seconds, max_rss_mb)` tuple: the wall time of the import statement
+    and the peak resident set size of the process afterwards.
+  """
+  code = ("import resource, time\n"
+          "start = time.time()\n"
+          "import %s\n"
+          "print(time.time() - start)\n"
+          "print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)\n" %
+          module_name)
+  output = subprocess.check_output(
+      [sys.executable, "-c", code],
+      cwd=os.path.dirname(os.path.abspath(__file__)))
+  (seconds, max_rss) = output.split()[-2:]
+  # `ru_maxrss` is in kilobytes on Linux, but in bytes on macOS.
+  if sys.platform == "darwin":
+    max_rss = int(max_rss) // 1024
+  return (float(seconds), int(max_rss) / 1024.0)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--input_file", default="sample_text.txt",
+                      help="UTF-8 text file to tokenize, one line at a time.")
+  parser.add_argument("--vocab_file", default=None,
+                      help="Vocabulary for the WordpieceTokenizer and "
+                      "FullTokenizer benchmarks, which are skipped without "
+                      "it.")
+  parser.add_argument("--repeats", type=int, default=100,
+                      help="Number of passes over each corpus.")
+  parser.add_argument("--num_synthetic_lines", type=int, default=1000,
+                      help="Number of lines of each synthetic corpus.")
+  parser.add_argument("--output_json", default=None,
+                      help="Where to write the results as JSON.")
+  args = parser.parse_args()
+
+  results = collections.OrderedDict([
+      ("time", time.strftime("%Y-%m-%dT%H:%M:%S")),
+      ("python", platform.python_version()),
+      ("input_file", args.input_file),
+      ("vocab_file", args.vocab_file),
+      ("repeats", args.repeats),
+  ])
+
+  # `tokenization` used to import TensorFlow, so the second line is roughly
+  # what every tokenization process paid before it stopped doing so.
+  print("Import cost (fresh process)")
+  results["import"] = collections.OrderedDict()
+  for module_name in ("tokenization", "tensorflow"):
+    try:
+      (seconds, max_rss_mb) = benchmark_import(module_name)
+    except subprocess.CalledProcessError:
+      print("  %-16s not importable" % module_name)
+      continue
+    print("  %-16s %8.3f sec %8.1f MB max RSS" % (module_name, seconds,
+                                                 max_rss_mb))
+    results["import"][module_name] = collections.OrderedDict([
+        ("seconds", seconds), ("max_rss_mb", max_rss_mb)])
+
+  lines = read_lines(args.input_file)
+  results["ascii_fast_path"] = collections.OrderedDict()
+  for do_lower_case in (True, False):
+    print("BasicTokenizer(do_lower_case=%s)" % do_lower_case)
+    fast_path_results = benchmark_ascii_fast_path(lines, do_lower_case,
+                                                  args.repeats)
+    for (name, tokens_per_sec) in fast_path_results:
+      print("  %-16s %12.0f tokens/sec" % (name, tokens_per_sec))
+    results["ascii_fast_path"]["do_lower_case=%s" % do_lower_case] = (
+        collections.OrderedDict(fast_path_results))
+
+  if args.vocab_file:
+    results["corpora"] = collections.OrderedDict()
+    for do_lower_case in (True, False):
+      tokenizer = tokenization.FullTokenizer(
+          vocab_file=args.vocab_file, do_lower_case=do_lower_case)
+      print("FullTokenizer(do_lower_case=%s)" % do_lower_case)
+      print("  %-12s %-14s %14s %14s %8s %8s" %
+            ("corpus", "stage", "chars/sec", "tokens/sec", "time %",
+             "hit %"))
+      for name in CORPORA:
+        corpus = make_corpus(name, lines, args.num_synthetic_lines)
+        result = benchmark_corpus(tokenizer, corpus, args.repeats)
+        for (stage, stage_result) in result["stages"].items():
+          share = ""
+          if stage + "_time_fraction" in result:
+            share = "%7.1f%%" % (100.0 * result[stage + "_time_fraction"])
+          hit_rate = ""
+          if stage_result.get("cache_hit_rate") is not None:
+            hit_rate = "%7.1f%%" % (100.0 * stage_result["cache_hit_rate"])
+          print("  %-12s %-14s %14.0f %14.0f %8s %8s" %
+                (name, stage, stage_result["chars_per_sec"],
+                 stage_result["tokens_per_sec"], share, hit_rate))
+        if result["peak_memory_mb"] is not None:
+          print("  %-12s peak memory %.1f MB" % (name,
+                                                 result["peak_memory_mb"]))
+        results["corpora"]["%s/do_lower_case=%s" % (name, do_lower_case)] = (
+            result)
+
+  if args.output_json:
+    with io.open(args.output_json, "w", encoding="utf-8") as writer:
+      writer.write(json.dumps(results, indent=2) + u"\n")
+    print("Wrote %s" % args.output_json)
+
+
+if __name__ == "__main__":
+  main()
@@ -17,26 +17,44 @@ from __future__ import division
 from __future__ import print_function
 
 import os
+import subprocess
+import sys
 import tempfile
 
+import numpy as np
+
 import tokenization
 import tensorflow as tf
 
 
 class TokenizationTest(tf.test.TestCase):
 
-  def test_full_tokenizer(self):
-    vocab_tokens = [
-        "[UNK]", "[CLS]", "[SEP]", "want", "##want", "##ed", "wa", "un", "runn",
-        "##ing", ","
-    ]
+  def _create_full_tokenizer(self, vocab_tokens, **kwargs):
     with tempfile.NamedTemporaryFile(delete=False) as vocab_writer:
-      vocab_writer.write("".join([x + "\n" for x in vocab_tokens]))
+      vocab_writer.write("".join([x + "\n" for x in vocab_tokens]).encode(
+          "utf-8"))
 
       vocab_file = vocab_writer.name
 
-    tokenizer = tokenization.FullTokenizer(vocab_file)
+    tokenizer = tokenization.FullTokenizer(vocab_file, **kwargs)
     os.unlink(vocab_file)
+    return tokenizer
+
+  def test_import_without_tensorflow(self):
+    # Lightweight tokenization processes should not pay for importing
+    # TensorFlow.
+    code = "import sys, tokenization; print('tensorflow' in sys.modules)"
+    output = subprocess.check_output(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.abspath(tokenization.__file__)))
+    self.assertEqual(output.strip(), b"False")
+
+  def test_full_tokenizer(self):
+    vocab_tokens = [
+        "[UNK]", "[CLS]", "[SEP]", "want", "##want", "##ed", "wa", "un", "runn",
+        "##ing", ","
+    ]
+    tokenizer = self._create_full_tokenizer(vocab_tokens)
 
     tokens = tokenizer.tokenize(u"UNwant\u00E9d,running")
     self.assertAllEqual(tokens, ["un", "##want", "##ed", ",", "runn", "##ing"])
@@ -44,6 +62,255 @@ class TokenizationTest(tf.test.TestCase):
     self.assertAllEqual(
         tokenizer.convert_tokens_to_ids(tokens), [7, 4, 5, 10, 8, 9])
 
+  def test_tokenize_batch(self):
+    vocab_tokens = [
+        "[UNK]", "[CLS]", "[SEP]", "want", "##want", "##ed", "wa", "un", "runn",
+        "##ing", ","
+    ]
+    tokenizer = self._create_full_tokenizer(vocab_tokens)
+
+    texts = [u"UNwant\u00E9d,running", u"", u"wa want xyz"] * 5
+    expected = [(tokenizer.tokenize(text),
+                 tokenizer.convert_tokens_to_ids(tokenizer.tokenize(text)))
+                for text in texts]
+
+    self.assertEqual(tokenizer.tokenize_batch(texts), expected)
+    self.assertEqual(
+        tokenizer.tokenize_batch(texts, num_workers=2, chunk_size=4), expected)
+
+  def test_tokenize_words(self):
+    vocab_tokens = [
+        "[UNK]", "[CLS]", "[SEP]", "want", "##want", "##ed", "wa", "un", "runn",
+        "##ing", ","
+    ]
+    tokenizer = self._create_full_tokenizer(vocab_tokens)
+
+    words = [u"UNwant\u00E9d,", u"running", u"\u0001", u"wa,X", u"", u"want"]
+    (tokens, tok_to_orig_index,
+     orig_to_tok_index) = tokenizer.tokenize_words(words)
+    self.assertAllEqual(tokens, [
+        "un", "##want", "##ed", ",", "runn", "##ing", "wa", ",", "[UNK]", "want"
+    ])
+    self.assertAllEqual(tok_to_orig_index, [0, 0, 0, 0, 1, 1, 3, 3, 3, 5])
+    self.assertAllEqual(orig_to_tok_index, [0, 4, 6, 6, 9, 9])
+
+    # The same words without the non-ASCII one.
+    (tokens, tok_to_orig_index,
+     orig_to_tok_index) = tokenizer.tokenize_words(words[1:])
+    self.assertAllEqual(tokens, ["runn", "##ing", "wa", ",", "[UNK]", "want"])
+    self.assertAllEqual(tok_to_orig_index, [0, 0, 2, 2, 2, 4])
+    self.assertAllEqual(orig_to_tok_index, [0, 2, 2, 5, 5])
+
+    # A `BasicTokenizer` with overridden hooks is used word by word.
+    class NoPunctuationSplitTokenizer(tokenization.BasicTokenizer):
+
+      def _run_split_on_punc(self, text):
+        return [text]
+
+    tokenizer.basic_tokenizer = NoPunctuationSplitTokenizer()
+    words = [u"UNwant\u00E9d,", u"running", u"wa,X", u"want"]
+    (tokens, tok_to_orig_index,
+     orig_to_tok_index) = tokenizer.tokenize_words(words)
+    self.assertAllEqual(tokens, ["[UNK]", "runn", "##ing", "[UNK]", "want"])
+    self.assertAllEqual(
+        tokens, [token for word in words for token in tokenizer.tokenize(word)])
+    self.assertAllEqual(tok_to_orig_index, [0, 1, 1, 2, 3])
+    self.assertAllEqual(orig_to_tok_index, [0, 1, 3, 4])
+
+  def test_tokenize_file(self):
+    vocab_tokens = [
+        "[UNK]", "[CLS]", "[SEP]", "want", "##want", "##ed", "wa", "un", "runn",
+        "##ing", ","
+    ]
+    tokenizer = self._create_full_tokenizer(vocab_tokens)
+
+    with tempfile.NamedTemporaryFile(delete=False) as input_writer:
+      input_writer.write(
+          u"unwanted running\n\u0001\nwa\n\n\n  \nwant,\n".encode("utf-8"))
+      input_file = input_writer.name
+
+    for (num_workers, chunk_size) in [(1, 256), (2, 1), (2, 2)]:
+      lines = list(
+          tokenizer.tokenize_file(
+              input_file, num_workers=num_workers, chunk_size=chunk_size))
+      self.assertEqual([line.dtype for line in lines], [np.int32] * 7)
+      self.assertAllEqual([list(line) for line in lines],
+                          [[7, 4, 5, 8, 9], [], [6], [], [], [], [3, 10]])
+
+      documents = list(
+          tokenizer.tokenize_file(
+              input_file,
+              by_document=True,
+              num_workers=num_workers,
+              chunk_size=chunk_size))
+      self.assertAllEqual([[list(line) for line in document]
+                           for document in documents],
+                          [[[7, 4, 5, 8, 9], [6]], [[3, 10]]])
+    os.unlink(input_file)
+
+  def test_encode(self):
+    vocab_tokens = [
+        "[UNK]", "[CLS]", "[SEP]", "want", "##want", "##ed", "wa", "un", "runn",
+        "##ing", ","
+    ]
+    tokenizer = self._create_full_tokenizer(vocab_tokens)
+
+    self.assertAllEqual(tokenizer.tokenize_to_ids(u"UNwant\u00E9d,runningX"),
+                        [7, 4, 5, 10, 0])
+
+    # A budget gives the same ids as truncating, including when the text is
+    # cut in the middle of a word or the budget is larger than the text.
+    text = u" ".join([u"unwanted,running\x1cwant"] * 50)
+    ids = tokenizer.tokenize_to_ids(text)
+    for max_tokens in (0, 1, 2, 5, 6, 7, 100, len(ids), len(ids) + 1):
+      self.assertAllEqual(
+          tokenizer.tokenize_to_ids(text, max_tokens=max_tokens),
+          ids[0:max_tokens])
+
+    encoded = tokenizer.encode(u"unwanted running", max_length=8)
+    self.assertEqual(encoded.input_ids.dtype, np.int32)
+    self.assertAllEqual(encoded.input_ids, [1, 7, 4, 5, 8, 9, 2, 0])
+    self.assertAllEqual(encoded.input_mask, [1, 1, 1, 1, 1, 1, 1, 0])
+    self.assertAllEqual(encoded.segment_ids, [0, 0, 0, 0, 0, 0, 0, 0])
+
+    # The longer segment is truncated first.
+    encoded = tokenizer.encode(u"unwanted running", pair=u"want", max_length=7)
+    self.assertAllEqual(encoded.input_ids, [1, 7, 4, 5, 2, 3, 2])
+    self.assertAllEqual(encoded.input_mask, [1, 1, 1, 1, 1, 1, 1])
+    self.assertAllEqual(encoded.segment_ids, [0, 0, 0, 0, 0, 1, 1])
+
+    encoded = tokenizer.encode(u"want", pair=u"wa")
+    self.assertAllEqual(encoded.input_ids, [1, 3, 2, 6, 2])
+    self.assertAllEqual(encoded.segment_ids, [0, 0, 0, 1, 1])
+
+    # Long segments are only tokenized up to the budget, with the same result.
+    long_text = u"want " * 1000
+    encoded = tokenizer.encode(long_text, pair=u"wa wa", max_length=8)
+    self.assertAllEqual(encoded.input_ids, [1, 3, 3, 3, 2, 6, 6, 2])
+    encoded = tokenizer.encode(u"wa", pair=long_text, max_length=8)
+    self.assertAllEqual(encoded.input_ids, [1, 6, 2, 3, 3, 3, 3, 2])
+
+    # A second segment truncated away gets no [SEP], as in the old builders.
+    encoded = tokenizer.encode(u"want want", pair=u"wa", max_length=4)
+    self.assertAllEqual(encoded.input_ids, [1, 3, 2, 0])
+    self.assertAllEqual(encoded.input_mask, [1, 1, 1, 0])
+    self.assertAllEqual(encoded.segment_ids, [0, 0, 0, 0])
+    encoded = tokenizer.encode(u"want", pair=u"wa", max_length=3)
+    self.assertAllEqual(encoded.input_ids, [1, 2, 0])
+    self.assertAllEqual(encoded.input_mask, [1, 1, 0])
+    self.assertAllEqual(encoded.segment_ids, [0, 0, 0])
+
+  def test_decode(self):
+    vocab_tokens = [
+        "[PAD]", "[UNK]", "[CLS]", "[SEP]", "want", "##want", "##ed", "wa",
+        "un", "runn", "##ing", ","
+    ]
+    tokenizer = self._create_full_tokenizer(vocab_tokens)
+
+    ids = tokenizer.tokenize_to_ids(u"UNwant\u00E9d,running")
+    self.assertEqual(tokenizer.decode(ids), u"unwanted , running")
+    # A span that starts in the middle of a word.
+    self.assertEqual(tokenizer.decode(ids[1:]), u"wanted , running")
+    self.assertEqual(tokenizer.decode([]), u"")
+
+    encoded = tokenizer.encode(u"want running", pair=u"wa", max_length=10)
+    self.assertEqual(
+        tokenizer.decode(encoded.input_ids),
+        u"[CLS] want running [SEP] wa [SEP] [PAD] [PAD] [PAD]")
+    self.assertEqual(
+        tokenizer.decode(encoded.input_ids, skip_special=True),
+        u"want running wa")
+
+    batch = np.array([[8, 5, 6, 0], [9, 10, 1, 3]])
+    self.assertAllEqual(
+        tokenizer.decode(batch, skip_special=True),
+        [u"unwanted", u"running [UNK]"])
+    self.assertAllEqual(
+        tokenizer.decode([[4], [7, 11, 7]]), [u"want", u"wa , wa"])
+
+  def test_tokenize_with_offsets(self):
+    vocab_tokens = [
+        "[UNK]", "[CLS]", "[SEP]", "want", "##want", "##ed", "wa", "un", "runn",
+        "##ing", ","
+    ]
+    tokenizer = self._create_full_tokenizer(vocab_tokens)
+
+    (tokens, offsets) = tokenizer.tokenize_with_offsets(
+        u" UNwant\u00E9d,running xyz")
+    self.assertAllEqual(tokens,
+                        ["un", "##want", "##ed", ",", "runn", "##ing", "[UNK]"])
+    self.assertAllEqual(offsets, [(1, 3), (3, 7), (7, 9), (9, 10), (10, 14),
+                                  (14, 17), (18, 21)])
+
+    # Combining accents are attributed to the character before them.
+    (tokens, offsets) = tokenizer.tokenize_with_offsets(
+        u"une\u0301d wa\u0000nt")
+    self.assertAllEqual(tokens, ["un", "##ed", "want"])
+    self.assertAllEqual(offsets, [(0, 2), (2, 5), (6, 11)])
+
+  def test_basic_tokenizer_with_offsets(self):
+    for do_lower_case in (True, False):
+      tokenizer = tokenization.BasicTokenizer(do_lower_case=do_lower_case)
+      text = u" \tHeLLo!how  \n Are\u535AyoU?  "
+      self.assertAllEqual(
+          [token for (token, _, _) in tokenizer.tokenize_with_offsets(text)],
+          tokenizer.tokenize(text))
+      self.assertAllEqual(
+          [(start, end)
+           for (_, start, end) in tokenizer.tokenize_with_offsets(text)],
+          [(2, 7), (7, 8), (8, 11), (15, 18), (18, 19), (19, 22), (22, 23)])
+
+  def test_compiled_vocab(self):
+    vocab_tokens = [
+        "[UNK]", "[CLS]", "[SEP]", "want", "##want", "##ed", "wa", "un", "runn",
+        "##ing", ",", "want", u"\u535A", ""
+    ]
+    vocab_dir = tempfile.mkdtemp()
+    vocab_file = os.path.join(vocab_dir, "vocab.txt")
+    with open(vocab_file, "wb") as vocab_writer:
+      vocab_writer.write("".join([x + "\n" for x in vocab_tokens]).encode(
+          "utf-8"))
+    text_vocab = tokenization.load_vocab(vocab_file)
+
+    compiled_file = tokenization.compile_vocab(vocab_file)
+    self.assertEqual(compiled_file,
+                     tokenization.compiled_vocab_path(vocab_file))
+    vocab = tokenization.load_vocab(vocab_file)
+    self.assertIsInstance(vocab, tokenization.CompiledVocab)
+    self.assertEqual(list(vocab.items()), list(text_vocab.items()))
+    self.assertEqual(vocab["want"], 11)
+    self.assertNotIn("xyz", vocab)
+    self.assertEqual(vocab.inv_vocab[3], "want")
+
+    self.assertEqual(vocab.trie.longest_match(u"wanted", 0), (u"want", 4))
+    self.assertEqual(vocab.trie.longest_match(u"wanted", 4), (u"##ed", 6))
+    self.assertEqual(vocab.trie.longest_match(u"xyz", 0), (None, 0))
+
+    tokenizer = tokenization.FullTokenizer(vocab_file)
+    self.assertAllEqual(
+        tokenizer.tokenize(u"UNwant\u00E9d,running\u535Axyz"),
+        ["un", "##want", "##ed", ",", "runn", "##ing", u"\u535A", "[UNK]"])
+
+    # A compiled vocab that is older than the text file is ignored.
+    os.utime(compiled_file, (0, 0))
+    self.assertNotIsInstance(
+        tokenization.load_vocab(vocab_file), tokenization.CompiledVocab)
+
+  def test_truncated_pair_lengths(self):
+    for len_a in range(10):
+      for len_b in range(10):
+        for max_length in range(20):
+          tokens_a = list(range(len_a))
+          tokens_b = list(range(len_b))
+          while len(tokens_a) + len(tokens_b) > max_length:
+            if len(tokens_a) > len(tokens_b):
+              tokens_a.pop()
+            else:
+              tokens_b.pop()
+          self.assertEqual(
+              tokenization._truncated_pair_lengths(len_a, len_b, max_length),
+              (len(tokens_a), len(tokens_b)))
+
   def test_chinese(self):
     tokenizer = tokenization.BasicTokenizer()
 
@@ -66,6 +333,48 @@ class TokenizationTest(tf.test.TestCase):
         tokenizer.tokenize(u" \tHeLLo!how  \n Are yoU?  "),
         ["HeLLo", "!", "how", "Are", "yoU", "?"])
 
+  def test_basic_tokenizer_cleanup(self):
+    tokenizer = tokenization.BasicTokenizer(do_lower_case=True)
+
+    # Control characters are removed without splitting the word, U+2028 acts
+    # as whitespace, and U+1FEF becomes "`" (punctuation) under NFD.
+    self.assertAllEqual(
+        tokenizer.tokenize(u"ab\u0000c\uFFFDd\u2028e\u1FEFF\u00AD"),
+        [u"abcd", u"e", u"`", u"f"])
+    self.assertAllEqual(
+        tokenizer.tokenize(u"\u00C9t\u00E9\u535Ax"),
+        [u"ete", u"\u535A", u"x"])
+
+  def test_basic_tokenizer_ascii_fast_path(self):
+    for do_lower_case in (True, False):
+      tokenizer = tokenization.BasicTokenizer(do_lower_case=do_lower_case)
+      for text in [
+          u" \tHeLLo!how  \n Are yoU?  ", u"a\u0001b\u007fc\u000bd",
+          u"(1895-1943).", u"^$`~{}[]|\\", u""
+      ]:
+        self.assertAllEqual(
+            tokenizer._tokenize_ascii(text), tokenizer._tokenize_unicode(text))
+
+  def test_basic_tokenizer_hooks(self):
+    tokenizer = tokenization.BasicTokenizer(do_lower_case=True)
+    text = u" \tHeLLo!how  \n Are yoU?  \u00E9t\u00E9\u4E2D\x00\ufffd "
+    self.assertEqual(tokenizer._tokenize_with_hooks(text),
+                     tokenizer.tokenize(text))
+    self.assertEqual(tokenizer._run_split_on_punc(u"a,b"), ["a", ",", "b"])
+    self.assertEqual(tokenizer._run_strip_accents(u"\u00E9t\u00E9"), u"ete")
+    self.assertEqual(tokenizer._tokenize_chinese_chars(u"a\u4E2Db"),
+                     u"a \u4E2D b")
+    self.assertEqual(tokenizer._clean_text(u"a\x00\tb"), u"a b")
+
+    class NoPunctuationSplitTokenizer(tokenization.BasicTokenizer):
+
+      def _run_split_on_punc(self, text):
+        return [text]
+
+    self.assertAllEqual(
+        NoPunctuationSplitTokenizer().tokenize(u"Hello, world-wide!"),
+        ["hello,", "world-wide!"])
+
   def test_wordpiece_tokenizer(self):
     vocab_tokens = [
         "[UNK]", "[CLS]", "[SEP]", "want", "##want", "##ed", "wa", "un", "runn",
@@ -86,6 +395,67 @@ class TokenizationTest(tf.test.TestCase):
     self.assertAllEqual(
         tokenizer.tokenize("unwantedX running"), ["[UNK]", "runn", "##ing"])
 
+  def test_wordpiece_tokenizer_cache(self):
+    vocab_tokens = [
+        "[UNK]", "[CLS]", "[SEP]", "want", "##want", "##ed", "wa", "un", "runn",
+        "##ing"
+    ]
+
+    vocab = {}
+    for (i, token) in enumerate(vocab_tokens):
+      vocab[token] = i
+    tokenizer = tokenization.WordpieceTokenizer(vocab=vocab, cache_size=2)
+
+    self.assertAllEqual(
+        tokenizer.tokenize("unwanted unwantedX unwanted"),
+        ["un", "##want", "##ed", "[UNK]", "un", "##want", "##ed"])
+    self.assertEqual(tokenizer.cache_info(), (1, 2, 2, 2))
+
+    # "running" evicts the least recently used entry, "unwantedX".
+    self.assertAllEqual(tokenizer.tokenize("running"), ["runn", "##ing"])
+    self.assertAllEqual(
+        tokenizer.tokenize("unwanted"), ["un", "##want", "##ed"])
+    self.assertEqual(tokenizer.cache_info(), (2, 3, 2, 2))
+    self.assertAllEqual(tokenizer.tokenize("unwantedX"), ["[UNK]"])
+    self.assertEqual(tokenizer.cache_info(), (2, 4, 2, 2))
+
+    tokenizer.cache_clear()
+    self.assertEqual(tokenizer.cache_info(), (0, 0, 2, 0))
+    self.assertAllEqual(tokenizer.tokenize("running"), ["runn", "##ing"])
+    self.assertEqual(tokenizer.cache_info(), (0, 1, 2, 1))
+
+  def test_wordpiece_tokenizer_warm_cache(self):
+    vocab_tokens = [
+        "[UNK]", "[CLS]", "[SEP]", "want", "##want", "##ed", "wa", "un", "runn",
+        "##ing"
+    ]
+
+    vocab = {}
+    for (i, token) in enumerate(vocab_tokens):
+      vocab[token] = i
+    tokenizer = tokenization.WordpieceTokenizer(vocab=vocab, cache_size=100)
+
+    tokenizer.warm_cache(num_words=5)
+    self.assertEqual(tokenizer.cache_info().currsize, 5)
+    self.assertAllEqual(tokenizer.tokenize("want wa"), ["want", "wa"])
+    self.assertEqual(tokenizer.cache_info().hits, 2)
+    self.assertEqual(tokenizer.cache_info().misses, 0)
+
+  def test_wordpiece_trie(self):
+    vocab_tokens = [
+        "[UNK]", "[CLS]", "[SEP]", "want", "##want", "##ed", "wa", "un", "runn",
+        "##ing"
+    ]
+
+    trie = tokenization.WordpieceTrie(vocab_tokens)
+
+    self.assertEqual(trie.longest_match(u"wanted", 0), (u"want", 4))
+    self.assertEqual(trie.longest_match(u"wanted", 4), (u"##ed", 6))
+    self.assertEqual(trie.longest_match(u"unwanted", 2), (u"##want", 6))
+    self.assertEqual(trie.longest_match(u"wax", 0), (u"wa", 2))
+    self.assertEqual(trie.longest_match(u"xyz", 0), (None, 0))
+    self.assertEqual(trie.longest_match(u"running", 1), (None, 1))
+
   def test_convert_tokens_to_ids(self):
     vocab_tokens = [
         "[UNK]", "[CLS]", "[SEP]", "want", "##want", "##ed", "wa", "un", "runn",